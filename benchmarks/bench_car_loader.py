@@ -0,0 +1,104 @@
+# Бенчмарк загрузчика task5 на масштабированных car_sales.json и car_sales1.csv.
+# Замеряются: чтение JSON целиком (json.load) и потоково (iter_json_array), разбор CSV с кэшем разбора дат
+# и без него, загрузка строк CSV в базу пакетами разного размера (batch 1 - по строке на executemany,
+# как прежний построчный загрузчик) и загрузка JSON. Для каждого этапа выводится лучшее из repeat время
+# и число строк в секунду.
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_car_loader.py --scales 1 100 1000
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.bench_pipeline import DEFAULT_DATA_DIR, best_of, load_task_module, stage
+from benchmarks.generators import DEFAULT_SEED, generate
+from common.db import bulk_load, close_all, get_connection
+from common.json_records import iter_json_array
+
+DEFAULT_BATCH_SIZES = [1, 100, 1000, 10000]
+
+
+def parse_csv(lab4_5, csv_file):
+    with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return sum(1 for row in reader if lab4_5.parse_csv_row(row))
+
+
+# Один запуск всех этапов на файлах одного масштаба в отдельном рабочем каталоге
+def run_once(lab4_5, json_file, csv_file, batch_sizes, data_dir):
+    stages = {}
+    with stage(stages, 'json:load'):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            json_rows = len(json.load(f))
+    stages['json:load']['rows'] = json_rows
+    with stage(stages, 'json:stream', json_rows):
+        sum(1 for _ in iter_json_array(json_file))
+
+    cached = lab4_5.parse_launch_date
+    lab4_5.parse_launch_date = cached.__wrapped__
+    try:
+        with stage(stages, 'csv:parse без кэша дат'):
+            csv_rows = parse_csv(lab4_5, csv_file)
+    finally:
+        lab4_5.parse_launch_date = cached
+    stages['csv:parse без кэша дат']['rows'] = csv_rows
+    cached.cache_clear()
+    with stage(stages, 'csv:parse', csv_rows):
+        parse_csv(lab4_5, csv_file)
+
+    workdir = tempfile.mkdtemp(prefix='cars-', dir=data_dir)
+    try:
+        conn = get_connection(os.path.join(workdir, 'data_frame.db'))
+        cursor = conn.cursor()
+        lab4_5.create_tables(cursor)
+        with stage(stages, 'json:insert', json_rows):
+            with bulk_load(conn):
+                manufacturer_ids = lab4_5.load_cars_from_json(cursor, json_file)
+        for batch_size in batch_sizes:
+            name = f'csv:insert batch={batch_size}'
+            with bulk_load(conn):
+                for table in ('CarPerformance', 'CarDimensions', 'CarDetails'):
+                    cursor.execute(f"DELETE FROM {table}")
+            with stage(stages, name, csv_rows):
+                with bulk_load(conn):
+                    lab4_5.load_car_rows_from_csv(cursor, csv_file, manufacturer_ids, batch_size=batch_size)
+    finally:
+        close_all()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return stages
+
+
+def print_stages(scale, stages):
+    for name, measured in stages.items():
+        rows = measured['rows']
+        rate = f"{rows / measured['seconds']:.0f}" if rows and measured['seconds'] else ''
+        print(f"{scale:>8} {name:32} {measured['seconds']:>10.4f} {rows or '':>10} {rate:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк загрузчика task5')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100, 1000])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=DEFAULT_BATCH_SIZES)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='число запусков, берётся лучшее время этапа')
+    args = parser.parse_args()
+
+    lab4_5 = load_task_module('lab4_5', os.path.join('task5', 'lab4_5.py'))
+    print(f"{'масштаб':>8} {'этап':32} {'с':>10} {'строк':>10} {'строк/с':>12}")
+    for scale in args.scales:
+        json_file, csv_file = generate('task5', os.path.join(args.data_dir, str(scale), 'task5'), scale, args.seed)
+        stages = best_of(run_once(lab4_5, json_file, csv_file, args.batch_sizes, args.data_dir)
+                         for _ in range(args.repeat))
+        print_stages(scale, stages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Сверка и бенчмарк колоночного движка (common.column_engine) с SQL-путём на синтетических данных.
+# Для каждой задачи и масштаба база собирается теми же функциями, что и в bench_pipeline.py (загрузка,
+# индексы, ANALYZE), затем каждый запрос нагрузки выполняется в SQLite и в движке на тех же исходных
+# файлах. Результаты должны совпадать строка в строку (включая порядок и типы значений); расхождение
+# выводится и даёт ненулевой код возврата. Время SQL-пути - загрузка с индексами и запросы, время
+# движка - загрузка файлов в массивы и те же запросы.
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_column_engine.py --scales 1 10 100
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.bench_pipeline import BENCHMARKS, DEFAULT_DATA_DIR, TASKS
+from benchmarks.generators import DEFAULT_SEED, generate
+from common import column_engine
+from common.db import close_all, get_connection
+
+# Нагрузка задачи, её база и порядок исходных файлов для загрузчика движка (в generate - другой порядок)
+WORKLOADS = {
+    'task1': (['books'], 'books.db', lambda msgpack_file: (msgpack_file,)),
+    'task2': (['books_and_sales'], 'books_and_sales.db', lambda msgpack_file, pickle_file: (msgpack_file, pickle_file)),
+    'task3': (['songs'], 'songs_database.db', lambda text_file, msgpack_file: (msgpack_file, text_file)),
+    'task4': (['products'], 'fourth_task.db', lambda text_file, csv_file: (text_file, csv_file)),
+    'task5': (['cars'], 'data_frame.db', lambda json_file, csv_file: (json_file, csv_file)),
+}
+
+
+# Время сборки базы SQL-пути: загрузка (вместе с разбором файлов), индексы и применение изменений
+def build_seconds(stages):
+    names = ['load'] if 'load' in stages else ['parse', 'insert']
+    names += ['parse_changes', 'index', 'apply_changes']
+    return sum(stages[name]['seconds'] for name in names if name in stages)
+
+
+# Сверка одной задачи на одном масштабе; возвращает список (запрос, строк, с SQL, с движка, совпадение)
+def check_task(task, scale, data_dir, seed):
+    files = generate(task, os.path.join(data_dir, str(scale), task), scale, seed)
+    workloads, db_file, engine_files = WORKLOADS[task]
+    workdir = tempfile.mkdtemp(prefix=f'engine-{task}-{scale}-', dir=data_dir)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        stages = {}
+        BENCHMARKS[task](files, stages)
+        conn = get_connection(db_file)
+
+        results = []
+        for workload in workloads:
+            started = time.perf_counter()
+            tables = column_engine.LOADERS[workload](*engine_files(*files))
+            engine_load = time.perf_counter() - started
+            results.append((f'{workload}:load', None, build_seconds(stages), engine_load, True))
+            for name, (query_workload, sql, function) in column_engine.QUERIES.items():
+                if query_workload != workload:
+                    continue
+                started = time.perf_counter()
+                expected = conn.execute(sql).fetchall()
+                sql_seconds = time.perf_counter() - started
+                started = time.perf_counter()
+                actual = function(tables)
+                engine_seconds = time.perf_counter() - started
+                matches = _same_rows(expected, actual)
+                if not matches:
+                    _report_difference(task, scale, name, expected, actual)
+                results.append((name, len(expected), sql_seconds, engine_seconds, matches))
+        return results
+    finally:
+        close_all()
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# Строки совпадают, если равны значения и их типы (1 и 1.0 - разные результаты)
+def _same_rows(expected, actual):
+    if len(expected) != len(actual):
+        return False
+    for expected_row, actual_row in zip(expected, actual):
+        if tuple(expected_row) != tuple(actual_row):
+            return False
+        if [type(value) for value in expected_row] != [type(value) for value in actual_row]:
+            return False
+    return True
+
+
+def _report_difference(task, scale, name, expected, actual):
+    print(f"РАСХОЖДЕНИЕ {task} x{scale} {name}: строк SQL {len(expected)}, движка {len(actual)}", file=sys.stderr)
+    for n, (expected_row, actual_row) in enumerate(zip(expected, actual)):
+        if tuple(expected_row) != tuple(actual_row) or \
+                [type(value) for value in expected_row] != [type(value) for value in actual_row]:
+            print(f"  строка {n}: SQL {expected_row!r}", file=sys.stderr)
+            print(f"  строка {n}: движок {actual_row!r}", file=sys.stderr)
+            break
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Сверка и бенчмарк колоночного движка запросов')
+    parser.add_argument('--tasks', nargs='+', default=TASKS, choices=TASKS)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    failed = False
+    print(f"{'задача':>6} {'масштаб':>8} {'запрос':26} {'строк':>8} {'SQL, с':>10} {'движок, с':>10}  результат")
+    for scale in args.scales:
+        for task in args.tasks:
+            for name, rows, sql_seconds, engine_seconds, matches in check_task(task, scale, args.data_dir, args.seed):
+                failed = failed or not matches
+                print(f"{task:>6} {scale:>8} {name:26} {rows if rows is not None else '':>8} "
+                      f"{sql_seconds:>10.4f} {engine_seconds:>10.4f}  {'совпадает' if matches else 'РАСХОЖДЕНИЕ'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+# Сравнение загрузки subitem.pkl и item.msgpack в SQLite: прежний путь (values.tolist() / to_sql)
+# и столбцовый путь common.columnar. Для каждого варианта выводятся строки в секунду и пиковая память
+# (tracemalloc). Данные масштабируются повторением исходных файлов.
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_columnar_load.py [масштаб]
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import msgpack
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.columnar import load_dataframe_to_db, load_msgpack_columnar, read_pickle_frame
+from common.msgpack_records import book_row, load_msgpack_to_db
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+SUBITEM_FILE = os.path.join(ROOT, 'task1-2', 'subitem.pkl')
+ITEM_FILE = os.path.join(ROOT, 'task1-2', 'item.msgpack')
+
+SUBITEMS_DDL = "CREATE TABLE subitems (title TEXT REFERENCES books (title), price INTEGER, place TEXT, date TEXT)"
+BOOKS_DDL = '''CREATE TABLE books (title TEXT, author TEXT, genre TEXT, pages INTEGER, published_year INTEGER,
+                                   isbn TEXT, rating REAL, views INTEGER)'''
+
+
+def subitems_tolist(conn, df):
+    values = df[['title', 'price', 'place', 'date']].values.tolist()
+    conn.executemany("INSERT INTO subitems VALUES (?, ?, ?, ?)", values)
+    conn.commit()
+    return len(values)
+
+
+def subitems_columnar(conn, df):
+    return load_dataframe_to_db(conn, df, 'subitems', ['title', 'price', 'place', 'date'])
+
+
+def books_to_sql(conn, filename):
+    with open(filename, 'rb') as f:
+        frame = pd.DataFrame(msgpack.unpack(f, raw=False))
+    frame.to_sql('books', conn, if_exists='replace', index=False)
+    return len(frame)
+
+
+def books_rows(conn, filename):
+    return load_msgpack_to_db(conn, filename, "INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)", book_row)
+
+
+def books_columnar(conn, filename):
+    return load_msgpack_columnar(conn, filename, 'books')
+
+
+# Один замер: время без tracemalloc и пиковая память отдельным прогоном
+def measure(ddl, load, data):
+    results = []
+    for traced in (False, True):
+        conn = sqlite3.connect(':memory:')
+        conn.execute(ddl)
+        if traced:
+            tracemalloc.start()
+        started = time.perf_counter()
+        rows = load(conn, data)
+        elapsed = time.perf_counter() - started
+        if traced:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            results.append(peak)
+        else:
+            results.append(elapsed)
+        conn.close()
+    elapsed, peak = results
+    return rows, rows / elapsed, peak
+
+
+def main(scale):
+    sales = read_pickle_frame(SUBITEM_FILE)
+    sales = pd.concat([sales] * scale, ignore_index=True)
+
+    with open(ITEM_FILE, 'rb') as f:
+        books = msgpack.unpack(f, raw=False)
+    with tempfile.NamedTemporaryFile(suffix='.msgpack', delete=False) as tmp:
+        tmp.write(msgpack.packb(books * scale))
+        scaled_items = tmp.name
+
+    try:
+        cases = [
+            ('subitems: values.tolist()', SUBITEMS_DDL, subitems_tolist, sales),
+            ('subitems: столбцовый', SUBITEMS_DDL, subitems_columnar, sales),
+            ('books: DataFrame + to_sql', BOOKS_DDL, books_to_sql, scaled_items),
+            ('books: Unpacker по строкам', BOOKS_DDL, books_rows, scaled_items),
+            ('books: Unpacker по столбцам', BOOKS_DDL, books_columnar, scaled_items),
+        ]
+        print(f"{'вариант':32} {'строк':>10} {'строк/с':>12} {'пик памяти, МБ':>16}")
+        for name, ddl, load, data in cases:
+            rows, rate, peak = measure(ddl, load, data)
+            print(f"{name:32} {rows:>10} {rate:>12.0f} {peak / 2 ** 20:>16.1f}")
+    finally:
+        os.remove(scaled_items)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100)
@@ -0,0 +1,74 @@
+# Бенчмарк рабочей копии базы в памяти (common.db, LAB4_IN_MEMORY) против работы с файлом.
+# Для каждой задачи и масштаба база собирается функциями bench_pipeline.py дважды: с файлом на диске
+# и в памяти с контрольной точкой при close_all(); замеряются загрузка (load), построение индексов
+# (index), применение изменений (apply_changes, task4), запросы и экспорт (queries), закрытие
+# соединений с записью копии в файл (close) и всё вместе (total). Выводится лучшее из repeat время.
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_in_memory.py --scales 1 100 --tasks task3 task4
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import common.db
+from benchmarks.bench_pipeline import BENCHMARKS, DEFAULT_DATA_DIR, TASKS, best_of
+from benchmarks.generators import DEFAULT_SEED, generate
+from common.db import close_all
+
+MODES = {'disk': False, 'memory': True}
+REPORTED_STAGES = ['load', 'index', 'apply_changes', 'queries', 'close', 'total']
+
+
+# Одна сборка базы задачи в режиме in_memory; возвращает {этап: {'seconds': ...}}
+def run_mode(task, files, data_dir, in_memory):
+    workdir = tempfile.mkdtemp(prefix=f'memory-{task}-', dir=data_dir)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    common.db.IN_MEMORY_ENABLED = in_memory
+    stages = {}
+    try:
+        started = time.perf_counter()
+        BENCHMARKS[task](files, stages)
+        closing = time.perf_counter()
+        close_all()
+        finished = time.perf_counter()
+        stages['close'] = {'seconds': finished - closing}
+        stages['total'] = {'seconds': finished - started}
+    finally:
+        close_all(checkpoint=False)
+        common.db.IN_MEMORY_ENABLED = False
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+    queries = [measured['seconds'] for name, measured in stages.items() if name.startswith(('query:', 'export:'))]
+    stages['queries'] = {'seconds': sum(queries)}
+    return stages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк рабочей копии базы в памяти против файла на диске')
+    parser.add_argument('--tasks', nargs='+', default=TASKS, choices=TASKS)
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='число запусков, берётся лучшее время этапа')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"{'задача':>8} {'масштаб':>8} {'режим':>8} " + ' '.join(f"{name:>14}" for name in REPORTED_STAGES))
+    for scale in args.scales:
+        for task in args.tasks:
+            files = generate(task, os.path.join(args.data_dir, str(scale), task), scale, args.seed)
+            for mode, in_memory in MODES.items():
+                stages = best_of([run_mode(task, files, args.data_dir, in_memory) for _ in range(args.repeat)])
+                cells = [f"{stages[name]['seconds']:>14.4f}" if name in stages else f"{'-':>14}"
+                         for name in REPORTED_STAGES]
+                print(f"{task:>8} {scale:>8} {mode:>8} " + ' '.join(cells))
+
+
+if __name__ == '__main__':
+    main()
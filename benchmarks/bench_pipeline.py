@@ -0,0 +1,382 @@
+# Бенчмарк всех задач (lab4_1.py ... task5/lab4_5.py) на синтетических данных разного масштаба.
+# Для каждой задачи и масштаба замеряется время этапов: разбор исходных файлов (parse), загрузка
+# в базу (load = разбор + вставка; insert = load - parse), построение индексов (index), каждый
+# зарегистрированный в common.schema запрос (query:N) и каждый экспорт в JSON (export:<файл>).
+# Результаты сохраняются в JSON и могут сравниваться с сохранённым эталоном: этап считается
+# регрессией, если он медленнее эталона больше чем в threshold раз (и больше чем на min_seconds).
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_pipeline.py --scales 1 100
+#   python benchmarks/bench_pipeline.py --scales 1 100 --save-baseline
+#   python benchmarks/bench_pipeline.py --scales 1 100 --baseline benchmarks/baseline.json
+# Масштаб 10000 требует нескольких ГБ на диске (и памяти для subitem.pkl, который не пишется потоково).
+import argparse
+import contextlib
+import csv
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.generators import DEFAULT_SEED, generate
+from common.columnar import load_dataframe_to_db, read_pickle_frame
+from common.db import bulk_load, close_all, get_connection
+from common.json_export import write_json_rows
+from common.msgpack_records import BOOK_COLUMNS, book_row, iter_msgpack_items, load_msgpack_to_db, song_row
+from common.query_builder import COLUMNS, batch_aggregates
+from common.reports import extrema_query, report, run_reports
+from common.rollups import with_epoch_days
+from common.schema import QUERIES, create_indexes, drop_indexes
+from common.text_records import PRODUCT_FIELDS, SONG_FIELDS, iter_records
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'lab4_bench')
+# Источник отчётов по продажам из lab4_2.py
+BOOK_SALES_SOURCE = "books JOIN subitems ON books.title = subitems.title"
+
+TASKS = ['task1', 'task2', 'task3', 'task4', 'task5']
+
+
+# Загрузка скрипта задачи как модуля (скрипты task3-task5 не выполняют работу при импорте)
+def load_task_module(name, path):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Замер этапа: время записывается в stages[name], rows - число обработанных строк (если известно)
+@contextlib.contextmanager
+def stage(stages, name, rows=None):
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')) as devnull:
+        try:
+            yield
+        finally:
+            devnull.close()
+    stages[name] = {'seconds': time.perf_counter() - started, 'rows': rows}
+
+
+# Этапы insert = load - parse для задач, где загрузка включает разбор
+def add_insert_stage(stages):
+    load, parse = stages['load'], stages['parse']
+    stages['insert'] = {'seconds': max(load['seconds'] - parse['seconds'], 0.0), 'rows': parse['rows']}
+
+
+# Запросы нагрузки из common.schema (только SELECT), строки читаются полностью
+def run_workload_queries(stages, cursor, workload):
+    for n, query in enumerate(QUERIES[workload], 1):
+        if not query.lstrip().upper().startswith('SELECT'):
+            continue
+        with stage(stages, f'query:{n}'):
+            rows = cursor.execute(query).fetchall()
+        stages[f'query:{n}']['rows'] = len(rows)
+
+
+# lab4_1.py выполняет работу при импорте и читает файл по абсолютному пути,
+# поэтому его этапы повторяются здесь теми же функциями common
+def bench_task1(files, stages):
+    msgpack_file, = files
+    with stage(stages, 'parse'):
+        rows = sum(1 for item in iter_msgpack_items(msgpack_file) if book_row(item))
+    stages['parse']['rows'] = rows
+
+    conn = get_connection('books.db')
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS books (title TEXT, author TEXT, genre TEXT, pages INTEGER,
+                      published_year INTEGER, isbn TEXT, rating REAL, views INTEGER)''')
+    with stage(stages, 'load', rows):
+        with bulk_load(conn):
+            cursor.execute('DELETE FROM books')
+            drop_indexes(cursor, 'books')
+            load_msgpack_to_db(conn, msgpack_file, 'INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)', book_row)
+    add_insert_stage(stages)
+
+    with stage(stages, 'index', rows):
+        create_indexes(cursor, 'books')
+        conn.commit()
+    run_workload_queries(stages, cursor, 'books')
+
+    to_item = lambda row: dict(zip(BOOK_COLUMNS, row))
+    with stage(stages, 'export:top_books.json'):
+        cursor.execute('SELECT * FROM books ORDER BY views DESC LIMIT ?', (76,))
+        write_json_rows('top_books.json', cursor, to_item, indent=4)
+    with stage(stages, 'export:filtered_books.json'):
+        cursor.execute('SELECT * FROM books WHERE rating > 4 ORDER BY views DESC LIMIT ?', (76,))
+        write_json_rows('filtered_books.json', cursor, to_item, indent=4)
+
+
+# lab4_2.py также выполняет работу при импорте; этапы повторяются функциями common
+def bench_task2(files, stages):
+    msgpack_file, pickle_file = files
+    with stage(stages, 'parse'):
+        books = sum(1 for item in iter_msgpack_items(msgpack_file) if book_row(item))
+        sales = read_pickle_frame(pickle_file)
+    stages['parse']['rows'] = books + len(sales)
+
+    conn = get_connection('books_and_sales.db')
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS books (title TEXT, author TEXT, genre TEXT, pages INTEGER,
+                      published_year INTEGER, isbn TEXT, rating REAL, views INTEGER)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS subitems
+                      (title TEXT REFERENCES books (title), price INTEGER, place TEXT, date TEXT, date_day INTEGER)''')
+    # Разбор pickle входит в parse, поэтому load здесь - это разбор msgpack и вставка обеих таблиц
+    with stage(stages, 'insert', books + len(sales)):
+        with bulk_load(conn):
+            drop_indexes(cursor, 'books_and_sales')
+            load_msgpack_to_db(conn, msgpack_file, 'INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)', book_row)
+            load_dataframe_to_db(conn, with_epoch_days(sales), 'subitems',
+                                 ['title', 'price', 'place', 'date', 'date_day'])
+
+    with stage(stages, 'index', books + len(sales)):
+        create_indexes(cursor, 'books_and_sales')
+        conn.commit()
+    run_workload_queries(stages, cursor, 'books_and_sales')
+
+    with stage(stages, 'export:book_prices_and_places.json'):
+        cursor.execute("SELECT books.title, subitems.price, subitems.place FROM books "
+                       "JOIN subitems ON books.title = subitems.title "
+                       "ORDER BY books.rowid, subitems.price, subitems.place")
+        write_json_rows('book_prices_and_places.json', cursor,
+                        lambda row: {"Книга": row[0], "Цена": row[1], "Место продажи": row[2]}, indent=4)
+    with stage(stages, 'export:book_reports'):
+        results = run_reports(cursor, [
+            report('genre_stats', BOOK_SALES_SOURCE, ['AVG(subitems.price)', 'COUNT(subitems.price)'],
+                   group_by='books.genre'),
+        ])
+        write_json_rows('average_price_and_sales_by_genre.json', results['genre_stats'], indent=4)
+        write_json_rows('cheapest_and_most_expensive_books.json',
+                        cursor.execute(extrema_query(BOOK_SALES_SOURCE, 'subitems.price', 'books.title')).fetchall(),
+                        indent=4)
+
+
+def bench_task3(files, stages):
+    text_file, msgpack_file = files
+    lab4_3 = load_task_module('lab4_3', os.path.join('task3', 'lab4_3.py'))
+    with stage(stages, 'parse'):
+        rows = sum(1 for _ in iter_records(text_file, SONG_FIELDS))
+        rows += sum(1 for item in iter_msgpack_items(msgpack_file) if song_row(item))
+    stages['parse']['rows'] = rows
+
+    lab4_3.create_songs_table()
+    with stage(stages, 'load', rows):
+        lab4_3.populate_songs_from_msgpack(msgpack_file)
+        lab4_3.populate_songs_from_txt(text_file)
+    add_insert_stage(stages)
+
+    with stage(stages, 'index', rows):
+        lab4_3.build_indexes()
+    run_workload_queries(stages, get_connection(lab4_3.DB_FILE).cursor(), 'songs')
+
+    with stage(stages, 'export:first_sorted.json'):
+        lab4_3.export_first_sorted_to_json(66, 'duration_ms')
+    with stage(stages, 'export:aggregate_results.json'):
+        lab4_3.export_aggregate_results('tempo')
+    with stage(stages, 'export:categorical_frequency.json'):
+        lab4_3.export_categorical_frequency('genre')
+    with stage(stages, 'export:genre_frequency.json'):
+        lab4_3.export_genre_frequency()
+    with stage(stages, 'export:filtered_sorted.json'):
+        lab4_3.export_filtered_sorted_to_json(66, [('year', '>', 2000)], 'year')
+    # Пакет агрегатов отчётного задания: каждое числовое поле с набором фильтров по году
+    combinations = [(field, [('year', '>', year)]) for field, kind in COLUMNS['songs'].items() if kind == 'numeric'
+                    for year in range(1990, 2020)]
+    with stage(stages, 'query:batch_aggregates', len(combinations)):
+        batch_aggregates(get_connection(lab4_3.DB_FILE), 'songs', combinations)
+
+
+def bench_task4(files, stages):
+    text_file, csv_file = files
+    lab4_4 = load_task_module('lab4_4', os.path.join('task4', 'lab4_4.py'))
+    with stage(stages, 'parse'):
+        rows = sum(1 for _ in iter_records(text_file, PRODUCT_FIELDS))
+    stages['parse']['rows'] = rows
+    with stage(stages, 'parse_changes'):
+        changes = lab4_4.load_changes_from_csv(csv_file)
+    stages['parse_changes']['rows'] = len(changes)
+
+    conn = get_connection(lab4_4.database_file)
+    cursor = conn.cursor()
+    lab4_4.create_products_table(cursor)
+    with stage(stages, 'load', rows):
+        with bulk_load(conn):
+            drop_indexes(cursor, 'products')
+            lab4_4.insert_products_from_text(cursor, text_file)
+    add_insert_stage(stages)
+
+    with stage(stages, 'index', rows):
+        create_indexes(cursor, 'products')
+        conn.commit()
+    with stage(stages, 'apply_changes', len(changes)):
+        lab4_4.apply_changes_bulk(cursor, changes)
+        conn.commit()
+    run_workload_queries(stages, cursor, 'products')
+
+    with stage(stages, 'export:top_updated_products.json'):
+        write_json_rows('top_updated_products.json', lab4_4.query_top_updated_products(cursor), indent=4)
+    with stage(stages, 'export:price_analysis.json+quantity_analysis.json'):
+        price_analysis, quantity_analysis = lab4_4.query_category_analysis(cursor)
+        write_json_rows('price_analysis.json', lab4_4.round_stats(price_analysis), indent=4)
+        write_json_rows('quantity_analysis.json', lab4_4.round_stats(quantity_analysis), indent=4)
+    with stage(stages, 'export:custom_query_result.json'):
+        write_json_rows('custom_query_result.json', lab4_4.query_custom(cursor), indent=4)
+
+
+def bench_task5(files, stages):
+    json_file, csv_file = files
+    lab4_5 = load_task_module('lab4_5', os.path.join('task5', 'lab4_5.py'))
+    with stage(stages, 'parse'):
+        with open(json_file, 'r', encoding='utf-8') as f:
+            rows = len(json.load(f))
+        with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader)
+            rows += sum(1 for row in reader if lab4_5.parse_csv_row(row))
+    stages['parse']['rows'] = rows
+
+    conn = get_connection('data_frame.db')
+    cursor = conn.cursor()
+    lab4_5.create_tables(cursor)
+    with stage(stages, 'load', rows):
+        with bulk_load(conn):
+            drop_indexes(cursor, 'cars')
+            lab4_5.load_data_to_db(cursor, json_file, csv_file)
+    add_insert_stage(stages)
+
+    with stage(stages, 'index', rows):
+        create_indexes(cursor, 'cars')
+        conn.commit()
+    run_workload_queries(stages, cursor, 'cars')
+
+    with stage(stages, 'export:result1-6'):
+        lab4_5.save_results_to_json(*lab4_5.execute_queries(cursor))
+
+
+BENCHMARKS = {
+    'task1': bench_task1,
+    'task2': bench_task2,
+    'task3': bench_task3,
+    'task4': bench_task4,
+    'task5': bench_task5,
+}
+
+
+# Запуск одной задачи на одном масштабе в отдельном рабочем каталоге (база и JSON создаются в нём,
+# каталог удаляется после замера)
+def run_task(task, scale, data_dir, seed):
+    files = generate(task, os.path.join(data_dir, str(scale), task), scale, seed)
+    workdir = tempfile.mkdtemp(prefix=f'{task}-{scale}-', dir=data_dir)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    stages = {}
+    try:
+        with stage(stages, 'total'):
+            BENCHMARKS[task](files, stages)
+    finally:
+        close_all()
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+    stages['total'] = stages.pop('total')
+    return stages
+
+
+# Лучшее время каждого этапа из repeat запусков: минимум меньше всего зависит от фоновой нагрузки
+def best_of(runs):
+    best = {}
+    for stages in runs:
+        for name, measured in stages.items():
+            if name not in best or measured['seconds'] < best[name]['seconds']:
+                best[name] = measured
+    return best
+
+
+def run_benchmarks(tasks, scales, data_dir=DEFAULT_DATA_DIR, seed=DEFAULT_SEED, repeat=3):
+    results = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'runs': {},
+    }
+    for scale in scales:
+        for task in tasks:
+            stages = best_of(run_task(task, scale, data_dir, seed) for _ in range(repeat))
+            results['runs'].setdefault(task, {})[str(scale)] = stages
+            print(f"{task} x{scale}: {stages['total']['seconds']:.3f} с")
+    return results
+
+
+# Сравнение с эталоном: список (задача, масштаб, этап, эталон, текущее, отношение) для регрессий
+def compare_results(results, baseline, threshold=1.25, min_seconds=0.005):
+    regressions = []
+    for task, scales in results['runs'].items():
+        for scale, stages in scales.items():
+            reference = baseline.get('runs', {}).get(task, {}).get(scale, {})
+            for name, measured in stages.items():
+                if name not in reference:
+                    continue
+                before, after = reference[name]['seconds'], measured['seconds']
+                if after > before * threshold and after - before > min_seconds:
+                    regressions.append((task, scale, name, before, after, after / before if before else float('inf')))
+    return regressions
+
+
+def print_results(results):
+    print(f"{'задача':8} {'масштаб':>8} {'этап':48} {'с':>10} {'строк':>10} {'строк/с':>12}")
+    for task, scales in results['runs'].items():
+        for scale, stages in scales.items():
+            for name, measured in stages.items():
+                rows = measured['rows']
+                rate = f"{rows / measured['seconds']:.0f}" if rows and measured['seconds'] else ''
+                print(f"{task:8} {scale:>8} {name:48} {measured['seconds']:>10.4f} {rows or '':>10} {rate:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк задач lab4 на синтетических данных')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--tasks', nargs='+', choices=TASKS, default=TASKS)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='число запусков, берётся лучшее время этапа')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='сохранить результаты как эталон')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    results = run_benchmarks(args.tasks, args.scales, args.data_dir, args.seed, args.repeat)
+    print_results(results)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Эталон сохранён: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare_results(results, baseline, args.threshold)
+    for task, scale, name, before, after, ratio in regressions:
+        print(f"[РЕГРЕССИЯ] {task} x{scale} {name}: {before:.4f} с -> {after:.4f} с (x{ratio:.2f})")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Бенчмарк запросов продаж за период (common.rollups) на синтетических данных. Для каждого масштаба база
+# books_and_sales собирается функциями bench_pipeline.py, затем для окон разной длины (от начала продаж)
+# замеряется средняя цена по жанрам тремя способами: полный просмотр таблицы с разбором текстовых дат
+# (как до появления date_day), чтение subitems по индексу на date_day и чтение сводок по дням, неделям
+# и месяцам. Отдельно замеряется пересчёт сводок (rollup_build). Выводится лучшее из repeat время.
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_rollups.py --scales 1 100 1000 --windows 7 30 365 3650
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.bench_pipeline import BENCHMARKS, DEFAULT_DATA_DIR
+from benchmarks.generators import DEFAULT_SEED, generate
+from common.db import close_all, get_connection
+from common.rollups import average_price_by_range, drop_rollups, epoch_day, rebuild_rollups
+
+
+def best_seconds(repeat, run):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+# Средняя цена по жанрам за [start, end] без date_day: каждая строка читается, её дата разбирается заново
+def scan_text_dates(cursor, start, end):
+    totals = {}
+    for genre, price, text in cursor.execute("SELECT books.genre, subitems.price, subitems.date FROM books "
+                                             "JOIN subitems ON books.title = subitems.title"):
+        day = epoch_day.__wrapped__(text)
+        if day is not None and start <= day <= end and price is not None:
+            count, total = totals.get(genre, (0, 0))
+            totals[genre] = (count + 1, total + price)
+    return sorted((genre, total * 1.0 / count) for genre, (count, total) in totals.items())
+
+
+# Один масштаб; возвращает строки (этап, строк в результате, с)
+def check_scale(scale, data_dir, seed, windows, repeat):
+    files = generate('task2', os.path.join(data_dir, str(scale), 'task2'), scale, seed)
+    workdir = tempfile.mkdtemp(prefix=f'rollups-{scale}-', dir=data_dir)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        BENCHMARKS['task2'](files, {})
+        conn = get_connection('books_and_sales.db')
+        cursor = conn.cursor()
+        first = cursor.execute("SELECT MIN(date_day) FROM subitems").fetchone()[0]
+        rows = cursor.execute("SELECT COUNT(*) FROM subitems").fetchone()[0]
+
+        drop_rollups(cursor)
+        timings = {}
+        for window in windows:
+            end = first + window - 1
+            timings[f'text:{window}'] = best_seconds(repeat, lambda: scan_text_dates(cursor, first, end))
+            timings[f'index:{window}'] = best_seconds(repeat, lambda: average_price_by_range(cursor, first, end))
+
+        started = time.perf_counter()
+        rebuild_rollups(cursor)
+        conn.commit()
+        results = [('rollup_build', rows, time.perf_counter() - started)]
+
+        for window in windows:
+            end = first + window - 1
+            timings[f'rollups:{window}'] = best_seconds(repeat, lambda: average_price_by_range(cursor, first, end))
+            for method in ('text', 'index', 'rollups'):
+                seconds, found = timings[f'{method}:{window}']
+                results.append((f'{method}:{window}', len(found), seconds))
+        return results
+    finally:
+        close_all()
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк запросов продаж за период: сводки против таблицы')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--windows', type=int, nargs='+', default=[7, 30, 365, 3650], help='длины окон в днях')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='число запусков, берётся лучшее время запроса')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"{'масштаб':>8} {'этап':24} {'строк':>10} {'с':>10}")
+    for scale in args.scales:
+        for stage_name, rows, seconds in check_scale(scale, args.data_dir, args.seed, args.windows, args.repeat):
+            print(f"{scale:>8} {stage_name:24} {rows:>10} {seconds:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
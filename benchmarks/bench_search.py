@@ -0,0 +1,96 @@
+# Бенчмарк полнотекстового поиска (common.search) против LIKE '%...%' на синтетических данных.
+# Для каждой задачи и масштаба база собирается функциями bench_pipeline.py, затем строится индекс FTS5
+# и для каждого слова замеряются: поиск по индексу (префиксный, лучшие limit по bm25) и полный просмотр
+# таблицы с LIKE '%слово%' по тем же столбцам (без индекса ранжировать можно только все совпадения,
+# поэтому строки LIKE читаются полностью). Для каждого запроса выводится лучшее из repeat время.
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_search.py --scales 1 100 1000
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.bench_pipeline import BENCHMARKS, DEFAULT_DATA_DIR
+from benchmarks.generators import DEFAULT_SEED, generate
+from common.db import close_all, get_connection
+from common.search import DEFAULT_LIMIT, SEARCH_INDEXES, create_search_index, search
+
+# Задача, база и слова запросов каждого индекса. LIKE в SQLite не различает регистр только у латиницы,
+# поэтому слова для books взяты в том регистре, в котором они встречаются в названиях
+WORKLOADS = {
+    'books': ('task1', 'books.db', ['мир', 'ведьм', 'мух']),
+    'songs': ('task3', 'songs_database.db', ['love', 'dra', 'tonight']),
+    'products': ('task4', 'fourth_task.db', ['plum', 'ama', 'sunscreen']),
+}
+
+
+def best_seconds(repeat, run):
+    best, result = None, None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = run()
+        seconds = time.perf_counter() - started
+        best = seconds if best is None else min(best, seconds)
+    return best, result
+
+
+# Один индекс на одном масштабе; возвращает строки (этап, строк, с)
+def check_index(name, scale, data_dir, seed, limit, repeat):
+    task, db_file, words = WORKLOADS[name]
+    files = generate(task, os.path.join(data_dir, str(scale), task), scale, seed)
+    workdir = tempfile.mkdtemp(prefix=f'search-{name}-{scale}-', dir=data_dir)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        BENCHMARKS[task](files, {})
+        conn = get_connection(db_file)
+        cursor = conn.cursor()
+        spec = SEARCH_INDEXES[name]
+        rows = cursor.execute(f"SELECT COUNT(*) FROM {spec['table']}").fetchone()[0]
+
+        started = time.perf_counter()
+        create_search_index(cursor, name)
+        conn.commit()
+        results = [('index', rows, time.perf_counter() - started)]
+
+        like = ' OR '.join(f"{column} LIKE ?" for column in spec['columns'])
+        like_sql = f"SELECT {', '.join(spec['columns'])} FROM {spec['table']} WHERE {like}"
+        for word in words:
+            seconds, found = best_seconds(repeat, lambda: search(cursor, name, word, limit))
+            results.append((f'fts:{word}', len(found), seconds))
+            pattern = [f'%{word}%'] * len(spec['columns'])
+            seconds, found = best_seconds(repeat, lambda: cursor.execute(like_sql, pattern).fetchall())
+            results.append((f'like:{word}', len(found), seconds))
+        return results
+    finally:
+        close_all()
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк полнотекстового поиска FTS5 против LIKE')
+    parser.add_argument('--indexes', nargs='+', default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=3, help='число запусков, берётся лучшее время запроса')
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"{'индекс':>8} {'масштаб':>8} {'этап':24} {'строк':>10} {'с':>10}")
+    for scale in args.scales:
+        for name in args.indexes:
+            for stage_name, rows, seconds in check_index(name, scale, args.data_dir, args.seed, args.limit,
+                                                         args.repeat):
+                print(f"{name:>8} {scale:>8} {stage_name:24} {rows:>10} {seconds:>10.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Бенчмарк потоковых скетчей (common.sketches) против точных перцентилей SQL на синтетических данных.
+# Для каждой нагрузки и масштаба база собирается функциями bench_pipeline.py, затем замеряются:
+# сборка скетчей одним проходом по таблице (столько же стоит их обновление во время загрузки),
+# точные перцентили DEFAULT_FRACTIONS по группам (оконные функции с сортировкой всей таблицы),
+# чтение перцентилей из скетчей и фактическая ошибка ранга и числа различных значений (check_sketches).
+#
+# Запуск из корня репозитория:
+#   python benchmarks/bench_sketches.py --scales 1 100 1000
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.bench_pipeline import BENCHMARKS, DEFAULT_DATA_DIR
+from benchmarks.generators import DEFAULT_SEED, generate
+from common.db import close_all, get_connection
+from common.sketches import DEFAULT_FRACTIONS, check_sketches, rebuild_sketches, sketch_quantiles
+
+# Задача, база, измерение и точный запрос (группа, значение) каждой нагрузки
+WORKLOADS = {
+    'books_and_sales': ('task2', 'books_and_sales.db', 'genre',
+                        "SELECT books.genre AS g, subitems.price AS v FROM books JOIN subitems "
+                        "ON books.title = subitems.title WHERE subitems.price IS NOT NULL"),
+    'songs': ('task3', 'songs_database.db', 'genre', "SELECT genre AS g, duration_ms AS v FROM songs "
+                                                     "WHERE duration_ms IS NOT NULL"),
+}
+
+
+# Точные перцентили: номер строки в группе по возрастанию значения и размер группы
+def exact_quantiles(cursor, source):
+    columns = ', '.join(f"MIN(CASE WHEN r >= {fraction} * n THEN v END)" for fraction in DEFAULT_FRACTIONS)
+    return cursor.execute(f"SELECT g, COUNT(*), {columns} FROM (SELECT g, v, "
+                          f"ROW_NUMBER() OVER (PARTITION BY g ORDER BY v) AS r, COUNT(*) OVER (PARTITION BY g) AS n "
+                          f"FROM ({source})) GROUP BY g ORDER BY g").fetchall()
+
+
+# Одна нагрузка на одном масштабе; возвращает строки (этап, групп, с)
+def check_workload(name, scale, data_dir, seed):
+    task, db_file, dimension, source = WORKLOADS[name]
+    files = generate(task, os.path.join(data_dir, str(scale), task), scale, seed)
+    workdir = tempfile.mkdtemp(prefix=f'sketches-{name}-{scale}-', dir=data_dir)
+    previous = os.getcwd()
+    os.chdir(workdir)
+    try:
+        BENCHMARKS[task](files, {})
+        conn = get_connection(db_file)
+        cursor = conn.cursor()
+        rows = cursor.execute(f"SELECT COUNT(*) FROM ({source})").fetchone()[0]
+
+        started = time.perf_counter()
+        rebuild_sketches(cursor, name)
+        conn.commit()
+        results = [('sketch_build', rows, time.perf_counter() - started)]
+
+        started = time.perf_counter()
+        groups = exact_quantiles(cursor, source)
+        results.append(('exact_quantiles', len(groups), time.perf_counter() - started))
+        started = time.perf_counter()
+        groups = sketch_quantiles(cursor, name, dimension)
+        results.append(('sketch_quantiles', len(groups), time.perf_counter() - started))
+
+        errors = check_sketches(cursor, name)
+        results.append(('rank_error', len(groups), errors[dimension][0]))
+        results.append(('distinct_error', len(groups), errors[dimension][1]))
+        return results
+    finally:
+        close_all()
+        os.chdir(previous)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Бенчмарк скетчей квантилей и различных значений против точного SQL')
+    parser.add_argument('--workloads', nargs='+', default=list(WORKLOADS), choices=list(WORKLOADS))
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 100])
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR)
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    print(f"{'нагрузка':>16} {'масштаб':>8} {'этап':18} {'строк/групп':>12} {'с / ошибка':>12}")
+    for scale in args.scales:
+        for name in args.workloads:
+            for stage_name, count, measured in check_workload(name, scale, args.data_dir, args.seed):
+                print(f"{name:>16} {scale:>8} {stage_name:18} {count:>12} {measured:>12.4f}")
+
+
+if __name__ == '__main__':
+    main()
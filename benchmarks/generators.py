@@ -0,0 +1,201 @@
+# Генераторы синтетических данных для бенчмарков: каждый исходный файл репозитория масштабируется
+# в scale раз с сохранением формата, набора полей и распределений значений.
+#
+# Запись с номером n строится по записи-образцу n % len(образцы): набор полей (в том числе пропуски)
+# берётся из образца, значения каждого поля выбираются случайно из значений этого поля во всех образцах,
+# поэтому распределения по полям совпадают с исходными. Ключевые поля (название книги, имя товара,
+# производитель) получают суффикс номера копии, чтобы связи между файлами (books-subitems,
+# products-_update_data.csv) и их селективность сохранялись на любом масштабе.
+import csv
+import json
+import os
+import pickle
+import random
+
+import msgpack
+
+from common.msgpack_records import iter_msgpack_items
+from common.text_records import RECORD_SEPARATOR, iter_lines
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Исходные файлы: имя -> путь к образцу в репозитории
+FIXTURES = {
+    'item.msgpack': os.path.join(ROOT, 'task1-2', 'item.msgpack'),
+    'subitem.pkl': os.path.join(ROOT, 'task1-2', 'subitem.pkl'),
+    '_part_1.text': os.path.join(ROOT, 'task3', '_part_1.text'),
+    '_part_2.msgpack': os.path.join(ROOT, 'task3', '_part_2.msgpack'),
+    '_product_data.text': os.path.join(ROOT, 'task4', '_product_data.text'),
+    '_update_data.csv': os.path.join(ROOT, 'task4', '_update_data.csv'),
+    'car_sales.json': os.path.join(ROOT, 'task5', 'car_sales.json'),
+    'car_sales1.csv': os.path.join(ROOT, 'task5', 'car_sales1.csv'),
+}
+
+DEFAULT_SEED = 66
+
+
+# Ключ n-й копии: исходное значение для копии 0, иначе значение с суффиксом
+def scaled_key(value, copy):
+    if copy == 0 or value is None or value == '':
+        return value
+    return f"{value} #{copy}"
+
+
+# Значения каждого поля во всех образцах
+def field_pools(samples):
+    pools = {}
+    for sample in samples:
+        for key, value in sample.items():
+            pools.setdefault(key, []).append(value)
+    return pools
+
+
+# Масштабированные записи: scale копий образцов, ключевые поля с суффиксом копии,
+# остальные поля выбираются из значений поля в образцах. Поля из одной группы groups
+# (например, метод изменения и его параметр) берутся вместе из одного случайного образца
+def scale_records(samples, scale, keys=(), groups=(), seed=DEFAULT_SEED):
+    rng = random.Random(seed)
+    pools = field_pools(samples)
+    grouped = {key: group for group in groups for key in group}
+    for copy in range(scale):
+        for sample in samples:
+            record = {}
+            donors = {group: rng.choice(samples) for group in groups} if copy else {}
+            for key in sample:
+                if key in keys:
+                    record[key] = scaled_key(sample[key], copy)
+                elif copy == 0:
+                    record[key] = sample[key]
+                elif key in grouped:
+                    record[key] = donors[grouped[key]].get(key, sample[key])
+                else:
+                    record[key] = rng.choice(pools[key])
+            yield record
+
+
+# Чтение текстового файла key::value в словари строк без преобразования типов
+def read_text_samples(filename):
+    samples = []
+    record = {}
+    for line in iter_lines(filename):
+        line = line.strip()
+        if line == RECORD_SEPARATOR:
+            if record:
+                samples.append(record)
+            record = {}
+        elif '::' in line:
+            key, value = line.split('::', 1)
+            record[key] = value
+    if record:
+        samples.append(record)
+    return samples
+
+
+def write_text_records(filename, records):
+    with open(filename, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.writelines(f"{key}::{value}\n" for key, value in record.items())
+            f.write(RECORD_SEPARATOR + '\n')
+
+
+# msgpack-массив пишется потоково: заголовок массива, затем элементы по одному
+def write_msgpack_records(filename, records, count):
+    packer = msgpack.Packer()
+    with open(filename, 'wb') as f:
+        f.write(packer.pack_array_header(count))
+        for record in records:
+            f.write(packer.pack(record))
+
+
+# pickle нельзя писать потоково, поэтому список продаж целиком находится в памяти
+def write_pickle_records(filename, records):
+    with open(filename, 'wb') as f:
+        pickle.dump(list(records), f)
+
+
+# JSON-массив пишется потоково, по одному объекту
+def write_json_records(filename, records):
+    with open(filename, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for n, record in enumerate(records):
+            if n:
+                f.write(', ')
+            f.write(json.dumps(record, ensure_ascii=False))
+        f.write(']')
+
+
+def read_csv_samples(filename, delimiter=','):
+    with open(filename, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f, delimiter=delimiter)
+        return reader.fieldnames, list(reader)
+
+
+def write_csv_records(filename, fieldnames, records, delimiter=','):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=delimiter)
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def generate_books(directory, scale, seed=DEFAULT_SEED):
+    samples = list(iter_msgpack_items(FIXTURES['item.msgpack']))
+    write_msgpack_records(os.path.join(directory, 'item.msgpack'),
+                          scale_records(samples, scale, keys=('title',), seed=seed), len(samples) * scale)
+
+
+def generate_sales(directory, scale, seed=DEFAULT_SEED):
+    with open(FIXTURES['subitem.pkl'], 'rb') as f:
+        samples = pickle.load(f)
+    write_pickle_records(os.path.join(directory, 'subitem.pkl'),
+                         scale_records(samples, scale, keys=('title',), seed=seed))
+
+
+def generate_songs(directory, scale, seed=DEFAULT_SEED):
+    write_text_records(os.path.join(directory, '_part_1.text'),
+                       scale_records(read_text_samples(FIXTURES['_part_1.text']), scale, keys=('song',), seed=seed))
+    samples = list(iter_msgpack_items(FIXTURES['_part_2.msgpack']))
+    write_msgpack_records(os.path.join(directory, '_part_2.msgpack'),
+                          scale_records(samples, scale, keys=('song',), seed=seed), len(samples) * scale)
+
+
+def generate_products(directory, scale, seed=DEFAULT_SEED):
+    write_text_records(os.path.join(directory, '_product_data.text'),
+                       scale_records(read_text_samples(FIXTURES['_product_data.text']), scale, keys=('name',),
+                                     seed=seed))
+    fieldnames, samples = read_csv_samples(FIXTURES['_update_data.csv'], delimiter=';')
+    write_csv_records(os.path.join(directory, '_update_data.csv'), fieldnames,
+                      scale_records(samples, scale, keys=('name',), groups=[('method', 'param')], seed=seed),
+                      delimiter=';')
+
+
+def generate_cars(directory, scale, seed=DEFAULT_SEED):
+    with open(FIXTURES['car_sales.json'], 'r', encoding='utf-8') as f:
+        samples = json.load(f)
+    write_json_records(os.path.join(directory, 'car_sales.json'),
+                       scale_records(samples, scale, keys=('Manufacturer', 'Model'), seed=seed))
+    fieldnames, samples = read_csv_samples(FIXTURES['car_sales1.csv'])
+    write_csv_records(os.path.join(directory, 'car_sales1.csv'), fieldnames,
+                      scale_records(samples, scale, seed=seed))
+
+
+# Генераторы по задачам: задача -> (функции генерации, создаваемые файлы)
+GENERATORS = {
+    'task1': ([generate_books], ['item.msgpack']),
+    'task2': ([generate_books, generate_sales], ['item.msgpack', 'subitem.pkl']),
+    'task3': ([generate_songs], ['_part_1.text', '_part_2.msgpack']),
+    'task4': ([generate_products], ['_product_data.text', '_update_data.csv']),
+    'task5': ([generate_cars], ['car_sales.json', 'car_sales1.csv']),
+}
+
+
+# Генерация данных задачи в каталог. Данные, уже созданные прошлым запуском с тем же масштабом
+# и seed, не пересоздаются: о завершённой генерации говорит файл-метка
+def generate(task, directory, scale, seed=DEFAULT_SEED):
+    os.makedirs(directory, exist_ok=True)
+    functions, files = GENERATORS[task]
+    marker = os.path.join(directory, f'.{task}-{scale}-{seed}.done')
+    if not os.path.exists(marker):
+        for function in functions:
+            function(directory, scale, seed)
+        open(marker, 'w').close()
+    return [os.path.join(directory, name) for name in files]
@@ -0,0 +1 @@
+# Общие модули для скриптов lab4_1.py, lab4_2.py и task3-task5
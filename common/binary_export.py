@@ -0,0 +1,332 @@
+import gzip
+import json
+import os
+import zipfile
+import zlib
+
+import msgpack
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Компактные колоночные форматы вывода рядом с JSON (или вместо него):
+#   msgpack - файл <имя>.cols.msgpack: заголовок с именами столбцов, затем группы строк, у каждой - типы
+#             столбцов и (возможно сжатое) тело; числовые столбцы хранятся как массивы int64/float64
+#             (little-endian), строки - массивом строк
+#   npz     - файл <имя>.npz (zip-архив .npy, как у numpy.savez_compressed): по массиву на столбец каждой
+#             группы строк и заголовок с типами столбцов групп в __schema__
+# Строки пишутся группами по ROW_GROUP_SIZE, поэтому память при записи не зависит от числа строк.
+# Форматы выбираются переменной окружения LAB4_EXPORT_FORMAT через '+', например json+msgpack
+# (по умолчанию json), сжатие тела msgpack - LAB4_EXPORT_COMPRESSION=<gzip|zlib|zstd>[:уровень].
+# npz всегда сжимается deflate, уровень в numpy не настраивается
+FORMAT_NAME = 'lab4-columns'
+FORMAT_VERSION = 2
+FORMATS = ('json', 'msgpack', 'npz')
+COMPRESSIONS = ('gzip', 'zlib', 'zstd')
+EXTENSIONS = {'msgpack': '.cols.msgpack', 'npz': '.npz'}
+ROW_GROUP_SIZE = 65536
+
+DEFAULT_FORMATS = os.environ.get('LAB4_EXPORT_FORMAT', 'json')
+DEFAULT_COMPRESSION = os.environ.get('LAB4_EXPORT_COMPRESSION')
+
+_INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+
+# Разбор списка форматов вида "json+msgpack"
+def parse_formats(value=None):
+    formats = [name.strip() for name in (value or DEFAULT_FORMATS).split('+') if name.strip()]
+    for name in formats:
+        if name not in FORMATS:
+            raise ValueError(f"Неизвестный формат вывода: {name}")
+    return formats
+
+
+# Разбор сжатия вида "gzip:9" -> ('gzip', 9); None - без сжатия
+def parse_compression(value=None):
+    value = value if value is not None else DEFAULT_COMPRESSION
+    if not value or value == 'none':
+        return None, None
+    name, _, level = value.partition(':')
+    if name not in COMPRESSIONS:
+        raise ValueError(f"Неизвестное сжатие: {name}")
+    if name == 'zstd' and zstandard is None:
+        raise ValueError("Для сжатия zstd нужен пакет zstandard")
+    return name, int(level) if level else None
+
+
+def binary_filename(filename, fmt):
+    stem = filename[:-len('.json')] if filename.endswith('.json') else filename
+    return stem + EXTENSIONS[fmt]
+
+
+# Накопление элементов вывода по столбцам: у словарей столбцы - ключи первого элемента,
+# у списков и кортежей - column_0, column_1, ...
+def new_columns():
+    return {'names': None, 'kind': None, 'values': [], 'rows': 0}
+
+
+# Очистка накопленных значений после записи группы строк (имена столбцов сохраняются)
+def clear_columns(columns):
+    columns['values'] = [[] for _ in columns['names'] or []]
+    columns['rows'] = 0
+
+
+# Значения словаря берутся по именам столбцов, а не по порядку ключей; элемент с другим набором
+# ключей (или список другой длины) не может лечь в те же столбцы и отклоняется
+def add_item(columns, item):
+    if columns['names'] is None:
+        if isinstance(item, dict):
+            columns['kind'] = 'dict'
+            columns['names'] = list(item)
+        else:
+            columns['kind'] = 'list'
+            columns['names'] = [f"column_{n}" for n in range(len(item))]
+        columns['values'] = [[] for _ in columns['names']]
+    names = columns['names']
+    if columns['kind'] == 'dict':
+        if not isinstance(item, dict) or len(item) != len(names) or any(name not in item for name in names):
+            raise ValueError(f"Элемент {item!r} не совпадает со столбцами {names}")
+        values = [item[name] for name in names]
+    else:
+        if isinstance(item, dict) or len(item) != len(names):
+            raise ValueError(f"Элемент {item!r} не совпадает со столбцами {names}")
+        values = item
+    for column, value in zip(columns['values'], values):
+        column.append(value)
+    columns['rows'] += 1
+
+
+# Тип столбца по его значениям: int64, float64, bool, str или object (смешанные значения, вложенные структуры).
+# Столбец из целых и дробных чисел - object, чтобы целые читались обратно целыми, как в JSON.
+# None допускается в любом типе и отмечается в маске пропусков
+def column_type(values):
+    kinds = {type(value) for value in values if value is not None}
+    if not kinds:
+        return 'object'
+    if kinds == {bool}:
+        return 'bool'
+    if kinds == {int}:
+        present = [value for value in values if value is not None]
+        if _INT64_RANGE[0] <= min(present) and max(present) <= _INT64_RANGE[1]:
+            return 'int64'
+        return 'object'
+    if kinds == {float}:
+        return 'float64'
+    if kinds == {str}:
+        return 'str'
+    return 'object'
+
+
+_DTYPES = {'int64': '<i8', 'float64': '<f8', 'bool': '|u1'}
+
+
+# Массив numpy столбца (пропуски заменены нулём или пустой строкой) и маска пропусков (None, если их нет)
+def column_array(values, kind):
+    nulls = [value is None for value in values]
+    mask = np.array(nulls, dtype=np.bool_) if any(nulls) else None
+    if kind in _DTYPES:
+        filled = [0 if value is None else value for value in values] if mask is not None else values
+        return np.array(filled, dtype=_DTYPES[kind]), mask
+    if kind == 'str':
+        return np.array(['' if value is None else value for value in values], dtype=np.str_), mask
+    # object хранится в npz строками JSON, чтобы файл читался без pickle
+    return np.array([json.dumps(value, ensure_ascii=False) for value in values], dtype=np.str_), None
+
+
+def _header(columns, compression=None, level=None):
+    return {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'items': columns['kind'] or 'dict',
+        'names': columns['names'] or [],
+        'compression': compression,
+        'level': level,
+    }
+
+
+def _compress(data, compression, level):
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+    if compression == 'zlib':
+        return zlib.compress(data, -1 if level is None else level)
+    if compression == 'zstd':
+        return zstandard.ZstdCompressor(level=3 if level is None else level).compress(data)
+    return data
+
+
+def _decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    if compression == 'zlib':
+        return zlib.decompress(data)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ValueError("Для чтения файла со сжатием zstd нужен пакет zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+# Колоночный файл, который пишется группами строк: open_columns, write_row_group для каждой группы
+# накопленных столбцов (после записи их очищает вызывающий, clear_columns) и close_columns.
+# Файл открывается при записи первой группы, когда имена столбцов уже известны
+def open_columns(filename, fmt, compression=None, level=None):
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Неизвестный колоночный формат: {fmt}")
+    return {'filename': filename, 'fmt': fmt, 'compression': compression if fmt == 'msgpack' else 'deflate',
+            'level': level if fmt == 'msgpack' else None, 'file': None, 'groups': []}
+
+
+def _open_file(writer, columns):
+    if writer['file'] is not None:
+        return
+    if writer['fmt'] == 'msgpack':
+        writer['file'] = open(writer['filename'], 'wb')
+        writer['file'].write(msgpack.packb(_header(columns, writer['compression'], writer['level']),
+                                           use_bin_type=True))
+    else:
+        writer['file'] = zipfile.ZipFile(writer['filename'], 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True)
+
+
+def _write_npy(archive, name, array):
+    with archive.open(name + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, array, allow_pickle=False)
+
+
+# Группа строк msgpack - объект {'rows', 'types', 'body'}, тело - массив столбцов [значения, маска пропусков]:
+# значения int64/float64/bool - байты массива, str/object - массив msgpack. В npz столбец n группы k -
+# массив g<k>_c<n> (и маска g<k>_c<n>_nulls), типы групп записываются в __schema__ при закрытии
+def write_row_group(writer, columns):
+    _open_file(writer, columns)
+    types = [column_type(values) for values in columns['values']]
+    if writer['fmt'] == 'msgpack':
+        body = []
+        for kind, values in zip(types, columns['values']):
+            if kind in _DTYPES:
+                array, mask = column_array(values, kind)
+                body.append([array.tobytes(), mask.tobytes() if mask is not None else None])
+            else:
+                body.append([values, None])
+        payload = _compress(msgpack.packb(body, use_bin_type=True), writer['compression'], writer['level'])
+        writer['file'].write(msgpack.packb({'rows': columns['rows'], 'types': types, 'body': payload},
+                                           use_bin_type=True))
+    else:
+        group = len(writer['groups'])
+        for n, (kind, values) in enumerate(zip(types, columns['values'])):
+            array, mask = column_array(values, kind)
+            _write_npy(writer['file'], f"g{group}_c{n}", array)
+            if mask is not None:
+                _write_npy(writer['file'], f"g{group}_c{n}_nulls", mask)
+    writer['groups'].append({'rows': columns['rows'], 'types': types})
+
+
+# Завершение файла; columns - накопленные столбцы (по ним записывается заголовок, если строк не было).
+# Возвращает число записанных строк
+def close_columns(writer, columns):
+    _open_file(writer, columns)
+    if writer['fmt'] == 'npz':
+        header = dict(_header(columns, writer['compression']), row_groups=writer['groups'])
+        _write_npy(writer['file'], '__schema__', np.array(json.dumps(header, ensure_ascii=False)))
+    writer['file'].close()
+    return sum(group['rows'] for group in writer['groups'])
+
+
+# Прерванная запись: недописанный файл удаляется
+def abort_columns(writer):
+    if writer['file'] is not None:
+        writer['file'].close()
+        os.remove(writer['filename'])
+
+
+# Запись накопленных столбцов в колоночный формат fmt (msgpack или npz) одной группой строк
+def write_columns(filename, columns, fmt, compression=None, level=None):
+    writer = open_columns(filename, fmt, compression, level)
+    if columns['rows']:
+        write_row_group(writer, columns)
+    return close_columns(writer, columns)
+
+
+def _restore(array, mask, kind):
+    if kind == 'object':
+        return [json.loads(value) for value in array.tolist()]
+    values = array.tolist()
+    if kind == 'bool':
+        values = [bool(value) for value in values]
+    if mask is not None:
+        values = [None if null else value for value, null in zip(values, mask.tolist())]
+    return values
+
+
+def _check_header(filename, header):
+    if not isinstance(header, dict) or header.get('format') != FORMAT_NAME:
+        raise ValueError(f"{filename}: не колоночный файл {FORMAT_NAME}")
+    if header.get('version') != FORMAT_VERSION:
+        raise ValueError(f"{filename}: неподдерживаемая версия формата {header.get('version')}")
+
+
+# Заголовок и группы строк файла: [(число строк, типы столбцов, [(значения, маска пропусков)])]
+def _read_groups(filename):
+    groups = []
+    if filename.endswith('.npz'):
+        with np.load(filename, allow_pickle=False) as data:
+            header = json.loads(data['__schema__'].item())
+            _check_header(filename, header)
+            for k, group in enumerate(header['row_groups']):
+                groups.append((group['rows'], group['types'],
+                               [(data[f"g{k}_c{n}"], data[f"g{k}_c{n}_nulls"] if f"g{k}_c{n}_nulls" in data else None)
+                                for n in range(len(header['names']))]))
+        return header, groups
+    with open(filename, 'rb') as f:
+        unpacker = msgpack.Unpacker(f, raw=False)
+        header = unpacker.unpack()
+        _check_header(filename, header)
+        for group in unpacker:
+            body = msgpack.unpackb(_decompress(group['body'], header['compression']), raw=False)
+            arrays = []
+            for kind, (values, mask) in zip(group['types'], body):
+                if kind in _DTYPES:
+                    array = np.frombuffer(values, dtype=_DTYPES[kind])
+                    arrays.append((array.astype(np.bool_) if kind == 'bool' else array,
+                                   np.frombuffer(mask, dtype=np.bool_) if mask is not None else None))
+                else:
+                    arrays.append((values, None))
+            groups.append((group['rows'], group['types'], arrays))
+    return header, groups
+
+
+# Чтение колоночного файла: (схема, {имя столбца: значения}); в схеме - общее число строк и тип каждого
+# столбца (object, если в группах строк типы разные). numpy=True - числовые столбцы массивами numpy
+# (пропуски заполнены нулями, маски - в столбцах '<имя>__nulls'), иначе списки Python с None
+def read_columns(filename, numpy=False):
+    header, groups = _read_groups(filename)
+    header['rows'] = sum(rows for rows, _, _ in groups)
+    header['columns'] = []
+    result = {}
+    for n, name in enumerate(header['names']):
+        kinds = {types[n] for _, types, _ in groups}
+        kind = kinds.pop() if len(kinds) == 1 else 'object'
+        header['columns'].append({'name': name, 'type': kind})
+        parts = [(arrays[n], types[n], rows) for rows, types, arrays in groups]
+        if numpy and kind in _DTYPES:
+            result[name] = (np.concatenate([array for (array, _), _, _ in parts]) if parts
+                            else np.array([], dtype=_DTYPES[kind]))
+            if any(mask is not None for (_, mask), _, _ in parts):
+                result[name + '__nulls'] = np.concatenate([mask if mask is not None else np.zeros(rows, dtype=np.bool_)
+                                                           for (_, mask), _, rows in parts])
+        else:
+            result[name] = []
+            for (array, mask), group_kind, _ in parts:
+                result[name] += array if isinstance(array, list) else _restore(array, mask, group_kind)
+    return header, result
+
+
+# Элементы в том виде, в каком они записаны в JSON: словари или списки
+def read_items(filename):
+    header, columns = read_columns(filename)
+    names = [spec['name'] for spec in header['columns']]
+    rows = zip(*(columns[name] for name in names))
+    if header['items'] == 'dict':
+        return [dict(zip(names, row)) for row in rows]
+    return [list(row) for row in rows]
@@ -0,0 +1,785 @@
+import csv
+import operator
+import re
+import sqlite3
+
+import numpy as np
+
+from common.columnar import dataframe_to_columns, read_pickle_frame
+from common.json_records import iter_json_array
+from common.msgpack_records import book_row, iter_msgpack_items, song_row
+from common.reports import extrema_query
+from common.schema import INDEXES, NATURAL_KEYS
+from common.text_records import PRODUCT_FIELDS, SONG_FIELDS, iter_records, parse_bool
+
+# Колоночный движок запросов лабораторных: исходные файлы загружаются в массивы numpy по столбцам,
+# и запросы задач 1-5 выполняются в процессе без SQLite: фильтры - булевыми масками, первые N строк -
+# argpartition, группировки - np.unique и bincount, соединение subitems с books - по хэш-индексу названий.
+#
+# Результат - те же строки (кортежи), что возвращает курсор SQL-пути на базе, собранной скриптами задач
+# с нуля (в непустой базе id и порядок строк зависят от прежних загрузок):
+#   - значения приводятся к объявленным типам столбцов по правилам родства типов SQLite (REAL-столбец
+#     хранит 5 как 5.0, BOOLEAN - True как 1, INTEGER - 3.0 как 3);
+#   - SUM и AVG вещественных чисел накапливаются последовательно в порядке обхода строк, как в SQLite
+#     (с 3.43 - с компенсацией Кэхэна-Бабушки-Ноймайера), поэтому совпадают до последнего бита;
+#   - порядок строк с равными ключами повторяет планы SQLite с индексами из common.schema: обход индекса
+#     по возрастанию и сортировка во временном B-дереве дают равные строки по возрастанию rowid, обход
+#     индекса с конца (ORDER BY ... DESC) - по убыванию, сортировка сгруппированных строк по агрегату -
+#     в обратном порядке групп;
+#   - rowid строк - номера по порядку вставки в пустую таблицу (id AUTOINCREMENT новой базы), повторная
+#     запись по естественному ключу (common.schema.NATURAL_KEYS) обновляет строку на месте первой вставки
+
+# Объявленные типы столбцов таблиц (как в CREATE TABLE скриптов задач), порядок - порядок столбцов
+SCHEMAS = {
+    'books': [('title', 'TEXT'), ('author', 'TEXT'), ('genre', 'TEXT'), ('pages', 'INTEGER'),
+              ('published_year', 'INTEGER'), ('isbn', 'TEXT'), ('rating', 'REAL'), ('views', 'INTEGER')],
+    'subitems': [('title', 'TEXT'), ('price', 'INTEGER'), ('place', 'TEXT'), ('date', 'TEXT')],
+    'songs': [('id', 'INTEGER'), ('artist', 'TEXT'), ('song', 'TEXT'), ('duration_ms', 'INTEGER'),
+              ('year', 'INTEGER'), ('tempo', 'REAL'), ('genre', 'TEXT'), ('instrumentalness', 'REAL'),
+              ('explicit', 'BOOLEAN'), ('loudness', 'REAL')],
+    'products': [('id', 'INTEGER'), ('name', 'TEXT'), ('price', 'REAL'), ('quantity', 'INTEGER'),
+                 ('category', 'TEXT'), ('fromCity', 'TEXT'), ('isAvailable', 'BOOLEAN'), ('views', 'INTEGER'),
+                 ('update_counter', 'INTEGER')],
+    'Manufacturer': [('id', 'INTEGER'), ('name', 'TEXT')],
+    'Car': [('Manufacturer_id', 'INTEGER'), ('Model', 'TEXT'), ('Sales_in_thousands', 'REAL'),
+            ('__year_resale_value', 'REAL')],
+    'CarDetails': [('Car_id', 'INTEGER'), ('Vehicle_type', 'TEXT'), ('Price_in_thousands', 'REAL'),
+                   ('Engine_size', 'REAL'), ('Horsepower', 'REAL')],
+    'CarDimensions': [('Car_id', 'INTEGER'), ('Wheelbase', 'REAL'), ('Width', 'REAL'), ('Length', 'REAL'),
+                      ('Curb_weight', 'REAL')],
+}
+
+# SQLite с 3.43 суммирует вещественные числа с компенсацией ошибки округления
+KBN_SUM = sqlite3.sqlite_version_info >= (3, 43, 0)
+
+# Число в тексте, которое SQLite при родстве INTEGER/REAL/NUMERIC сохраняет числом
+_NUMERIC_TEXT = re.compile(r'\s*[+-]?(?:\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*\Z')
+# Вещественное значение сохраняется целым, только если оно точно целое и по модулю меньше 2**51
+_REAL_AS_INT = 1 << 51
+_INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+_COMPARISONS = {'=': operator.eq, '!=': operator.ne, '<': operator.lt, '<=': operator.le,
+                '>': operator.gt, '>=': operator.ge}
+
+
+# Родство типа столбца по объявленному типу (правила раздела 3.1 документации SQLite)
+def affinity(declared):
+    declared = declared.upper()
+    if 'INT' in declared:
+        return 'INTEGER'
+    if any(name in declared for name in ('CHAR', 'CLOB', 'TEXT')):
+        return 'TEXT'
+    if 'BLOB' in declared or not declared:
+        return 'BLOB'
+    if any(name in declared for name in ('REAL', 'FLOA', 'DOUB')):
+        return 'REAL'
+    return 'NUMERIC'
+
+
+# Текст вещественного числа, как его пишет SQLite ("%!.15g": у целых значений остаётся ".0")
+def _real_text(value):
+    text = '%.15g' % value
+    mantissa, e, exponent = text.partition('e')
+    if mantissa.lstrip('-').isdigit():
+        mantissa += '.0'
+    return mantissa + e + exponent
+
+
+# Значение в том виде, в каком его сохранит столбец с родством column_affinity
+def apply_affinity(value, column_affinity):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, float) and value != value:
+        return None
+    if column_affinity == 'TEXT':
+        if isinstance(value, float):
+            return _real_text(value)
+        return str(value) if isinstance(value, int) else value
+    if column_affinity == 'BLOB':
+        return value
+    if isinstance(value, str):
+        match = _NUMERIC_TEXT.match(value)
+        if match is None:
+            return value
+        text = value.strip()
+        value = float(text)
+        if match.group(1) is None and '.' not in text and _INT64_RANGE[0] <= int(text) <= _INT64_RANGE[1]:
+            value = int(text)
+    if column_affinity == 'REAL':
+        return float(value) if isinstance(value, int) else value
+    if isinstance(value, float) and value.is_integer() and -_REAL_AS_INT <= value < _REAL_AS_INT:
+        return int(value)
+    return value
+
+
+# Уже приведённые значения: тип каждого значения - тот, что хранит столбец с таким родством
+_STORED_TYPES = {'INTEGER': {int, type(None)}, 'NUMERIC': {int, type(None)}, 'REAL': {float, type(None)},
+                 'TEXT': {str, type(None)}}
+
+
+def _stored_values(values, column_affinity):
+    if {type(value) for value in values} <= _STORED_TYPES.get(column_affinity, set()):
+        return values
+    return [apply_affinity(value, column_affinity) for value in values]
+
+
+# Массив столбца: int64 или float64, если все значения одного числового типа, иначе object
+# (строки, NULL как None, смешанные типы)
+def column_array(values):
+    kinds = {type(value) for value in values}
+    if kinds == {int}:
+        try:
+            return np.array(values, dtype=np.int64)
+        except OverflowError:
+            pass
+    elif kinds == {float}:
+        return np.array(values, dtype=np.float64)
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+# Таблица из строк: словарь {столбец: массив} в порядке столбцов SCHEMAS[table]
+def make_table(table, rows):
+    schema = SCHEMAS[table]
+    columns = [list(values) for values in zip(*rows)] or [[] for _ in schema]
+    return {name: column_array(_stored_values(values, affinity(declared)))
+            for (name, declared), values in zip(schema, columns)}
+
+
+def table_size(table):
+    return len(next(iter(table.values())))
+
+
+# Строки таблицы (кортежи, как у курсора sqlite3) по позициям positions, столбцы names (по умолчанию все)
+def table_rows(table, positions=None, names=None):
+    names = list(table) if names is None else names
+    columns = [table[name] if positions is None else table[name][positions] for name in names]
+    return list(zip(*(column.tolist() for column in columns)))
+
+
+# Загрузка с заменой по естественному ключу (INSERT ... ON CONFLICT DO UPDATE): строка остаётся на месте
+# первой вставки, столбцы update берутся из последней записи. Ключ с NULL не совпадает ни с каким другим.
+# Возвращает пары (номер попытки вставки, строка): id AUTOINCREMENT выделяется и при конфликте,
+# поэтому id новой строки - номер её попытки вставки + 1
+def upsert_rows(rows, key_positions, update_positions):
+    positions = {}
+    result = []
+    for attempt, row in enumerate(rows):
+        key = tuple(row[i] for i in key_positions)
+        n = None if None in key else positions.get(key)
+        if n is None:
+            if None not in key:
+                positions[key] = len(result)
+            result.append((attempt, list(row)))
+            continue
+        for i in update_positions:
+            result[n][1][i] = row[i]
+    return result
+
+
+# Строки с приведёнными к типам столбцов значениями (до сравнения естественных ключей)
+def _stored_rows(table, rows, offset=0):
+    affinities = [affinity(declared) for _, declared in SCHEMAS[table][offset:]]
+    columns = [_stored_values(values, column_affinity) for values, column_affinity in zip(zip(*rows), affinities)]
+    return list(zip(*columns))
+
+
+def _upsert_table(table, rows, offset=0):
+    rows = _stored_rows(table, rows, offset)
+    names = [name for name, _ in SCHEMAS[table][offset:]][:len(rows[0]) if rows else 0]
+    keys = [names.index(name) for name in NATURAL_KEYS[table]] if names else []
+    return upsert_rows(rows, keys, [i for i in range(len(names)) if i not in keys])
+
+
+# Загрузка исходных файлов задач
+
+# books из item.msgpack (lab4_1.py, lab4_2.py)
+def load_books(msgpack_file):
+    return make_table('books', [book_row(item) for item in iter_msgpack_items(msgpack_file)])
+
+
+# subitems из subitem.pkl (lab4_2.py): столбцы приводятся к типам таблицы так же, как при загрузке в базу
+def load_subitems(pickle_file):
+    schema = SCHEMAS['subitems']
+    arrays = dataframe_to_columns(read_pickle_frame(pickle_file), schema)
+    return {name: array if array.dtype != object else column_array(_stored_values(array.tolist(), affinity(declared)))
+            for (name, declared), array in zip(schema, arrays)}
+
+
+# songs из _part_2.msgpack, затем _part_1.text (task3): повтор (artist, song) обновляет строку
+def load_songs(msgpack_file, text_file):
+    rows = [song_row(item) for item in iter_msgpack_items(msgpack_file)]
+    rows.extend(iter_records(text_file, SONG_FIELDS))
+    return make_table('songs', [(attempt + 1,) + tuple(row) for attempt, row in _upsert_table('songs', rows, 1)])
+
+
+# Журнал изменений _update_data.csv (task4): список (name, method, param)
+def load_changes(csv_file):
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        fieldnames = next(csv.reader([f.readline()], delimiter=';'))
+        return [(row.get('name', ''), row.get('method', ''), row.get('param', ''))
+                for row in csv.DictReader(f, fieldnames=fieldnames, delimiter=';')]
+
+
+_CHANGE_METHODS = ('available', 'price_percent', 'price_abs', 'quantity_add', 'quantity_sub')
+
+
+# Арифметика SQL: NULL в любом операнде даёт NULL
+def _add(a, b):
+    return None if a is None or b is None else a + b
+
+
+def _multiply(a, b):
+    return None if a is None or b is None else a * b
+
+
+# products из _product_data.text с изменениями из _update_data.csv (task4, пакетный режим apply_changes_bulk):
+# товар с 'remove' в журнале удаляется, остальные операции применяются по порядку журнала, параметр
+# операции - значение столбца REAL временного журнала
+def load_products(text_file, changes_file):
+    attempts, rows = zip(*_upsert_table('products', iter_records(text_file, PRODUCT_FIELDS), 1)) or ((), ())
+    changes = load_changes(changes_file)
+    removed = {name for name, method, _ in changes if method == 'remove'}
+    positions = {row[0]: n for n, row in enumerate(rows)}
+    counters = [0] * len(rows)
+    for name, method, param in changes:
+        n = positions.get(name)
+        if n is None or name in removed or method not in _CHANGE_METHODS:
+            continue
+        if not param:
+            param = None
+        else:
+            param = apply_affinity(parse_bool(param) if method == 'available' else float(param), 'REAL')
+        row = rows[n]
+        if method == 'available':
+            row[5] = param
+        elif method == 'price_percent':
+            row[1] = _multiply(row[1], _add(1, param))
+        elif method == 'price_abs':
+            row[1] = _add(row[1], param)
+        elif method == 'quantity_add':
+            row[2] = _add(row[2], param)
+        elif method == 'quantity_sub':
+            row[2] = _add(row[2], None if param is None else -param)
+        counters[n] += 1
+    kept = [(attempt + 1,) + tuple(row) + (counter,)
+            for attempt, row, counter in zip(attempts, rows, counters) if row[0] not in removed]
+    return make_table('products', _stored_rows('products', kept))
+
+
+# rowid столбца INTEGER PRIMARY KEY: NULL получает max(rowid) + 1, повтор явного значения - ошибка
+def _assign_rowids(ids):
+    used = set()
+    top = 0
+    result = []
+    for rowid in ids:
+        if rowid is None:
+            rowid = top + 1
+        elif rowid in used:
+            raise ValueError(f"Повтор значения первичного ключа: {rowid}")
+        used.add(rowid)
+        top = max(top, rowid)
+        result.append(rowid)
+    return result
+
+
+# Строки таблицы с INTEGER PRIMARY KEY в первом столбце в порядке rowid (порядке обхода таблицы)
+def _rowid_table(table, rows):
+    rows = _stored_rows(table, rows)
+    ids = _assign_rowids([row[0] for row in rows])
+    rows = sorted(((rowid,) + row[1:] for rowid, row in zip(ids, rows)), key=lambda row: row[0])
+    return make_table(table, rows)
+
+
+def _csv_float(text):
+    return float(text) if text else None
+
+
+# Manufacturer и Car из car_sales.json, CarDetails и CarDimensions из car_sales1.csv (task5).
+# id производителей - по порядку первого появления; Car_id строк CSV ищется по первому столбцу, как в lab4_5.py
+def load_cars(json_file, csv_file):
+    manufacturer_ids = {}
+    cars = []
+    for data in iter_json_array(json_file):
+        name = data.get('Manufacturer')
+        manufacturer_ids.setdefault(name, len(manufacturer_ids) + 1)
+        cars.append((manufacturer_ids[name], data.get('Model'), data.get('Sales_in_thousands') or None,
+                     data.get('__year_resale_value') or None))
+
+    details, dimensions = [], []
+    with open(csv_file, 'r', newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            car_id = manufacturer_ids.get(row[0])
+            if row[1] and row[2]:
+                details.append((car_id, row[0], float(row[1]), float(row[2]), int(row[3]) if row[3] else None))
+            dimensions.append((car_id,) + tuple(_csv_float(text) for text in row[4:8]))
+
+    return {
+        'Manufacturer': make_table('Manufacturer', [(n, name) for name, n in manufacturer_ids.items()]),
+        'Car': make_table('Car', [row for _, row in _upsert_table('Car', cars)]),
+        'CarDetails': _rowid_table('CarDetails', details),
+        'CarDimensions': _rowid_table('CarDimensions', dimensions),
+    }
+
+
+# Примитивы запросов
+
+# Ключ сортировки значений по правилам SQLite: NULL, затем числа, затем строки
+def _sql_key(value):
+    if value is None:
+        return (0, 0)
+    if isinstance(value, str):
+        return (2, value)
+    return (1, value)
+
+
+# Булева маска условия "столбец оператор значение"; сравнение с NULL ложно
+def compare(values, operator, value=None):
+    if operator == 'IS NULL':
+        return np.array([v is None for v in values.tolist()], dtype=bool) if values.dtype == object \
+            else np.zeros(len(values), dtype=bool)
+    if operator == 'IS NOT NULL':
+        return ~compare(values, 'IS NULL')
+    if operator == '<>':
+        operator = '!='
+    if operator not in _COMPARISONS:
+        raise ValueError(f"Неподдерживаемый оператор: {operator!r}")
+    if value is None:
+        return np.zeros(len(values), dtype=bool)
+    if values.dtype != object and not isinstance(value, str):
+        return _COMPARISONS[operator](values, value)
+    target = _sql_key(value)
+    check = _COMPARISONS[operator]
+    return np.array([v is not None and check(_sql_key(v), target) for v in values.tolist()], dtype=bool)
+
+
+# Маска конъюнкции условий [(столбец, оператор[, значение])] (как в common.query_builder)
+def where_mask(table, conditions):
+    mask = np.ones(table_size(table), dtype=bool)
+    for condition in conditions or ():
+        mask &= compare(table[condition[0]], condition[1].upper(), *condition[2:])
+    return mask
+
+
+# Позиции строк в порядке сортировки по values; ties - порядок равных строк ('asc' - по возрастанию
+# позиции, 'desc' - по убыванию), limit - первые N строк: кандидаты отбираются argpartition, и полностью
+# сортируются только они (вместе со всеми строками, равными N-й)
+def sort_positions(values, descending=False, limit=None, ties='asc'):
+    size = len(values)
+    if limit is not None and limit <= 0:
+        return np.empty(0, dtype=np.intp)
+    if values.dtype == object:
+        keys = [_sql_key(value) for value in values.tolist()]
+        positions = list(range(size)) if ties == 'asc' else list(range(size - 1, -1, -1))
+        positions.sort(key=keys.__getitem__, reverse=descending)
+        return np.array(positions[:limit], dtype=np.intp)
+
+    signed = -values if descending else values
+    tie_keys = np.arange(size) if ties == 'asc' else -np.arange(size)
+    candidates = np.arange(size)
+    if limit is not None and limit < size:
+        boundary = signed[np.argpartition(signed, limit - 1)[limit - 1]]
+        candidates = np.flatnonzero(signed <= boundary)
+    order = candidates[np.lexsort((tie_keys[candidates], signed[candidates]))]
+    return order[:limit]
+
+
+# Группировка: (ключи групп по возрастанию, как у GROUP BY, номер группы каждой строки)
+def group_by(values):
+    if values.dtype != object:
+        keys, inverse = np.unique(values, return_inverse=True)
+        return keys.tolist(), inverse.ravel()
+    values = values.tolist()
+    keys = sorted(set(values), key=_sql_key)
+    index = {key: n for n, key in enumerate(keys)}
+    return keys, np.fromiter((index[value] for value in values), dtype=np.intp, count=len(values))
+
+
+# SUM, AVG, MIN, MAX, COUNT списка значений в порядке обхода по правилам SQLite
+def _sum_state(values):
+    count, total, approx = 0, 0, False
+    real, error = 0.0, 0.0
+    for value in values:
+        if value is None:
+            continue
+        count += 1
+        if isinstance(value, int) and not approx:
+            total += value
+            if not _INT64_RANGE[0] <= total <= _INT64_RANGE[1]:
+                raise OverflowError("integer overflow")
+            if not KBN_SUM:
+                real += value
+            continue
+        number = float(value) if not isinstance(value, str) else _text_number(value)
+        if not KBN_SUM:
+            real += number
+            approx = True
+            continue
+        if not approx:
+            approx = True
+            real, error = _kbn_init(total)
+        for part in _kbn_parts(number):
+            real, error = _kbn_step(real, error, part)
+    return count, total, approx, real, error
+
+
+def _text_number(text):
+    match = re.match(r'\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?', text)
+    return float(match.group()) if match else 0.0
+
+
+def _kbn_init(value):
+    if abs(value) >= 4503599627370496:
+        small = value % 16384 if value >= 0 else -((-value) % 16384)
+        return float(value - small), float(small)
+    return float(value), 0.0
+
+
+def _kbn_parts(value):
+    if isinstance(value, int) and abs(value) >= 4503599627370496:
+        small = value % 16384 if value >= 0 else -((-value) % 16384)
+        return [float(value - small), float(small)]
+    return [float(value)]
+
+
+def _kbn_step(real, error, value):
+    total = real + value
+    if abs(real) > abs(value):
+        error += (real - total) + value
+    else:
+        error += (value - total) + real
+    return total, error
+
+
+def aggregate_values(function, values):
+    function = function.upper()
+    if function == 'COUNT':
+        return sum(1 for value in values if value is not None)
+    if function in ('MIN', 'MAX'):
+        present = [value for value in values if value is not None]
+        if not present:
+            return None
+        return (min if function == 'MIN' else max)(present, key=_sql_key)
+    count, total, approx, real, error = _sum_state(values)
+    if not count:
+        return None
+    if function == 'SUM':
+        if not approx:
+            return total
+        return real + error if KBN_SUM else real
+    if function == 'AVG':
+        if not approx:
+            return (real if not KBN_SUM else float(total)) / count
+        return (real + error if KBN_SUM else real) / count
+    raise ValueError(f"Неизвестная агрегатная функция: {function!r}")
+
+
+# Агрегат столбца по группам (inverse - номер группы строки, groups - число групп) или по всем строкам
+# (inverse=None); строки обходятся в порядке массива. Числовые столбцы без NULL считаются векторно:
+# bincount складывает веса последовательно в порядке строк, так же как SQLite накапливает SUM
+def aggregate(function, values, inverse=None, groups=None):
+    function = function.upper()
+    if inverse is None:
+        inverse, groups = np.zeros(len(values), dtype=np.intp), 1
+    if function == 'COUNT(*)':
+        return np.bincount(inverse, minlength=groups).tolist()
+
+    numeric = values.dtype != object
+    if numeric and function == 'COUNT':
+        return np.bincount(inverse, minlength=groups).tolist()
+    counts = np.bincount(inverse, minlength=groups)
+    if numeric and function in ('MIN', 'MAX') and counts.all():
+        limits = np.iinfo(values.dtype) if values.dtype.kind == 'i' else np.finfo(values.dtype)
+        result = np.full(groups, limits.max if function == 'MIN' else limits.min, dtype=values.dtype)
+        (np.minimum if function == 'MIN' else np.maximum).at(result, inverse, values)
+        return result.tolist()
+    integral = values.dtype == np.int64
+    if numeric and function in ('SUM', 'AVG') and counts.all() and (integral or not KBN_SUM):
+        if integral and function == 'SUM' and np.abs(values).max(initial=0) * max(len(values), 1) < 2 ** 63:
+            result = np.zeros(groups, dtype=np.int64)
+            np.add.at(result, inverse, values)
+            return result.tolist()
+        if not integral or not KBN_SUM:
+            sums = np.bincount(inverse, weights=values.astype(np.float64), minlength=groups)
+            if function == 'AVG':
+                return (sums / counts).tolist()
+            if not integral:
+                return sums.tolist()
+
+    members = [[] for _ in range(groups)]
+    for group, value in zip(inverse.tolist(), values.tolist()):
+        members[group].append(value)
+    return [aggregate_values(function, group_values) for group_values in members]
+
+
+# Хэш-индекс столбца: значение -> позиции строк по возрастанию (NULL не индексируется)
+def hash_index(values):
+    index = {}
+    for position, value in enumerate(values.tolist()):
+        if value is not None:
+            index.setdefault(value, []).append(position)
+    return index
+
+
+# Соединение по равенству: строки левой таблицы обходятся в порядке left_positions, для каждой
+# совпадения берутся из хэш-индекса правой. Возвращает пары позиций (левые, правые) в порядке вывода
+def hash_join(left_values, left_positions, index):
+    left, right = [], []
+    values = left_values.tolist()
+    for position in left_positions.tolist():
+        matches = index.get(values[position])
+        if matches:
+            left.extend([position] * len(matches))
+            right.extend(matches)
+    return np.array(left, dtype=np.intp), np.array(right, dtype=np.intp)
+
+
+# Есть ли в common.schema индекс, начинающийся со столбца column таблицы table
+def indexed(table, column):
+    return any(index_table == table and columns.split(',')[0].strip() == column
+               for indexes in INDEXES.values() for _, index_table, columns in indexes)
+
+
+# SELECT ... WHERE ... ORDER BY ... LIMIT по одной таблице. По индексированному столбцу SQLite обходит
+# индекс (при DESC - с конца, равные строки идут по убыванию rowid), иначе сортирует устойчиво
+def select_rows(table, table_name, columns=None, where=None, order_by=None, descending=False, limit=None):
+    positions = np.flatnonzero(where_mask(table, where)) if where else np.arange(table_size(table))
+    if order_by is not None:
+        ties = 'desc' if descending and indexed(table_name, order_by) else 'asc'
+        positions = positions[sort_positions(table[order_by][positions], descending, limit, ties)]
+    elif limit is not None:
+        positions = positions[:limit]
+    return table_rows(table, positions, columns)
+
+
+# Строки групп, отсортированные по агрегату по убыванию: SQLite выдаёт равные строки в обратном порядке групп
+def _order_groups_desc(rows, column):
+    keys = np.array([row[column] for row in rows])
+    order = np.lexsort((np.arange(len(rows)), keys))[::-1]
+    return [rows[n] for n in order.tolist()]
+
+
+# Запросы задач. tables - словарь таблиц, загруженных функциями load_*
+
+# lab4_1.py: SELECT * FROM books ORDER BY views DESC LIMIT ?
+def top_books(tables, limit=76):
+    return select_rows(tables['books'], 'books', order_by='views', descending=True, limit=limit)
+
+
+# lab4_1.py: SELECT * FROM books WHERE rating > 4 ORDER BY views DESC LIMIT ?
+def filtered_books(tables, min_rating=4, limit=76):
+    return select_rows(tables['books'], 'books', where=[('rating', '>', min_rating)], order_by='views',
+                       descending=True, limit=limit)
+
+
+# lab4_1.py: SUM, MIN, MAX, AVG рейтинга
+def rating_stats(tables):
+    values = tables['books']['rating']
+    return [tuple(aggregate(function, values)[0] for function in ('SUM', 'MIN', 'MAX', 'AVG'))]
+
+
+# lab4_1.py: SELECT genre, COUNT(*) AS frequency FROM books GROUP BY genre ORDER BY frequency DESC
+def genre_frequency(tables):
+    keys, inverse = group_by(tables['books']['genre'])
+    rows = list(zip(keys, aggregate('COUNT(*)', tables['books']['genre'], inverse, len(keys))))
+    return _order_groups_desc(rows, 1)
+
+
+# Соединение books JOIN subitems ON books.title = subitems.title; by_title=True - books обходятся
+# по индексу idx_books_title (по названию, затем по rowid), иначе по rowid
+def _book_sales(tables, by_title):
+    books, subitems = tables['books'], tables['subitems']
+    titles = books['title']
+    order = np.argsort(titles, kind='stable') if by_title else np.arange(len(titles))
+    return hash_join(titles, order, hash_index(subitems['title']))
+
+
+# lab4_2.py: SELECT books.title, subitems.price, subitems.place FROM books JOIN subitems ...
+# ORDER BY books.rowid, subitems.price, subitems.place
+def book_prices_and_places(tables):
+    left, right = _book_sales(tables, by_title=False)
+    rows = list(zip(tables['books']['title'][left].tolist(), tables['subitems']['price'][right].tolist(),
+                    tables['subitems']['place'][right].tolist()))
+    order = sorted(range(len(rows)), key=lambda n: (left[n], _sql_key(rows[n][1]), _sql_key(rows[n][2])))
+    return [rows[n] for n in order]
+
+
+# lab4_2.py: средняя цена и число продаж по жанрам (GROUP BY books.genre)
+def genre_stats(tables):
+    left, right = _book_sales(tables, by_title=False)
+    keys, inverse = group_by(tables['books']['genre'][left])
+    prices = tables['subitems']['price'][right]
+    return list(zip(keys, aggregate('AVG', prices, inverse, len(keys)), aggregate('COUNT', prices, inverse, len(keys))))
+
+
+# lab4_2.py: название и цена при MIN и MAX цены (common.reports.extrema_query); при равных ценах -
+# первая строка в порядке соединения
+def price_extrema(tables):
+    left, right = _book_sales(tables, by_title=True)
+    prices = tables['subitems']['price'][right]
+    titles = tables['books']['title'][left]
+    if prices.dtype != object and len(prices):
+        cheapest, dearest = np.argmin(prices), np.argmax(prices)
+        return [(titles[cheapest], prices[cheapest].item(), titles[dearest], prices[dearest].item())]
+    prices = prices.tolist()
+    present = [n for n, price in enumerate(prices) if price is not None]
+    if not present:
+        return [(None, None, None, None)]
+    keys = [_sql_key(price) for price in prices]
+    cheapest = min(present, key=keys.__getitem__)
+    dearest = max(present, key=lambda n: (keys[n], -n))
+    return [(titles[cheapest], prices[cheapest], titles[dearest], prices[dearest])]
+
+
+# task3: первые limit песен по числовому полю (select_query('songs', order_by=field, limit=limit))
+def first_sorted_songs(tables, field='duration_ms', limit=76):
+    return select_rows(tables['songs'], 'songs', order_by=field, limit=limit)
+
+
+# task3: SUM, MIN, MAX, AVG числового поля
+def song_aggregates(tables, field='tempo'):
+    values = tables['songs'][field]
+    return [tuple(aggregate(function, values)[0] for function in ('SUM', 'MIN', 'MAX', 'AVG'))]
+
+
+# task3: частота значений поля (GROUP BY field, COUNT(field))
+def song_frequency(tables, field='genre'):
+    values = tables['songs'][field]
+    keys, inverse = group_by(values)
+    return list(zip(keys, aggregate('COUNT', values, inverse, len(keys))))
+
+
+# task3: первые limit песен по условиям where, отсортированные по полю
+def filtered_sorted_songs(tables, where=(('year', '>', 2000),), field='year', limit=81):
+    return select_rows(tables['songs'], 'songs', where=list(where), order_by=field, limit=limit)
+
+
+# task4: SELECT name, update_counter FROM products ORDER BY update_counter DESC LIMIT 10
+def top_updated_products(tables, limit=10):
+    return select_rows(tables['products'], 'products', ['name', 'update_counter'], order_by='update_counter',
+                       descending=True, limit=limit)
+
+
+# task4: SUM, MIN, MAX, AVG поля и COUNT(*) по категориям
+def category_analysis(tables, field):
+    products = tables['products']
+    keys, inverse = group_by(products['category'])
+    columns = [aggregate(function, products[field], inverse, len(keys)) for function in ('SUM', 'MIN', 'MAX', 'AVG')]
+    return list(zip(keys, *columns, aggregate('COUNT(*)', products[field], inverse, len(keys))))
+
+
+def price_analysis(tables):
+    return category_analysis(tables, 'price')
+
+
+def quantity_analysis(tables):
+    return category_analysis(tables, 'quantity')
+
+
+# task4: SELECT name, price, quantity FROM products WHERE price > 50000 AND quantity < 50
+def custom_products(tables):
+    return select_rows(tables['products'], 'products', ['name', 'price', 'quantity'],
+                       where=[('price', '>', 50000), ('quantity', '<', 50)])
+
+
+# task5: SELECT * FROM Car WHERE Sales_in_thousands > 200
+def cars_over_sales(tables, sales=200):
+    return select_rows(tables['Car'], 'Car', where=[('Sales_in_thousands', '>', sales)])
+
+
+# task5: SELECT * FROM CarDetails ORDER BY Price_in_thousands DESC LIMIT 5
+def most_expensive_cars(tables, limit=5):
+    return select_rows(tables['CarDetails'], 'CarDetails', order_by='Price_in_thousands', descending=True,
+                       limit=limit)
+
+
+# task5: SELECT COUNT(*), Vehicle_type FROM CarDetails GROUP BY Vehicle_type
+def vehicle_types(tables):
+    values = tables['CarDetails']['Vehicle_type']
+    keys, inverse = group_by(values)
+    return list(zip(aggregate('COUNT(*)', values, inverse, len(keys)), keys))
+
+
+# task5: средние продажи по производителям (Manufacturer JOIN Car GROUP BY Manufacturer.name);
+# производители обходятся по имени, их модели - по rowid
+def manufacturer_sales(tables):
+    manufacturers, cars = tables['Manufacturer'], tables['Car']
+    names = manufacturers['name']
+    order = np.array(sorted(range(len(names)), key=lambda n: _sql_key(names[n])), dtype=np.intp)
+    left, right = hash_join(manufacturers['id'], order, hash_index(cars['Manufacturer_id']))
+    keys, inverse = group_by(names[left])
+    return list(zip(keys, aggregate('AVG', cars['Sales_in_thousands'][right], inverse, len(keys))))
+
+
+# task5: SELECT * FROM CarDetails WHERE Engine_size = (SELECT MAX(Engine_size) FROM CarDetails)
+def largest_engine_cars(tables):
+    details = tables['CarDetails']
+    return select_rows(details, 'CarDetails', where=[('Engine_size', '=', aggregate('MAX', details['Engine_size'])[0])])
+
+
+# task5: SELECT * FROM CarDimensions WHERE Length > 180 ORDER BY rowid
+def long_cars(tables, length=180):
+    return select_rows(tables['CarDimensions'], 'CarDimensions', where=[('Length', '>', length)])
+
+
+# Загрузчики исходных файлов нагрузок: нагрузка -> функция, возвращающая словарь таблиц
+LOADERS = {
+    'books': lambda msgpack_file: {'books': load_books(msgpack_file)},
+    'books_and_sales': lambda msgpack_file, pickle_file: {'books': load_books(msgpack_file),
+                                                          'subitems': load_subitems(pickle_file)},
+    'songs': lambda msgpack_file, text_file: {'songs': load_songs(msgpack_file, text_file)},
+    'products': lambda text_file, changes_file: {'products': load_products(text_file, changes_file)},
+    'cars': load_cars,
+}
+
+# Запросы нагрузок: имя -> (нагрузка, текст SQL-пути, функция движка). По текстам SQL результат
+# движка сверяется с базой (benchmarks/bench_column_engine.py)
+QUERIES = {
+    'top_books': ('books', "SELECT * FROM books ORDER BY views DESC LIMIT 76", top_books),
+    'rating_stats': ('books', "SELECT SUM(rating), MIN(rating), MAX(rating), AVG(rating) FROM books", rating_stats),
+    'genre_frequency': ('books', "SELECT genre, COUNT(*) AS frequency FROM books GROUP BY genre "
+                                 "ORDER BY frequency DESC", genre_frequency),
+    'filtered_books': ('books', "SELECT * FROM books WHERE rating > 4 ORDER BY views DESC LIMIT 76", filtered_books),
+    'book_prices_and_places': ('books_and_sales', "SELECT books.title, subitems.price, subitems.place FROM books "
+                                                  "JOIN subitems ON books.title = subitems.title "
+                                                  "ORDER BY books.rowid, subitems.price, subitems.place",
+                               book_prices_and_places),
+    'genre_stats': ('books_and_sales', "SELECT books.genre, AVG(subitems.price), COUNT(subitems.price) FROM books "
+                                       "JOIN subitems ON books.title = subitems.title GROUP BY books.genre",
+                    genre_stats),
+    'price_extrema': ('books_and_sales', extrema_query("books JOIN subitems ON books.title = subitems.title",
+                                                       'subitems.price', 'books.title'), price_extrema),
+    'first_sorted': ('songs', "SELECT * FROM songs ORDER BY duration_ms LIMIT 76", first_sorted_songs),
+    'aggregate_results': ('songs', "SELECT SUM(tempo), MIN(tempo), MAX(tempo), AVG(tempo) FROM songs",
+                          song_aggregates),
+    'categorical_frequency': ('songs', "SELECT genre, COUNT(genre) AS frequency FROM songs GROUP BY genre",
+                              song_frequency),
+    'filtered_sorted': ('songs', "SELECT * FROM songs WHERE year > 2000 ORDER BY year LIMIT 81",
+                        filtered_sorted_songs),
+    'top_updated_products': ('products', "SELECT name, update_counter FROM products ORDER BY update_counter DESC "
+                                         "LIMIT 10", top_updated_products),
+    'price_analysis': ('products', "SELECT category, SUM(price), MIN(price), MAX(price), AVG(price), COUNT(*) "
+                                   "FROM products GROUP BY category", price_analysis),
+    'quantity_analysis': ('products', "SELECT category, SUM(quantity), MIN(quantity), MAX(quantity), "
+                                      "AVG(quantity), COUNT(*) FROM products GROUP BY category", quantity_analysis),
+    'custom_query_result': ('products', "SELECT name, price, quantity FROM products "
+                                        "WHERE price > 50000 AND quantity < 50", custom_products),
+    'result1': ('cars', "SELECT * FROM Car WHERE Sales_in_thousands > 200", cars_over_sales),
+    'result2': ('cars', "SELECT * FROM CarDetails ORDER BY Price_in_thousands DESC LIMIT 5", most_expensive_cars),
+    'result3': ('cars', "SELECT COUNT(*), Vehicle_type FROM CarDetails GROUP BY Vehicle_type", vehicle_types),
+    'result4': ('cars', "SELECT Manufacturer.name, AVG(Car.Sales_in_thousands) FROM Manufacturer "
+                        "JOIN Car ON Manufacturer.id = Car.Manufacturer_id GROUP BY Manufacturer.name",
+                manufacturer_sales),
+    'result5': ('cars', "SELECT * FROM CarDetails WHERE Engine_size = (SELECT MAX(Engine_size) FROM CarDetails)",
+                largest_engine_cars),
+    'result6': ('cars', "SELECT * FROM CarDimensions WHERE Length > 180 ORDER BY rowid", long_cars),
+}
+
+
+# Выполнение запроса нагрузки по имени на загруженных таблицах
+def run_query(name, tables):
+    return QUERIES[name][2](tables)
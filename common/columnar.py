@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+from common.db import transaction
+from common.msgpack_records import DEFAULT_READ_SIZE, iter_msgpack_items
+from common.profiling import profiled
+from common.text_records import iter_batches
+
+# Размер порции строк для одного вызова executemany
+DEFAULT_CHUNK_SIZE = 10000
+
+
+# Объявленные типы столбцов таблицы: [(имя, тип)] из PRAGMA table_info.
+# Загрузка идёт в уже созданную таблицу, поэтому схема (типы, REFERENCES) сохраняется
+def table_schema(cursor, table):
+    return [(row[1], (row[2] or '').upper()) for row in cursor.execute(f"PRAGMA table_info({table})")]
+
+
+# Приведение столбца DataFrame к типу столбца таблицы один раз для всего столбца.
+# Столбцы с пропусками остаются object-массивами с None, чтобы в базу попал NULL
+def cast_column(series, declared_type):
+    if series.isna().any():
+        return series.astype(object).where(series.notna(), None).to_numpy()
+    if 'INT' in declared_type:
+        return series.to_numpy(dtype=np.int64)
+    if any(t in declared_type for t in ('REAL', 'FLOA', 'DOUB')):
+        return series.to_numpy(dtype=np.float64)
+    return series.astype(str).to_numpy(dtype=object)
+
+
+# Массивы столбцов в порядке столбцов таблицы
+def dataframe_to_columns(df, schema):
+    return [cast_column(df[name], declared_type) for name, declared_type in schema]
+
+
+# Строки из массивов столбцов порциями: tolist() переводит срез массива в объекты Python
+# одним проходом на C, кортежи строк собираются zip-ом и не хранятся все сразу
+def iter_column_chunks(columns, chunk_size=DEFAULT_CHUNK_SIZE):
+    total = len(columns[0]) if columns else 0
+    for start in range(0, total, chunk_size):
+        yield zip(*(column[start:start + chunk_size].tolist() for column in columns))
+
+
+# Загрузка DataFrame в существующую таблицу по столбцам; возвращает число строк.
+# on_batch(строки) вызывается после вставки каждой порции (строки в порядке столбцов columns)
+@profiled
+def load_dataframe_to_db(conn, df, table, columns=None, chunk_size=DEFAULT_CHUNK_SIZE, on_batch=None):
+    cursor = conn.cursor()
+    schema = table_schema(cursor, table)
+    if columns is not None:
+        declared = dict(schema)
+        schema = [(name, declared[name]) for name in columns]
+    arrays = dataframe_to_columns(df, schema)
+    placeholders = ', '.join('?' * len(schema))
+    insert_sql = f"INSERT INTO {table} ({', '.join(name for name, _ in schema)}) VALUES ({placeholders})"
+    with transaction(conn):
+        for rows in iter_column_chunks(arrays, chunk_size):
+            if on_batch is not None:
+                rows = list(rows)
+            cursor.executemany(insert_sql, rows)
+            if on_batch is not None:
+                on_batch(rows)
+    return len(df)
+
+
+# Загрузка msgpack-файла по столбцам: пакеты записей превращаются в DataFrame, приводятся
+# к типам таблицы и вставляются порциями; память определяется размером пакета
+def load_msgpack_columnar(conn, filename, table, columns=None, batch_size=DEFAULT_CHUNK_SIZE,
+                          read_size=DEFAULT_READ_SIZE, use_mmap=False):
+    total = 0
+    with transaction(conn):
+        for batch in iter_batches(iter_msgpack_items(filename, read_size, use_mmap), batch_size):
+            frame = pd.DataFrame.from_records(batch)
+            total += load_dataframe_to_db(conn, frame, table, columns, batch_size)
+    return total
+
+
+# Чтение pickle-файла с продажами (список словарей или DataFrame) в DataFrame
+def read_pickle_frame(filename):
+    data = pd.read_pickle(filename)
+    if isinstance(data, list):
+        data = pd.DataFrame(data)
+    return data
@@ -0,0 +1,278 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from common.profiling import PROFILE_ENABLED, instrument_connection
+from common.query_cache import database_path, invalidate
+
+# Настройки соединения по умолчанию:
+# WAL позволяет читать во время записи, synchronous=NORMAL в режиме WAL безопасен и заметно быстрее FULL,
+# cache_size < 0 задаётся в КБ (64 МБ), mmap_size - в байтах (256 МБ)
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+# Настройки на время массовой загрузки: журнал в памяти и без fsync
+BULK_LOAD_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+}
+
+# Размер кэша подготовленных запросов соединения (по умолчанию в sqlite3 - 128):
+# запросы построителя (common.query_builder) одной формы компилируются один раз
+STATEMENT_CACHE_SIZE = 256
+
+# Рабочая копия базы в памяти (включается переменной окружения LAB4_IN_MEMORY=1).
+# При первом открытии файл базы целиком копируется в базу memdb (общую для всех соединений процесса,
+# в том числе потока записи common.parallel_ingest), загрузка, изменения и запросы идут в памяти,
+# а результат сохраняется в файл контрольной точкой (checkpoint): при close_all() в конце скрипта
+# и, если задана LAB4_CHECKPOINT_INTERVAL=<секунды>, после фиксации транзакции, когда с прошлой
+# контрольной точки прошло больше этого времени. Контрольная точка пишется во временный файл рядом
+# с базой и заменяет её через os.replace, поэтому прерванный или упавший запуск оставляет файл
+# в состоянии последней контрольной точки (без интервала - прежним). Другие процессы, читающие файл
+# (например, common.report_service), видят изменения только после контрольной точки
+IN_MEMORY_ENABLED = os.environ.get('LAB4_IN_MEMORY') == '1'
+CHECKPOINT_INTERVAL = float(os.environ.get('LAB4_CHECKPOINT_INTERVAL', '0'))
+
+# Рабочие копии в памяти: абсолютный путь к файлу -> {'name', 'uri', 'anchor', 'version', 'saved_at'}.
+# anchor - служебное соединение, которое держит базу memdb открытой (она удаляется с последним
+# соединением) и через которое выполняются контрольные точки; version - PRAGMA data_version на момент
+# последней контрольной точки (меняется при каждой фиксации изменений другими соединениями)
+_memory = {}
+
+# Открытые соединения: (абсолютный путь к файлу, id потока) -> соединение.
+# sqlite3-соединение нельзя использовать из другого потока, поэтому у каждого потока своё
+_connections = {}
+_lock = threading.Lock()
+
+
+def _key(path):
+    if path == ':memory:':
+        return path, threading.get_ident()
+    return os.path.abspath(path), threading.get_ident()
+
+
+def set_pragmas(conn, pragmas):
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+
+
+def get_pragmas(conn, names):
+    return {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in names}
+
+
+# Рабочая копия файла в памяти (создаётся при первом обращении). Файл читается через serialize,
+# в копии страница 1 помечается как база без WAL (байты 18-19 заголовка; у базы в режиме WAL memdb
+# пытается открыть журнал и не открывается), затем страницы переносятся в memdb через backup
+def _memory_copy(path):
+    copy = _memory.get(path)
+    if copy is not None:
+        return copy
+    name = f"/lab4-{os.getpid()}-{hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]}"
+    uri = f"file:{name}?vfs=memdb"
+    anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    if os.path.exists(path) and os.path.getsize(path):
+        disk = sqlite3.connect(path)
+        try:
+            data = bytearray(disk.serialize())
+        finally:
+            disk.close()
+        data[18:20] = b'\x01\x01'
+        staging = sqlite3.connect(':memory:')
+        try:
+            staging.deserialize(bytes(data))
+            del data
+            staging.backup(anchor)
+        finally:
+            staging.close()
+    copy = _memory[path] = {'name': name, 'uri': uri, 'anchor': anchor, 'version': None, 'saved_at': time.monotonic()}
+    if os.path.exists(path):
+        copy['version'] = anchor.execute("PRAGMA data_version").fetchone()[0]
+    return copy
+
+
+# Запись копии в файл: изменения из WAL-журнала файла сначала переносятся в сам файл (иначе прежний
+# журнал применился бы к новому файлу), копия пишется через backup во временный файл, который
+# сбрасывается на диск и атомарно заменяет базу; затем на диск сбрасывается и запись каталога
+def _write_copy(anchor, path):
+    if os.path.exists(path + '-wal'):
+        disk = sqlite3.connect(path)
+        try:
+            disk.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            disk.close()
+    tmp = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    try:
+        target = sqlite3.connect(tmp)
+        try:
+            anchor.backup(target)
+        finally:
+            target.close()
+        fd = os.open(tmp, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if os.name == 'posix':
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def _checkpoint_copy(path, copy):
+    version = copy['anchor'].execute("PRAGMA data_version").fetchone()[0]
+    if version == copy['version'] and os.path.exists(path):
+        return False
+    _write_copy(copy['anchor'], path)
+    copy['version'], copy['saved_at'] = version, time.monotonic()
+    return True
+
+
+# Контрольная точка рабочей копии базы path: запись в файл, если с прошлой контрольной точки были
+# зафиксированы изменения. Незафиксированные транзакции в копию не попадают, поэтому вызывать её
+# нужно, когда ни одно соединение с базой не держит открытую транзакцию записи (backup её ждёт).
+# Возвращает True, если файл записан
+def checkpoint(path):
+    with _lock:
+        copy = _memory.get(os.path.abspath(path))
+    if copy is None:
+        return False
+    return _checkpoint_copy(os.path.abspath(path), copy)
+
+
+# Контрольная точка по интервалу LAB4_CHECKPOINT_INTERVAL после фиксации транзакции transaction()
+# (и загрузки bulk_load()) соединения conn
+def _maybe_checkpoint(conn):
+    if not (_memory and CHECKPOINT_INTERVAL > 0):
+        return
+    name = conn.execute("PRAGMA database_list").fetchone()[2]
+    with _lock:
+        found = [(path, copy) for path, copy in _memory.items() if copy['name'] == name]
+    for path, copy in found:
+        if time.monotonic() - copy['saved_at'] >= CHECKPOINT_INTERVAL:
+            _checkpoint_copy(path, copy)
+
+
+# Получение соединения с базой из пула; при первом открытии применяются настройки pragmas,
+# а при включённом профилировании подключается учёт запросов. В режиме LAB4_IN_MEMORY
+# соединение открывается к рабочей копии файла в памяти
+def get_connection(path, pragmas=None):
+    key = _key(path)
+    with _lock:
+        conn = _connections.get(key)
+        if conn is None:
+            if IN_MEMORY_ENABLED and path != ':memory:':
+                conn = sqlite3.connect(_memory_copy(key[0])['uri'], uri=True, cached_statements=STATEMENT_CACHE_SIZE)
+            else:
+                conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+            set_pragmas(conn, {**DEFAULT_PRAGMAS, **(pragmas or {})})
+            if PROFILE_ENABLED:
+                instrument_connection(conn)
+            _connections[key] = conn
+        return conn
+
+
+# Закрытие соединения с базой в текущем потоке
+def close_connection(path):
+    with _lock:
+        conn = _connections.pop(_key(path), None)
+    if conn is not None:
+        conn.commit()
+        conn.close()
+
+
+# Закрытие всех соединений; рабочие копии в памяти при checkpoint=True сохраняются в файлы,
+# при checkpoint=False отбрасываются. При завершении процесса вызывается автоматически без
+# контрольной точки: скрипт, упавший до своего close_all(), не перезаписывает базу
+def close_all(checkpoint=True):
+    with _lock:
+        connections = list(_connections.values())
+        _connections.clear()
+        copies = list(_memory.items())
+        _memory.clear()
+    for conn in connections:
+        try:
+            conn.commit()
+            conn.close()
+        except sqlite3.ProgrammingError:
+            # Соединение принадлежит другому, уже завершённому потоку
+            pass
+    try:
+        for path, copy in copies:
+            if checkpoint:
+                _checkpoint_copy(path, copy)
+    finally:
+        for _, copy in copies:
+            copy['anchor'].close()
+
+
+atexit.register(close_all, checkpoint=False)
+
+
+# Транзакция: COMMIT при успешном выходе, ROLLBACK при исключении.
+# Если транзакция уже открыта, блок выполняется внутри неё, а фиксирует её внешний владелец
+@contextmanager
+def transaction(conn):
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    _maybe_checkpoint(conn)
+
+
+# Массовая загрузка: журналирование ослабляется на время загрузки и восстанавливается после неё,
+# вся загрузка выполняется в одной транзакции. Если режим журнала сменить нельзя
+# (к базе в режиме WAL подключены другие соединения), он остаётся прежним. Если транзакция уже открыта,
+# загрузка выполняется внутри неё, как в transaction(), без смены настроек журнала (внутри транзакции
+# их не сменить), а фиксирует её внешний владелец. После загрузки кэш результатов запросов к этой базе
+# сбрасывается
+@contextmanager
+def bulk_load(conn, pragmas=None):
+    if conn.in_transaction:
+        try:
+            yield conn
+        finally:
+            _invalidate_cache(conn)
+        return
+    settings = {**BULK_LOAD_PRAGMAS, **(pragmas or {})}
+    saved = get_pragmas(conn, settings)
+    for name, value in settings.items():
+        try:
+            set_pragmas(conn, {name: value})
+        except sqlite3.OperationalError:
+            del saved[name]
+    try:
+        with transaction(conn):
+            yield conn
+    finally:
+        set_pragmas(conn, saved)
+        _invalidate_cache(conn)
+
+
+def _invalidate_cache(conn):
+    path = database_path(conn)
+    if path:
+        invalidate(path)
@@ -0,0 +1,210 @@
+import os
+import re
+
+# Словарное кодирование категориальных столбцов (включается переменной окружения LAB4_DICTIONARY=1).
+# После загрузки и построения индексов таблица переименовывается в <таблица>_data, вместо каждого
+# категориального столбца в ней хранится целый код <столбец>_id из словаря <таблица>_<столбец>_dict,
+# а под прежним именем создаётся представление с прежними столбцами в прежнем порядке, поэтому запросы
+# чтения не меняются. Коды выдаются в порядке значений, так что группировка по коду даёт группы в том же
+# порядке, что и GROUP BY по тексту. Перед следующей загрузкой таблица раскодируется обратно
+# (decode_tables), и загрузчики пишут в обычную таблицу, как и без кодирования
+DICTIONARY_ENABLED = os.environ.get('LAB4_DICTIONARY') == '1'
+
+# Категориальные столбцы нагрузок: список (таблица, столбец)
+CATEGORICAL_COLUMNS = {
+    'books': [('books', 'genre')],
+    'books_and_sales': [('books', 'genre'), ('subitems', 'place')],
+    'songs': [('songs', 'genre')],
+    'products': [('products', 'category'), ('products', 'fromCity')],
+    'cars': [('CarDetails', 'Vehicle_type')],
+}
+
+# Многозначные столбцы (значения через разделитель, например "hip hop, pop, rock"): отдельные значения
+# хранятся в словаре values, пары (код значения, ключ строки) - в таблице связей junction без rowid,
+# первичный ключ которой начинается с кода значения
+MULTI_VALUED_COLUMNS = {
+    'songs': {
+        'key': 'id',
+        'column': 'genre',
+        'separator': ',',
+        'values': 'genres',
+        'junction': 'song_genres',
+        'value_key': 'genre_id',
+        'row_key': 'song_id',
+    },
+}
+
+# Закодированные таблицы: исходное определение таблицы и список закодированных столбцов
+CATALOG = 'dictionary_tables'
+
+
+def dictionary_table(table, column):
+    return f"{table}_{column}_dict"
+
+
+def data_table(table):
+    return f"{table}_data"
+
+
+def _table_exists(cursor, name, kind='table'):
+    row = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (kind, name)).fetchone()
+    return row is not None
+
+
+# Закодированные столбцы таблицы (пустой список, если таблица не закодирована)
+def encoded_columns(cursor, table):
+    if not _table_exists(cursor, CATALOG):
+        return []
+    row = cursor.execute(f"SELECT columns FROM {CATALOG} WHERE name = ?", (table,)).fetchone()
+    return row[0].split(',') if row else []
+
+
+# Кодирование одной таблицы. Триггеры таблицы (сводки common.summaries) снимаются: после кодирования
+# таблица только читается, а при следующей загрузке сводки создаются заново. Триггеры других таблиц,
+# которые читают эту таблицу (сводка продаж на subitems читает books), на время кодирования тоже снимаются:
+# иначе перестройка схемы при DROP COLUMN не находит таблицу под прежним именем. После создания
+# представления с прежним именем они создаются снова. Переименование выполняется в режиме
+# legacy_alter_table, чтобы внешние ключи других таблиц (subitems -> books) не переписывались на <таблица>_data
+def _encode_table(cursor, table, columns):
+    data = data_table(table)
+    ddl = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    names = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+    triggers = cursor.execute("SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    reference = re.compile(rf'\b{re.escape(table)}\b', re.IGNORECASE)
+    readers = [sql for _, tbl_name, sql in triggers if tbl_name != table and reference.search(sql)]
+    for trigger, tbl_name, sql in triggers:
+        if tbl_name == table or reference.search(sql):
+            cursor.execute(f"DROP TRIGGER {trigger}")
+
+    cursor.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        cursor.execute(f"ALTER TABLE {table} RENAME TO {data}")
+    finally:
+        cursor.execute("PRAGMA legacy_alter_table = OFF")
+
+    for column in columns:
+        dictionary = dictionary_table(table, column)
+        cursor.execute(f"DROP TABLE IF EXISTS {dictionary}")
+        cursor.execute(f"CREATE TABLE {dictionary} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+        cursor.execute(f"INSERT INTO {dictionary} (value) "
+                       f"SELECT DISTINCT {column} FROM {data} WHERE {column} IS NOT NULL ORDER BY {column}")
+        cursor.execute(f"ALTER TABLE {data} ADD COLUMN {column}_id INTEGER REFERENCES {dictionary} (id)")
+        cursor.execute(f"UPDATE {data} SET {column}_id = (SELECT id FROM {dictionary} WHERE value = {data}.{column})")
+        cursor.execute(f"ALTER TABLE {data} DROP COLUMN {column}")
+
+    # Статистика планировщика (ANALYZE) переходит к переименованной таблице, поэтому планы запросов не меняются
+    if _table_exists(cursor, 'sqlite_stat1'):
+        cursor.execute("UPDATE sqlite_stat1 SET tbl = ? WHERE tbl = ?", (data, table))
+    cursor.execute(f"CREATE VIEW {table} AS SELECT {_decoded_select(table, names, columns)} FROM {data} AS t")
+    for sql in readers:
+        cursor.execute(sql)
+    cursor.execute(f"INSERT INTO {CATALOG} (name, sql, columns) VALUES (?, ?, ?)", (table, ddl, ','.join(columns)))
+
+
+# Столбцы в исходном порядке; значение категориального столбца - подзапрос к словарю по коду. В отличие
+# от соединения, подзапрос вычисляется, только если столбец выбран, и не мешает покрывающим индексам
+def _decoded_select(table, names, columns):
+    select = []
+    for name in names:
+        if name in columns:
+            select.append(f"(SELECT value FROM {dictionary_table(table, name)} WHERE id = t.{name}_id) AS {name}")
+        else:
+            select.append(f"t.{name} AS {name}")
+    return ', '.join(select)
+
+
+# Кодирование категориальных столбцов нагрузки (уже закодированные таблицы пропускаются).
+# Освободившиеся страницы возвращаются VACUUM, иначе файл базы не уменьшится
+def encode_tables(conn, workload):
+    cursor = conn.cursor()
+    by_table = {}
+    for table, column in CATEGORICAL_COLUMNS[workload]:
+        by_table.setdefault(table, []).append(column)
+    conn.commit()
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {CATALOG} "
+                   f"(name TEXT PRIMARY KEY, sql TEXT NOT NULL, columns TEXT NOT NULL)")
+    encoded = False
+    for table, columns in by_table.items():
+        if encoded_columns(cursor, table) or not _table_exists(cursor, table):
+            continue
+        _encode_table(cursor, table, columns)
+        encoded = True
+    conn.commit()
+    if encoded:
+        cursor.execute("VACUUM")
+
+
+# Раскодирование всех закодированных таблиц базы: таблица пересоздаётся по исходному определению
+# с прежними rowid и счётчиком AUTOINCREMENT, словари удаляются. Индексы таблицы при этом удаляются,
+# загрузчики строят их заново. Вызывается перед созданием таблиц при каждой загрузке (и без LAB4_DICTIONARY,
+# чтобы база, закодированная прежним запуском, снова стала записываемой)
+def decode_tables(conn):
+    cursor = conn.cursor()
+    if not _table_exists(cursor, CATALOG):
+        return
+    rows = cursor.execute(f"SELECT name, sql, columns FROM {CATALOG}").fetchall()
+    if not rows:
+        return
+    for table, ddl, columns in rows:
+        columns = columns.split(',')
+        data = data_table(table)
+        names = [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]
+        select = _decoded_select(table, names, columns)
+        cursor.execute(f"DROP VIEW {table}")
+        cursor.execute(ddl)
+        cursor.execute(f"INSERT INTO {table} (rowid, {', '.join(names)}) SELECT t.rowid, {select} FROM {data} AS t")
+        if _table_exists(cursor, 'sqlite_sequence'):
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+            cursor.execute("UPDATE sqlite_sequence SET name = ? WHERE name = ?", (table, data))
+        cursor.execute(f"DROP TABLE {data}")
+        for column in columns:
+            cursor.execute(f"DROP TABLE {dictionary_table(table, column)}")
+        cursor.execute(f"DELETE FROM {CATALOG} WHERE name = ?", (table,))
+    conn.commit()
+
+
+# Частота значений закодированного столбца с группировкой по целому коду в таблице <таблица>_data;
+# count_nulls=True - COUNT(*), иначе COUNT(столбец). None, если столбец не закодирован
+def encoded_frequency_query(cursor, table, column, count_nulls=False):
+    if column not in encoded_columns(cursor, table):
+        return None
+    code = f"{column}_id"
+    count = 'COUNT(*)' if count_nulls else f"COUNT({code})"
+    return (f"SELECT d.value AS {column}, f.frequency AS frequency "
+            f"FROM (SELECT {code}, {count} AS frequency FROM {data_table(table)} GROUP BY {code}) AS f "
+            f"LEFT JOIN {dictionary_table(table, column)} AS d ON d.id = f.{code} ORDER BY f.{code}")
+
+
+# Пересборка словаря отдельных значений и таблицы связей многозначного столбца. Коды значений
+# выдаются в порядке значений, повторы значения в одной строке учитываются один раз
+def build_junction(cursor, table):
+    spec = MULTI_VALUED_COLUMNS[table]
+    values, junction = spec['values'], spec['junction']
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {values} (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+    cursor.execute(f'''CREATE TABLE IF NOT EXISTS {junction} (
+                       {spec['value_key']} INTEGER NOT NULL REFERENCES {values} (id),
+                       {spec['row_key']} INTEGER NOT NULL,
+                       PRIMARY KEY ({spec['value_key']}, {spec['row_key']})) WITHOUT ROWID''')
+    cursor.execute(f"DELETE FROM {junction}")
+    cursor.execute(f"DELETE FROM {values}")
+
+    pairs = []
+    for key, text in cursor.execute(
+            f"SELECT {spec['key']}, {spec['column']} FROM {table} WHERE {spec['column']} IS NOT NULL"):
+        for value in str(text).split(spec['separator']):
+            value = value.strip()
+            if value:
+                pairs.append((value, key))
+    ids = {value: n for n, value in enumerate(sorted({value for value, _ in pairs}), 1)}
+    cursor.executemany(f"INSERT INTO {values} (id, value) VALUES (?, ?)", ((n, value) for value, n in ids.items()))
+    cursor.executemany(f"INSERT OR IGNORE INTO {junction} ({spec['value_key']}, {spec['row_key']}) VALUES (?, ?)",
+                       ((ids[value], key) for value, key in pairs))
+
+
+# Частота отдельных значений многозначного столбца: один проход по первичному ключу таблицы связей
+# (группы идут в порядке кодов, то есть значений), без временного B-дерева для GROUP BY
+def value_frequency_query(table):
+    spec = MULTI_VALUED_COLUMNS[table]
+    value_key = spec['value_key']
+    return (f"SELECT v.value AS {spec['column']}, COUNT(*) AS frequency FROM {spec['junction']} AS j "
+            f"JOIN {spec['values']} AS v ON v.id = j.{value_key} GROUP BY j.{value_key}")
@@ -0,0 +1,136 @@
+import hashlib
+import os
+from datetime import datetime
+
+from common.db import transaction
+
+# Режимы загрузки источника: пропустить, дочитать дописанный хвост, загрузить целиком
+SKIP = 'skip'
+TAIL = 'tail'
+FULL = 'full'
+
+# Сколько байтов перед концом загруженной части хешируется для проверки, что файл только дописывали
+ANCHOR_SIZE = 64 * 1024
+
+# Размер блока чтения при хешировании (1 МБ)
+HASH_CHUNK_SIZE = 1 << 20
+
+# Отпечатки загруженных источников: размер и время изменения файла, до какого байта он загружен,
+# хеш последних ANCHOR_SIZE байтов загруженной части и хеш всей загруженной части [0, offset)
+SOURCES_DDL = '''CREATE TABLE IF NOT EXISTS source_files (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime_ns INTEGER,
+    offset INTEGER,
+    anchor_hash TEXT,
+    content_hash TEXT,
+    ingested_at TEXT
+)'''
+
+
+# SHA-256 байтов [start, end) файла, чтение блоками
+def file_hash(filename, start=0, end=None):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        remaining = (os.path.getsize(filename) if end is None else end) - start
+        while remaining > 0:
+            chunk = f.read(min(HASH_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+
+def anchor_hash(filename, offset):
+    return file_hash(filename, max(0, offset - ANCHOR_SIZE), offset)
+
+
+def _key(filename):
+    return os.path.abspath(filename)
+
+
+# Состояние файла (os.stat), увиденное source_state: загрузка читает файл только до этого размера,
+# а record_source сохраняет в отпечатке именно его. Строки, дописанные во время загрузки, отпечаток
+# не покрывает, и следующий запуск дочитает их как хвост
+_observed = {}
+
+
+# Размер файла, увиденный source_state (или текущий)
+def observed_size(filename):
+    stat = _observed.get(_key(filename))
+    return stat.st_size if stat is not None else os.path.getsize(filename)
+
+
+# Байт, до которого загрузка читает файл: граница последней полной записи в увиденном размере
+# (boundary - common.text_records.record_boundary или line_boundary; без него - весь файл). Недописанная
+# запись в конце файла не загружается: её дочитает следующий запуск, когда запись будет закончена
+def load_end(filename, boundary=None):
+    size = observed_size(filename)
+    return boundary(filename, size) if boundary is not None else size
+
+
+# Что делать с источником: (режим, байт начала загрузки).
+# - файл не загружался или загруженная часть изменилась -> FULL с начала;
+# - размер и время изменения совпадают с отпечатком -> SKIP без чтения файла;
+# - иначе загруженная часть [0, offset) сверяется с отпечатком целиком (сначала дешёвая проверка последних
+#   ANCHOR_SIZE байтов): если она не изменилась, файл только дописан -> TAIL с прежнего смещения
+#   (SKIP, если после смещения ничего нет). Правка на месте без изменения размера или правка вместе
+#   с дописыванием дают FULL.
+# appendable=False - формат нельзя дописать без изменения начала файла (msgpack- и JSON-массивы),
+# такой файл либо не изменился, либо загружается целиком
+def source_state(cursor, filename, appendable=True):
+    cursor.execute(SOURCES_DDL)
+    stat = _observed[_key(filename)] = os.stat(filename)
+    row = cursor.execute("SELECT size, mtime_ns, offset, anchor_hash, content_hash FROM source_files WHERE path = ?",
+                         (_key(filename),)).fetchone()
+    if row is None:
+        return FULL, 0
+    size, mtime_ns, offset, anchor, content = row
+    if stat.st_size == size and stat.st_mtime_ns == mtime_ns:
+        return SKIP, offset
+    if (content is not None and stat.st_size >= offset and (appendable or stat.st_size == offset)
+            and anchor_hash(filename, offset) == anchor and file_hash(filename, 0, offset) == content):
+        return (SKIP, offset) if stat.st_size == offset else (TAIL, offset)
+    return FULL, 0
+
+
+# Сохранение отпечатка после загрузки файла целиком или его хвоста до load_end(filename, boundary):
+# сохраняются размер и время изменения, увиденные source_state, смещение конца последней полной записи
+# и хеши загруженной части
+def record_source(cursor, filename, boundary=None):
+    cursor.execute(SOURCES_DDL)
+    offset = load_end(filename, boundary)
+    stat = _observed.pop(_key(filename), None) or os.stat(filename)
+    content = file_hash(filename, 0, offset)
+    cursor.execute('''INSERT INTO source_files (path, size, mtime_ns, offset, anchor_hash, content_hash, ingested_at)
+                      VALUES (?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT (path) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns,
+                          offset = excluded.offset, anchor_hash = excluded.anchor_hash,
+                          content_hash = excluded.content_hash, ingested_at = excluded.ingested_at''',
+                   (_key(filename), stat.st_size, stat.st_mtime_ns, offset,
+                    anchor_hash(filename, offset), content, datetime.now().isoformat(timespec='seconds')))
+
+
+# Сброс отпечатков: следующий запуск загрузит файлы целиком
+def forget_sources(cursor, filenames=None):
+    cursor.execute(SOURCES_DDL)
+    if filenames is None:
+        cursor.execute("DELETE FROM source_files")
+    else:
+        cursor.executemany("DELETE FROM source_files WHERE path = ?", [(_key(name),) for name in filenames])
+
+
+# Загрузка источника с учётом отпечатка: load(start, end) читает байты [start, end) и вызывается только
+# для нового или изменённого файла, после неё сохраняется новый отпечаток (boundary - как в record_source).
+# Возвращает режим загрузки
+def ingest_source(conn, filename, load, appendable=True, boundary=None):
+    cursor = conn.cursor()
+    mode, start = source_state(cursor, filename, appendable)
+    if mode == SKIP:
+        return mode
+    load(start, load_end(filename, boundary))
+    with transaction(conn):
+        record_source(cursor, filename, boundary=boundary)
+    return mode
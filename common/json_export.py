@@ -0,0 +1,102 @@
+import json
+import os
+from contextlib import nullcontext
+
+from common.binary_export import (ROW_GROUP_SIZE, abort_columns, add_item, binary_filename, clear_columns,
+                                  close_columns, new_columns, open_columns, parse_compression, parse_formats,
+                                  write_row_group)
+from common.profiling import profiled
+
+# Режим вывода по умолчанию можно задать переменной окружения LAB4_JSON_EXPORT_MODE:
+#   pretty - массив с отступами, как у json.dump(..., indent=...)
+#   compact - массив без пробелов
+#   ndjson - по одному объекту в строке
+DEFAULT_MODE = os.environ.get('LAB4_JSON_EXPORT_MODE', 'pretty')
+MODES = ('pretty', 'compact', 'ndjson')
+
+
+# Строки результата пакетами: у курсора читаем через fetchmany, остальное просто перебираем
+def iter_rows(rows, batch_size=1000):
+    if hasattr(rows, 'fetchmany'):
+        while True:
+            batch = rows.fetchmany(batch_size)
+            if not batch:
+                break
+            yield from batch
+    else:
+        yield from rows
+
+
+# Потоковая запись строк результата в JSON: элементы массива пишутся по одному,
+# поэтому память не зависит от числа строк. В режиме pretty вывод совпадает с json.dump
+# с тем же indent. formats - форматы вывода через '+' (common.binary_export): json и/или колоночные
+# msgpack и npz, которые пишутся рядом с JSON-файлом группами по row_group_size строк.
+# Возвращает число записанных элементов
+@profiled
+def write_json_rows(filename, rows, to_item=None, indent=None, ensure_ascii=False, mode=None,
+                    batch_size=1000, formats=None, row_group_size=ROW_GROUP_SIZE):
+    mode = mode or DEFAULT_MODE
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим вывода JSON: {mode}")
+    formats = parse_formats(formats)
+    # Для колоночных форматов элементы накапливаются по столбцам до размера группы строк
+    binary = [fmt for fmt in formats if fmt != 'json']
+    compression, level = parse_compression() if binary else (None, None)
+    writers = [open_columns(binary_filename(filename, fmt), fmt, compression, level) for fmt in binary]
+    columns = new_columns() if writers else None
+
+    if mode == 'pretty':
+        dumps_kwargs = {'indent': indent, 'ensure_ascii': ensure_ascii}
+        if indent is None:
+            opening, separator, closing = '[', ', ', ']'
+        else:
+            pad = ' ' * indent if isinstance(indent, int) else indent
+            opening, separator, closing = '[\n' + pad, ',\n' + pad, '\n]'
+    else:
+        pad = None
+        dumps_kwargs = {'separators': (',', ':'), 'ensure_ascii': ensure_ascii}
+        if mode == 'compact':
+            opening, separator, closing = '[', ',', ']'
+        else:
+            opening, separator, closing = '', '\n', '\n'
+
+    count = 0
+    try:
+        with open(filename, 'w', encoding='utf-8') if 'json' in formats else nullcontext() as f:
+            for row in iter_rows(rows, batch_size):
+                item = to_item(row) if to_item is not None else row
+                if columns is not None:
+                    add_item(columns, item)
+                    if columns['rows'] >= row_group_size:
+                        _flush_row_group(writers, columns)
+                if f is not None:
+                    text = json.dumps(item, **dumps_kwargs)
+                    if mode == 'pretty' and indent is not None:
+                        text = text.replace('\n', '\n' + pad)
+                    f.write(separator if count else opening)
+                    f.write(text)
+                count += 1
+
+            if f is not None:
+                if count:
+                    f.write(closing)
+                elif mode != 'ndjson':
+                    f.write('[]')
+
+        if columns is not None:
+            if columns['rows']:
+                _flush_row_group(writers, columns)
+            for writer in writers:
+                close_columns(writer, columns)
+    except BaseException:
+        # Недописанные колоночные файлы не остаются рядом с JSON
+        for writer in writers:
+            abort_columns(writer)
+        raise
+    return count
+
+
+def _flush_row_group(writers, columns):
+    for writer in writers:
+        write_row_group(writer, columns)
+    clear_columns(columns)
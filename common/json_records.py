@@ -0,0 +1,55 @@
+import json
+import re
+
+from common.msgpack_records import DEFAULT_READ_SIZE
+
+_WHITESPACE = re.compile(r'\s*')
+_DELIMITERS = frozenset(',] \t\r\n')
+
+
+# Потоковое чтение элементов JSON-массива верхнего уровня (как car_sales.json): файл читается
+# порциями по read_size символов, элементы разбираются по одному, и весь массив никогда не строится
+# в памяти целиком. Элемент, не поместившийся в прочитанную часть, разбирается после дочитывания
+def iter_json_array(filename, read_size=DEFAULT_READ_SIZE):
+    decoder = json.JSONDecoder()
+    with open(filename, 'r', encoding='utf-8') as f:
+        buffer, position, eof = '', 0, False
+        # start - до '[', first - первый элемент или ']', value - элемент после ',', separator - ',' или ']'
+        state = 'start'
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position < len(buffer):
+                char = buffer[position]
+                if state == 'start':
+                    if char != '[':
+                        raise ValueError(f"{filename}: ожидается JSON-массив")
+                    position += 1
+                    state = 'first'
+                    continue
+                if char == ']' and state in ('first', 'separator'):
+                    return
+                if state == 'separator':
+                    if char != ',':
+                        raise ValueError(f"{filename}: ожидается ',' в позиции {position}")
+                    position += 1
+                    state = 'value'
+                    continue
+                end = None
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                # Элемент принимается, только если за ним в прочитанной части уже виден разделитель:
+                # число в конце порции ("2" из "2.5") может продолжаться в следующей
+                if end is not None and (eof or end < len(buffer) and buffer[end] in _DELIMITERS):
+                    yield item
+                    position = end
+                    state = 'separator'
+                    continue
+            if eof:
+                raise ValueError(f"{filename}: JSON-массив не закрыт")
+            chunk = f.read(read_size)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
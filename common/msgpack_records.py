@@ -0,0 +1,104 @@
+import mmap
+from contextlib import contextmanager
+
+import msgpack
+
+from common.db import transaction
+from common.profiling import profiled
+from common.text_records import iter_batches
+
+# Размер порции, которую Unpacker читает из файла за один раз (256 КБ)
+DEFAULT_READ_SIZE = 256 * 1024
+
+BOOK_COLUMNS = ['title', 'author', 'genre', 'pages', 'published_year', 'isbn', 'rating', 'views']
+SONG_COLUMNS = ['artist', 'song', 'duration_ms', 'year', 'tempo', 'genre', 'instrumentalness', 'explicit', 'loudness']
+
+
+# Преобразование записи книги из item.msgpack в типизированный кортеж
+def book_row(item):
+    return (
+        item.get('title'),
+        item.get('author'),
+        item.get('genre'),
+        int(item['pages']) if item.get('pages') is not None else None,
+        int(item['published_year']) if item.get('published_year') is not None else None,
+        item.get('isbn'),
+        float(item['rating']) if item.get('rating') is not None else None,
+        int(item['views']) if item.get('views') is not None else None,
+    )
+
+
+# Преобразование записи песни из _part_2.msgpack в типизированный кортеж
+def song_row(item):
+    return (
+        item.get('artist', ''),
+        item.get('song', ''),
+        int(item.get('duration_ms', 0)),
+        int(item.get('year', 0)),
+        float(item.get('tempo', 0.0)),
+        item.get('genre', ''),
+        float(item.get('instrumentalness', 0.0)),
+        str(item.get('explicit', 'False')).lower() == 'true',
+        float(item.get('loudness', 0.0)),
+    )
+
+
+# Источник байтов для Unpacker: обычный файл или отображение файла в память (mmap),
+# во втором случае декодер читает данные прямо из страничного кэша без промежуточного буфера файла
+@contextmanager
+def _open_source(filename, use_mmap):
+    with open(filename, 'rb') as f:
+        if not use_mmap:
+            yield f
+            return
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Пустой файл нельзя отобразить в память
+            yield f
+            return
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+# Потоковое чтение объектов из msgpack-файла.
+# Если файл содержит один массив верхнего уровня (как item.msgpack), элементы массива
+# выдаются по одному, и весь массив никогда не строится в памяти целиком
+def iter_msgpack_items(filename, read_size=DEFAULT_READ_SIZE, use_mmap=False):
+    with _open_source(filename, use_mmap) as source:
+        first = source.read(1)
+        if not first:
+            return
+        source.seek(0)
+
+        unpacker = msgpack.Unpacker(source, read_size=read_size, raw=False)
+        if 0x90 <= first[0] <= 0x9f or first[0] in (0xdc, 0xdd):
+            for _ in range(unpacker.read_array_header()):
+                yield unpacker.unpack()
+        else:
+            yield from unpacker
+
+
+# Пакеты типизированных кортежей фиксированного размера
+def iter_msgpack_batches(filename, to_row, batch_size=1000, read_size=DEFAULT_READ_SIZE, use_mmap=False):
+    rows = (to_row(item) for item in iter_msgpack_items(filename, read_size, use_mmap))
+    return iter_batches(rows, batch_size)
+
+
+# Загрузка msgpack-файла в таблицу в рамках одной транзакции (или внутри уже открытой).
+# Пиковое потребление памяти определяется размером пакета, а не размером файла;
+# on_batch(строки) вызывается после вставки каждого пакета (например, common.sketches.observe_batch)
+@profiled
+def load_msgpack_to_db(conn, filename, insert_sql, to_row, batch_size=1000,
+                       read_size=DEFAULT_READ_SIZE, use_mmap=False, on_batch=None):
+    total = 0
+    with transaction(conn):
+        cursor = conn.cursor()
+        for batch in iter_msgpack_batches(filename, to_row, batch_size, read_size, use_mmap):
+            cursor.executemany(insert_sql, batch)
+            total += len(batch)
+            if on_batch is not None:
+                on_batch(batch)
+    return total
@@ -0,0 +1,147 @@
+import os
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from common.db import bulk_load, close_connection, get_connection
+from common.msgpack_records import DEFAULT_READ_SIZE, iter_msgpack_batches
+from common.text_records import RECORD_SEPARATOR, parse_text_range, split_line_ranges
+
+# Параллельная загрузка включается переменной окружения LAB4_PARALLEL=1
+PARALLEL_ENABLED = os.environ.get('LAB4_PARALLEL') == '1'
+
+# Число процессов разбора по умолчанию
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Сколько разобранных частей может ждать записи одновременно. Каждая часть ограничена (DEFAULT_TASK_BYTES
+# текста или DEFAULT_STREAM_BATCH строк msgpack), поэтому память не растёт с размером файла
+DEFAULT_MAX_PENDING = 2 * DEFAULT_WORKERS + 2
+
+# Объём текстового файла на одну задачу разбора (8 МБ)
+DEFAULT_TASK_BYTES = 8 * 1024 * 1024
+
+# Строк в одном пакете потокового разбора msgpack
+DEFAULT_STREAM_BATCH = 10000
+
+# Признак конца очереди записи, когда загрузка прервана ошибкой: поток записи откатывает транзакцию
+_ABORT = object()
+
+
+# Прерывание потока записи по _ABORT (не ошибка записи: исключение пробрасывает поток загрузки)
+class _Aborted(Exception):
+    pass
+
+
+# Задача разбора: функция выполняется в процессе-разборщике и возвращает
+# список пар (SQL вставки, строки). Функции и аргументы должны сериализоваться pickle
+def parse_task(func, *args):
+    return func, args, False
+
+
+# Потоковая задача: функция-генератор выполняется в процессе загрузки (пока пул разбирает следующие задачи)
+# и выдаёт ограниченные пакеты - списки пар (SQL вставки, строки), каждый передаётся потоку записи по очереди
+def stream_task(func, *args):
+    return func, args, True
+
+
+# Обёртка для функций, возвращающих просто строки одной таблицы
+def insert_rows(insert_sql, func, *args):
+    return [(insert_sql, list(func(*args)))]
+
+
+# Потоковый разбор msgpack-файла пакетами по batch_size строк (msgpack-массив нельзя разрезать без разбора)
+def iter_msgpack_statements(filename, to_row, insert_sql, batch_size=DEFAULT_STREAM_BATCH, read_size=DEFAULT_READ_SIZE):
+    for rows in iter_msgpack_batches(filename, to_row, batch_size, read_size):
+        yield [(insert_sql, rows)]
+
+
+# Число частей, на которые делятся первые end байтов файла (None - весь файл), чтобы каждая часть
+# была около task_bytes байтов
+def task_parts(filename, task_bytes=DEFAULT_TASK_BYTES, end=None):
+    size = os.path.getsize(filename) if end is None else end
+    return max(1, -(-size // task_bytes))
+
+
+# Задачи разбора текстового файла key::value частями около task_bytes байтов по границам записей
+# (первые end байтов, None - весь файл)
+def text_source_tasks(filename, fields, insert_sql, task_bytes=DEFAULT_TASK_BYTES, end=None):
+    parts = task_parts(filename, task_bytes, end)
+    return [parse_task(insert_rows, insert_sql, parse_text_range, filename, fields, start, stop)
+            for start, stop in split_line_ranges(filename, parts, separator=RECORD_SEPARATOR, end=end)]
+
+
+# Потоковая задача разбора msgpack-файла
+def msgpack_source_task(filename, to_row, insert_sql):
+    return stream_task(iter_msgpack_statements, filename, to_row, insert_sql)
+
+
+# Поток записи: единственный владелец соединения, выполняет вставки строго в порядке задач
+def _writer(db_path, items, errors, setup, on_batch):
+    try:
+        conn = get_connection(db_path)
+        with bulk_load(conn):
+            cursor = conn.cursor()
+            for sql in setup:
+                cursor.execute(sql)
+            while True:
+                statements = items.get()
+                if statements is None:
+                    break
+                if statements is _ABORT:
+                    raise _Aborted()
+                for insert_sql, rows in statements:
+                    cursor.executemany(insert_sql, rows)
+                    if on_batch is not None:
+                        on_batch(rows)
+        close_connection(db_path)
+    except _Aborted:
+        pass
+    except BaseException as e:
+        errors.append(e)
+        # Дочитываем очередь, чтобы поток-отправитель не заблокировался
+        while True:
+            statements = items.get()
+            if statements is None or statements is _ABORT:
+                break
+
+
+# Передача потоку записи результата задачи пула или всех пакетов потоковой задачи
+def _put_result(items, result):
+    if isinstance(result, Future):
+        items.put(result.result())
+    else:
+        for statements in result:
+            items.put(statements)
+
+
+# Параллельная загрузка: задачи разбираются в пуле процессов (потоковые - в процессе загрузки),
+# результаты передаются
+# через очередь потоку записи в порядке задач, поэтому порядок и содержимое строк
+# совпадают с последовательной загрузкой. setup - SQL, который поток записи выполняет перед вставками
+# (например, создание временных таблиц его соединения); on_batch(строки) поток записи вызывает
+# после вставки строк каждой задачи, в том же порядке. Если задача разбора упала, поток записи
+# откатывает транзакцию (как последовательная загрузка) и исключение задачи пробрасывается дальше
+def run_parallel_ingest(db_path, tasks, max_workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING, setup=(),
+                        on_batch=None):
+    items = queue.Queue(maxsize=max_pending)
+    errors = []
+    writer = threading.Thread(target=_writer, args=(db_path, items, errors, setup, on_batch), daemon=True)
+    writer.start()
+    try:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            pending = deque()
+            for func, args, streamed in tasks:
+                pending.append(func(*args) if streamed else pool.submit(func, *args))
+                if len(pending) >= max_pending:
+                    _put_result(items, pending.popleft())
+            while pending:
+                _put_result(items, pending.popleft())
+    except BaseException:
+        items.put(_ABORT)
+        writer.join()
+        raise
+    items.put(None)
+    writer.join()
+    if errors:
+        raise errors[0]
@@ -0,0 +1,10 @@
+import os
+
+# Каталог исходных файлов задач 1-2 (item.msgpack, subitem.pkl): переменная окружения LAB4_DATA_DIR,
+# по умолчанию - прежний каталог. Задачи 3-5 читают файлы из текущего каталога
+DATA_DIR = os.environ.get('LAB4_DATA_DIR', r"E:\66\lab4\task1-2")
+
+
+# Путь к исходному файлу name в каталоге directory (по умолчанию DATA_DIR)
+def data_path(name, directory=None):
+    return os.path.join(directory or DATA_DIR, name)
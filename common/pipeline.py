@@ -0,0 +1,419 @@
+import argparse
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+from common.db import close_all, get_connection
+from common.incremental import file_hash, forget_sources
+from common.paths import DATA_DIR
+from common.sketches import SKETCHES_ENABLED
+
+# Конвейер задач 1-5 с объявленными этапами: исходные файлы -> таблица -> индексы -> запросы -> файлы вывода.
+# Этапы без зависимостей друг от друга (разные задачи, выгрузки одной базы) выполняются параллельно
+# в пуле процессов. Этап пропускается, как в make, если не изменились его ключ и файлы вывода на месте.
+# Ключ этапа - хеш функции и аргументов, кода (скрипт задачи и модули репозитория, которые он импортирует,
+# транзитивно), содержимого исходных файлов, настроек SETTINGS и ключей этапов, от которых он зависит. Этап выполняется заново
+# и тогда, когда в этом запуске выполнялся этап, от которого он зависит.
+# Ключи выполненных этапов и отпечатки исходных файлов хранятся в STATE_FILE в каталоге вывода задачи;
+# хеш файла пересчитывается, только если изменились его размер или время изменения.
+#
+# Каталоги задаются параметрами или файлом настроек (JSON {"sources": {...}, "outputs": {...}}):
+#   python -m common.pipeline --source task1=/data/task1-2 --source task2=/data/task1-2 --output task1=/out
+#   python -m common.pipeline --config pipeline.json --tasks task3 task5 --dry-run
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STATE_FILE = '.lab4_pipeline.json'
+
+TASKS = ['task1', 'task2', 'task3', 'task4', 'task5']
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# Переменные окружения, от которых зависят базы и файлы вывода этапов (словарное кодирование, индексы
+# поиска, скетчи, сводки, форматы выгрузки): после их смены этапы выполняются заново. Параллельная
+# загрузка, работа в памяти, профилирование и кэш запросов результат не меняют и в ключ не входят
+SETTINGS = ['LAB4_DICTIONARY', 'LAB4_SEARCH', 'LAB4_SKETCHES', 'LAB4_ROLLUPS', 'LAB4_SUMMARIES',
+            'LAB4_EXPORT_FORMAT', 'LAB4_EXPORT_COMPRESSION', 'LAB4_JSON_EXPORT_MODE']
+
+
+# Каталоги по умолчанию: исходные файлы задач 1-2 - common.paths.DATA_DIR (LAB4_DATA_DIR), задач 3-5 -
+# каталоги задач; вывод задач 1-2 - корень репозитория (скрипты запускаются из него), задач 3-5 - их каталоги
+def default_paths():
+    task_dirs = {task: os.path.join(ROOT, task) for task in ('task3', 'task4', 'task5')}
+    return {
+        'sources': {'task1': DATA_DIR, 'task2': DATA_DIR, **task_dirs},
+        'outputs': {'task1': ROOT, 'task2': ROOT, **task_dirs},
+    }
+
+
+# Описание этапа: функция function скрипта script (путь от корня репозитория) с аргументами args
+# выполняется в каталоге workdir. sources - исходные файлы, after - этапы, после которых он выполняется,
+# outputs - создаваемые файлы (относительно workdir). reset=True - при изменении кода этапа базы из outputs
+# забывают отпечатки загруженных источников (common.incremental) и загружаются заново целиком
+def stage(name, script, function, args=(), sources=(), after=(), outputs=(), workdir=ROOT, reset=False):
+    return {'name': name, 'script': script, 'function': function, 'args': list(args), 'sources': list(sources),
+            'after': list(after), 'outputs': list(outputs), 'workdir': os.path.abspath(workdir), 'reset': reset}
+
+
+# Этапы задач; paths - каталоги исходных файлов и вывода (default_paths). Выгрузки перцентилей из скетчей
+# входят в конвейер, как и в скрипты задач, только при LAB4_SKETCHES=1
+def pipeline_stages(paths, tasks=TASKS):
+    sources, outputs = paths['sources'], paths['outputs']
+    stages = []
+
+    if 'task1' in tasks:
+        workdir = outputs['task1']
+        item = os.path.join(sources['task1'], 'item.msgpack')
+        stages += [
+            stage('task1:table', 'lab4_1.py', 'load_books', [item], sources=[item], outputs=['books.db'],
+                  workdir=workdir),
+            stage('task1:index', 'lab4_1.py', 'build_indexes', after=['task1:table'], workdir=workdir),
+            stage('task1:top_books', 'lab4_1.py', 'export_top_books', after=['task1:index'],
+                  outputs=['top_books.json'], workdir=workdir),
+            stage('task1:filtered_books', 'lab4_1.py', 'export_filtered_books', after=['task1:index'],
+                  outputs=['filtered_books.json'], workdir=workdir),
+        ]
+
+    if 'task2' in tasks:
+        workdir = outputs['task2']
+        item, subitem = (os.path.join(sources['task2'], name) for name in ('item.msgpack', 'subitem.pkl'))
+        stages += [
+            stage('task2:table', 'lab4_2.py', 'load_tables', [item, subitem], sources=[item, subitem],
+                  outputs=['books_and_sales.db'], workdir=workdir),
+            stage('task2:index', 'lab4_2.py', 'build_indexes', after=['task2:table'], workdir=workdir),
+            stage('task2:prices_and_places', 'lab4_2.py', 'display_book_prices_and_places', after=['task2:index'],
+                  outputs=['book_prices_and_places.json'], workdir=workdir),
+            stage('task2:reports', 'lab4_2.py', 'run_book_reports', after=['task2:index'],
+                  outputs=['average_price_and_sales_by_genre.json', 'cheapest_and_most_expensive_books.json'],
+                  workdir=workdir),
+        ]
+        if SKETCHES_ENABLED:
+            stages.append(stage('task2:price_percentiles', 'lab4_2.py', 'export_price_percentiles',
+                                after=['task2:index'], outputs=['price_percentiles.json'], workdir=workdir))
+
+    if 'task3' in tasks:
+        workdir = outputs['task3']
+        msgpack_file, text_file = (os.path.join(sources['task3'], name) for name in ('_part_2.msgpack', '_part_1.text'))
+        script = os.path.join('task3', 'lab4_3.py')
+        stages += [
+            stage('task3:table', script, 'build_songs_table', [msgpack_file, text_file],
+                  sources=[msgpack_file, text_file], outputs=['songs_database.db'], workdir=workdir, reset=True),
+            stage('task3:index', script, 'build_indexes', after=['task3:table'], workdir=workdir),
+            stage('task3:first_sorted', script, 'export_first_sorted_to_json', [66, 'duration_ms'],
+                  after=['task3:index'], outputs=['first_sorted.json'], workdir=workdir),
+            stage('task3:aggregate', script, 'export_aggregate_results', ['tempo'], after=['task3:index'],
+                  outputs=['aggregate_results.json'], workdir=workdir),
+            stage('task3:frequency', script, 'export_categorical_frequency', ['genre'], after=['task3:index'],
+                  outputs=['categorical_frequency.json'], workdir=workdir),
+            stage('task3:genre_frequency', script, 'export_genre_frequency', after=['task3:index'],
+                  outputs=['genre_frequency.json'], workdir=workdir),
+            stage('task3:filtered_sorted', script, 'export_filtered_sorted_to_json', [66, [['year', '>', 2000]], 'year'],
+                  after=['task3:index'], outputs=['filtered_sorted.json'], workdir=workdir),
+        ]
+        if SKETCHES_ENABLED:
+            stages.append(stage('task3:duration_percentiles', script, 'export_duration_percentiles',
+                                after=['task3:index'], outputs=['duration_percentiles.json'], workdir=workdir))
+
+    if 'task4' in tasks:
+        workdir = outputs['task4']
+        text_file, csv_file = (os.path.join(sources['task4'], name) for name in ('_product_data.text', '_update_data.csv'))
+        script = os.path.join('task4', 'lab4_4.py')
+        # Индекс по name нужен для применения журнала изменений, поэтому строится на этапе таблицы
+        stages += [
+            stage('task4:table', script, 'build_products_table', [text_file, csv_file], sources=[text_file, csv_file],
+                  outputs=['fourth_task.db'], workdir=workdir, reset=True),
+            stage('task4:top_updated', script, 'export_top_updated_products', after=['task4:table'],
+                  outputs=['top_updated_products.json'], workdir=workdir),
+            stage('task4:category_analysis', script, 'export_category_analysis', after=['task4:table'],
+                  outputs=['price_analysis.json', 'quantity_analysis.json'], workdir=workdir),
+            stage('task4:custom', script, 'export_custom_query', after=['task4:table'],
+                  outputs=['custom_query_result.json'], workdir=workdir),
+        ]
+
+    if 'task5' in tasks:
+        workdir = outputs['task5']
+        json_file, csv_file = (os.path.join(sources['task5'], name) for name in ('car_sales.json', 'car_sales1.csv'))
+        script = os.path.join('task5', 'lab4_5.py')
+        stages += [
+            stage('task5:table', script, 'load_tables', ['data_frame.db', json_file, csv_file],
+                  sources=[json_file, csv_file], outputs=['data_frame.db'], workdir=workdir, reset=True),
+            stage('task5:index', script, 'build_indexes', ['data_frame.db'], after=['task5:table'], workdir=workdir),
+            stage('task5:results', script, 'export_results', ['data_frame.db'], after=['task5:index'],
+                  outputs=['result1-выборка.json', 'result2-сортировка.json', 'result3-агрегация.json',
+                           'result4-группировка.json', 'result5-выборка_макс_объем.json',
+                           'result6-выборка_длина_более_180.json'],
+                  workdir=workdir),
+        ]
+    return stages
+
+
+# Файл модуля репозитория по имени (common.db -> common/db.py) или None для сторонних модулей
+def _repo_module(name):
+    base = os.path.join(ROOT, *name.split('.'))
+    for candidate in (base + '.py', os.path.join(base, '__init__.py')):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+# Файлы кода скрипта: сам скрипт и модули репозитория, которые он импортирует (транзитивно)
+def code_files(path, seen=None):
+    seen = set() if seen is None else seen
+    path = os.path.abspath(path)
+    if path in seen:
+        return seen
+    seen.add(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names = [node.module] + [f"{node.module}.{alias.name}" for alias in node.names]
+        elif isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        else:
+            continue
+        for name in names:
+            module_file = _repo_module(name)
+            if module_file is not None:
+                code_files(module_file, seen)
+    return seen
+
+
+def code_hash(script):
+    digest = hashlib.sha256()
+    for path in sorted(code_files(os.path.join(ROOT, script))):
+        digest.update(os.path.relpath(path, ROOT).encode())
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+# Хеш содержимого исходного файла; сохранённый хеш используется, пока не изменились размер и время изменения
+def source_hash(path, known):
+    stat = os.stat(path)
+    entry = known.get(path)
+    if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': file_hash(path)}
+        known[path] = entry
+    return entry['hash']
+
+
+def load_state(workdir):
+    try:
+        with open(os.path.join(workdir, STATE_FILE), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    state.setdefault('stages', {})
+    state.setdefault('sources', {})
+    return state
+
+
+# Запись состояния через временный файл и os.replace: прерванный запуск не оставляет половину файла
+def save_state(workdir, state):
+    filename = os.path.join(workdir, STATE_FILE)
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, filename)
+
+
+# Порядок этапов, в котором каждый идёт после своих зависимостей; неизвестная зависимость или цикл - ошибка
+def topological_order(stages):
+    by_name = {item['name']: item for item in stages}
+    order, visiting, done = [], set(), set()
+
+    def visit(item):
+        name = item['name']
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Цикл зависимостей этапов: {name}")
+        visiting.add(name)
+        for dependency in item['after']:
+            if dependency not in by_name:
+                raise ValueError(f"Этап {name} зависит от неизвестного этапа {dependency}")
+            visit(by_name[dependency])
+        visiting.discard(name)
+        done.add(name)
+        order.append(item)
+
+    for item in stages:
+        visit(item)
+    return order
+
+
+_modules = {}
+
+
+def _load_script(script):
+    module = _modules.get(script)
+    if module is None:
+        name = os.path.splitext(os.path.basename(script))[0]
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, script))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[script] = module
+    return module
+
+
+# Выполнение этапа в процессе пула; возвращает время выполнения. Рабочие копии баз в памяти
+# (LAB4_IN_MEMORY) сохраняются только после успешного этапа, упавший этап оставляет файлы прежними
+def _run_stage(script, function, args, workdir, reset_databases):
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    os.chdir(workdir)
+    started = time.perf_counter()
+    try:
+        for db_file in reset_databases:
+            conn = get_connection(db_file)
+            forget_sources(conn.cursor())
+            conn.commit()
+        getattr(_load_script(script), function)(*args)
+    except BaseException:
+        close_all(checkpoint=False)
+        raise
+    close_all()
+    return time.perf_counter() - started
+
+
+# Выполнение этапов: готовые этапы (все зависимости завершены) отправляются в пул сразу, актуальные
+# пропускаются. force=True - выполнить все этапы, dry_run=True - только показать, что будет выполнено.
+# Возвращает {этап: 'run' | 'skip' | 'failed' | 'blocked'}
+def run_pipeline(stages, workers=DEFAULT_WORKERS, force=False, dry_run=False, log=print):
+    pending = topological_order(stages)
+    states = {}
+    codes = {}
+    keys = {}
+    results = {}
+    running = {}
+    settings = {name: os.environ.get(name) for name in SETTINGS}
+
+    def state_of(item):
+        if item['workdir'] not in states:
+            states[item['workdir']] = load_state(item['workdir'])
+        return states[item['workdir']]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for item in list(pending):
+                name = item['name']
+                if any(dependency not in results for dependency in item['after']):
+                    continue
+                pending.remove(item)
+                if any(results[dependency] in ('failed', 'blocked') for dependency in item['after']):
+                    results[name] = 'blocked'
+                    log(f"[не выполнен] {name}: не выполнены зависимости")
+                    continue
+
+                state = state_of(item)
+                missing = [path for path in item['sources'] if not os.path.isfile(path)]
+                if missing:
+                    results[name] = 'failed'
+                    log(f"[ошибка] {name}: нет исходного файла {missing[0]}")
+                    continue
+                if item['script'] not in codes:
+                    codes[item['script']] = code_hash(item['script'])
+                code = codes[item['script']]
+                payload = {
+                    'function': f"{item['script']}:{item['function']}",
+                    'args': item['args'],
+                    'outputs': item['outputs'],
+                    'code': code,
+                    'sources': [source_hash(path, state['sources']) for path in item['sources']],
+                    'settings': settings,
+                    'after': [keys[dependency] for dependency in item['after']],
+                }
+                key = keys[name] = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+                recorded = state['stages'].get(name)
+                up_to_date = (not force and recorded is not None and recorded['key'] == key
+                              and all(os.path.exists(os.path.join(item['workdir'], path)) for path in item['outputs'])
+                              and not any(results[dependency] == 'run' for dependency in item['after']))
+                if up_to_date:
+                    results[name] = 'skip'
+                    log(f"[актуален] {name}")
+                    continue
+                if dry_run:
+                    results[name] = 'run'
+                    log(f"[будет выполнен] {name}")
+                    continue
+
+                reset = item['reset'] and recorded is not None and recorded.get('code') != code
+                databases = [path for path in item['outputs'] if path.endswith('.db')] if reset else []
+                future = pool.submit(_run_stage, item['script'], item['function'], item['args'], item['workdir'],
+                                     databases)
+                running[future] = (item, key, code)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                item, key, code = running.pop(future)
+                name = item['name']
+                try:
+                    seconds = future.result()
+                except Exception as e:
+                    results[name] = 'failed'
+                    log(f"[ошибка] {name}: {type(e).__name__}: {e}")
+                    continue
+                results[name] = 'run'
+                state = state_of(item)
+                state['stages'][name] = {'key': key, 'code': code, 'seconds': round(seconds, 3),
+                                         'finished_at': datetime.now().isoformat(timespec='seconds')}
+                save_state(item['workdir'], state)
+                log(f"[выполнен] {name}: {seconds:.2f} с")
+
+    # Отпечатки исходных файлов сохраняются и у пропущенных этапов, чтобы не хешировать файлы повторно
+    if not dry_run:
+        for workdir, state in states.items():
+            save_state(workdir, state)
+    return results
+
+
+# Каталоги из файла настроек и параметров ИМЯ=КАТАЛОГ поверх каталогов по умолчанию
+def resolve_paths(config=None, sources=(), outputs=()):
+    paths = default_paths()
+    if config:
+        with open(config, 'r', encoding='utf-8') as f:
+            settings = json.load(f)
+        for kind in ('sources', 'outputs'):
+            paths[kind].update(settings.get(kind, {}))
+    for kind, items in (('sources', sources), ('outputs', outputs)):
+        for item in items:
+            task, _, directory = item.partition('=')
+            if task not in TASKS or not directory:
+                raise ValueError(f"Ожидается ЗАДАЧА=КАТАЛОГ, ЗАДАЧА из {', '.join(TASKS)}: {item!r}")
+            paths[kind][task] = directory
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Конвейер задач 1-5 с пропуском актуальных этапов')
+    parser.add_argument('--tasks', nargs='+', default=TASKS, choices=TASKS)
+    parser.add_argument('--config', help='JSON с каталогами {"sources": {...}, "outputs": {...}}')
+    parser.add_argument('--source', action='append', default=[], metavar='ЗАДАЧА=КАТАЛОГ',
+                        help='каталог исходных файлов задачи')
+    parser.add_argument('--output', action='append', default=[], metavar='ЗАДАЧА=КАТАЛОГ',
+                        help='каталог базы и файлов вывода задачи')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--force', action='store_true', help='выполнить все этапы')
+    parser.add_argument('--dry-run', action='store_true', help='только показать, какие этапы будут выполнены')
+    args = parser.parse_args(argv)
+
+    try:
+        paths = resolve_paths(args.config, args.source, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+    for task in args.tasks:
+        os.makedirs(paths['outputs'][task], exist_ok=True)
+    results = run_pipeline(pipeline_stages(paths, args.tasks), args.workers, args.force, args.dry_run)
+    sys.exit(1 if any(result in ('failed', 'blocked') for result in results.values()) else 0)
+
+
+if __name__ == '__main__':
+    main()
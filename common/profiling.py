@@ -0,0 +1,245 @@
+import atexit
+import functools
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import nullcontext
+
+# Профилирование включается переменной окружения LAB4_PROFILE=1; LAB4_PROFILE_TRACE=<файл> дополнительно
+# сохраняет трассу в формате Chrome Trace (chrome://tracing, Perfetto). Без них декоратор profiled
+# возвращает функцию без изменений, а span - пустой контекст, поэтому выключенное профилирование ничего не стоит
+TRACE_FILE = os.environ.get('LAB4_PROFILE_TRACE')
+PROFILE_ENABLED = os.environ.get('LAB4_PROFILE') == '1' or bool(TRACE_FILE)
+
+# Обработчик прогресса SQLite вызывается раз в PROGRESS_STEPS инструкций виртуальной машины
+PROGRESS_STEPS = 100
+
+# Ограничение числа событий SQL в трассе (executemany даёт событие на каждую строку)
+MAX_TRACE_EVENTS = 100000
+
+_started = time.perf_counter()
+_lock = threading.Lock()
+_local = threading.local()
+_spans = []
+_statements = {}
+_events = []
+_connections = []
+
+# Литералы в тексте запроса (trace-callback получает запрос с подставленными параметрами): строки, числа
+# со знаком (минус после имени или скобки - вычитание, а не знак) и NULL, кроме IS NULL и NOT NULL
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![\w)])-?\d+(?:\.\d+)?(?:e[-+]?\d+)?\b|(?<!\bIS )(?<!\bNOT )\bNULL\b",
+                       re.IGNORECASE)
+
+
+def _now_us():
+    return (time.perf_counter() - _started) * 1e6
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+# Запрос без литералов: одинаковые запросы с разными параметрами учитываются вместе
+def normalize_sql(sql):
+    return ' '.join(_LITERALS.sub('?', sql).split())
+
+
+# Учёт выполнения запросов на соединении: trace-callback отмечает начало каждого запроса,
+# обработчик прогресса считает шаги виртуальной машины (с точностью до PROGRESS_STEPS).
+# Время запроса - от его начала до последнего вызова обработчика прогресса, поэтому работа Python
+# между запросами в него не попадает, а запросы короче PROGRESS_STEPS инструкций получают нулевое время
+def instrument_connection(conn):
+    state = {'sql': None, 'start': 0.0, 'last': 0.0, 'steps': 0}
+
+    def finish():
+        if state['sql'] is None:
+            return
+        elapsed = state['last'] - state['start']
+        with _lock:
+            stats = _statements.setdefault(state['sql'], [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] += state['steps']
+            if len(_events) < MAX_TRACE_EVENTS:
+                _events.append({'name': state['sql'][:120], 'cat': 'sql', 'ph': 'X', 'ts': state['start'],
+                                'dur': elapsed, 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                'args': {'vm_steps': state['steps']}})
+        state['sql'] = None
+
+    def on_statement(sql):
+        finish()
+        state['sql'] = normalize_sql(sql)
+        state['start'] = state['last'] = _now_us()
+        state['steps'] = 0
+
+    def on_progress():
+        state['steps'] += PROGRESS_STEPS
+        state['last'] = _now_us()
+        return 0
+
+    conn.set_trace_callback(on_statement)
+    conn.set_progress_handler(on_progress, PROGRESS_STEPS)
+    _drop_closed_connections()
+    with _lock:
+        _connections.append((conn, finish))
+    return conn
+
+
+def _is_closed(conn):
+    try:
+        conn.total_changes
+        return False
+    except sqlite3.ProgrammingError:
+        return True
+
+
+# Закрытые соединения удаляются из учёта (их последний запрос учитывается), чтобы список не рос
+# и не держал соединения
+def _drop_closed_connections():
+    with _lock:
+        closed = [(conn, finish) for conn, finish in _connections if _is_closed(conn)]
+        _connections[:] = [(conn, finish) for conn, finish in _connections if not _is_closed(conn)]
+    for _, finish in closed:
+        finish()
+
+
+def _finish_statements():
+    with _lock:
+        finishers = [finish for _, finish in _connections]
+    for finish in finishers:
+        finish()
+
+
+def _total_changes():
+    total = 0
+    for conn, _ in list(_connections):
+        if not _is_closed(conn):
+            total += conn.total_changes
+    return total
+
+
+# Число обработанных строк по результату функции: число (write_json_rows), длина списка,
+# иначе - число строк, изменённых в базе за время этапа
+def _count_rows(result, changes):
+    if isinstance(result, bool):
+        return changes
+    if isinstance(result, int):
+        return result
+    if isinstance(result, list):
+        return len(result)
+    return changes
+
+
+class _Span:
+    def __init__(self, name):
+        self.name = name
+        self.rows = None
+
+    def __enter__(self):
+        stack = _stack()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1].max_peak = max(stack[-1].max_peak, peak)
+        tracemalloc.reset_peak()
+        self.memory = current
+        self.max_peak = current
+        self.changes = _total_changes()
+        self.start = _now_us()
+        stack.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _finish_statements()
+        end = _now_us()
+        stack = _stack()
+        stack.pop()
+        peak = max(self.max_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        if stack:
+            stack[-1].max_peak = max(stack[-1].max_peak, peak)
+        changes = _total_changes() - self.changes
+        rows = self.rows if self.rows is not None else changes
+        with _lock:
+            _spans.append({'name': self.name, 'start': self.start, 'dur': end - self.start, 'rows': rows,
+                           'peak': peak - self.memory, 'depth': len(stack), 'tid': threading.get_ident()})
+        return False
+
+
+# Этап с ручным учётом строк: with span('загрузка') as s: ...; s.rows = n
+def span(name):
+    if not PROFILE_ENABLED:
+        return nullcontext()
+    return _Span(name)
+
+
+# Декоратор этапа: время, строки, строки в секунду и пик памяти для каждого вызова функции
+def profiled(func=None, name=None):
+    if func is None:
+        return functools.partial(profiled, name=name)
+    if not PROFILE_ENABLED:
+        return func
+
+    label = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _Span(label) as current:
+            result = func(*args, **kwargs)
+            _finish_statements()
+            current.rows = _count_rows(result, _total_changes() - current.changes)
+        return result
+
+    return wrapper
+
+
+# Отчёт: этапы в порядке завершения и самые дорогие запросы по суммарному времени
+def format_report(top=15):
+    lines = ['Профиль: этапы',
+             f"{'этап':50} {'время, с':>10} {'строк':>10} {'строк/с':>12} {'пик, МБ':>9}"]
+    for item in sorted(_spans, key=lambda s: s['start']):
+        seconds = item['dur'] / 1e6
+        rate = f"{item['rows'] / seconds:.0f}" if item['rows'] and seconds else ''
+        label = '  ' * item['depth'] + item['name']
+        lines.append(f"{label[:50]:50} {seconds:>10.4f} {item['rows'] or '':>10} {rate:>12} "
+                     f"{item['peak'] / 2 ** 20:>9.2f}")
+    lines.append('Профиль: запросы SQL')
+    lines.append(f"{'запрос':70} {'вызовов':>8} {'время, с':>10} {'шагов VM':>12}")
+    ranked = sorted(_statements.items(), key=lambda item: item[1][1], reverse=True)[:top]
+    for sql, (calls, elapsed, steps) in ranked:
+        lines.append(f"{sql[:70]:70} {calls:>8} {elapsed / 1e6:>10.4f} {steps:>12}")
+    return '\n'.join(lines)
+
+
+def chrome_trace():
+    events = [{'name': item['name'], 'cat': 'stage', 'ph': 'X', 'ts': item['start'], 'dur': item['dur'],
+               'pid': os.getpid(), 'tid': item['tid'], 'args': {'rows': item['rows'], 'peak_bytes': item['peak']}}
+              for item in _spans]
+    return {'traceEvents': events + _events, 'displayTimeUnit': 'ms'}
+
+
+def write_chrome_trace(filename):
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(), f)
+
+
+# Отчёт выводится в stderr при завершении процесса, трасса пишется в LAB4_PROFILE_TRACE
+def _report_at_exit():
+    _finish_statements()
+    if not _spans and not _statements:
+        return
+    print(format_report(), file=sys.stderr)
+    if TRACE_FILE:
+        write_chrome_trace(TRACE_FILE)
+
+
+if PROFILE_ENABLED:
+    atexit.register(_report_at_exit)
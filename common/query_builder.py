@@ -0,0 +1,179 @@
+import re
+
+from common.query_cache import cached_query
+
+# Построитель запросов для выборок с произвольными полями и фильтрами.
+# Имена таблиц и столбцов проверяются по белому списку COLUMNS, значения фильтров и LIMIT передаются
+# параметрами. Поэтому запросы одной формы (те же столбцы и операторы, другие значения) дают один
+# и тот же текст SQL: он компилируется один раз и дальше берётся из кэша подготовленных запросов соединения
+
+# Разрешённые столбцы таблиц: имя -> тип ('numeric' - можно агрегировать и сравнивать, 'text')
+COLUMNS = {
+    'songs': {
+        'id': 'numeric',
+        'artist': 'text',
+        'song': 'text',
+        'duration_ms': 'numeric',
+        'year': 'numeric',
+        'tempo': 'numeric',
+        'genre': 'text',
+        'instrumentalness': 'numeric',
+        'explicit': 'numeric',
+        'loudness': 'numeric',
+    },
+}
+
+# Операторы фильтров: оператор -> число значений (None - список значений для IN)
+OPERATORS = {
+    '=': 1, '!=': 1, '<': 1, '<=': 1, '>': 1, '>=': 1,
+    'LIKE': 1, 'BETWEEN': 2, 'IN': None, 'IS NULL': 0, 'IS NOT NULL': 0,
+}
+
+AGGREGATES = ('SUM', 'MIN', 'MAX', 'AVG', 'COUNT')
+
+# Простое условие в виде строки: "<столбец> <оператор> <число или 'строка'>", условия через AND
+_CONDITION = re.compile(r"\s*(\w+)\s*(<=|>=|!=|<>|=|<|>)\s*(-?\d+(?:\.\d+)?|'(?:[^']|'')*')\s*", re.ASCII)
+_AND = re.compile(r"AND\b", re.IGNORECASE)
+
+
+def _literal(text):
+    if text.startswith("'"):
+        return text[1:-1].replace("''", "'")
+    return float(text) if '.' in text else int(text)
+
+
+# Разбор строкового фильтра вида "year > 2000 AND genre = 'pop'" в список условий (столбец, оператор, значение).
+# Другие выражения не принимаются: строка не попадает в SQL как есть
+def parse_filter(text):
+    conditions = []
+    position = 0
+    while True:
+        match = _CONDITION.match(text, position)
+        if match is None:
+            raise ValueError(f"Неподдерживаемый фильтр: {text!r}")
+        column, operator, value = match.groups()
+        conditions.append((column, '!=' if operator == '<>' else operator, _literal(value)))
+        position = match.end()
+        if position == len(text):
+            return conditions
+        separator = _AND.match(text, position)
+        if separator is None:
+            raise ValueError(f"Неподдерживаемый фильтр: {text!r}")
+        position = separator.end()
+
+
+def check_column(table, column, kind=None):
+    columns = COLUMNS.get(table)
+    if columns is None:
+        raise ValueError(f"Неизвестная таблица: {table!r}")
+    if column not in columns:
+        raise ValueError(f"Неизвестный столбец {table}.{column}")
+    if kind is not None and columns[column] != kind:
+        raise ValueError(f"Столбец {table}.{column} не {kind}")
+    return column
+
+
+# Условия фильтра -> (текст WHERE без значений, параметры). where - строка для parse_filter
+# или список условий (столбец, оператор[, значение]); у BETWEEN значение - пара, у IN - список
+def where_clause(table, where):
+    if not where:
+        return '', []
+    if isinstance(where, str):
+        where = parse_filter(where)
+    parts = []
+    params = []
+    for condition in where:
+        column, operator = check_column(table, condition[0]), condition[1].upper()
+        if operator not in OPERATORS:
+            raise ValueError(f"Неизвестный оператор: {condition[1]!r}")
+        arity = OPERATORS[operator]
+        if arity == 0:
+            parts.append(f"{column} {operator}")
+            continue
+        value = condition[2]
+        if arity is None:
+            values = list(value)
+            if not values:
+                raise ValueError(f"Пустой список значений IN для {column}")
+            parts.append(f"{column} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+        elif arity == 2:
+            parts.append(f"{column} BETWEEN ? AND ?")
+            params.extend(value)
+        else:
+            parts.append(f"{column} {operator} ?")
+            params.append(value)
+    return ' WHERE ' + ' AND '.join(parts), params
+
+
+# SELECT строк таблицы -> (sql, параметры); order_by - столбец сортировки, limit передаётся параметром
+def select_query(table, columns=None, where=None, order_by=None, descending=False, limit=None):
+    select = ', '.join(check_column(table, column) for column in columns) if columns else '*'
+    clause, params = where_clause(table, where)
+    sql = f"SELECT {select} FROM {table}{clause}"
+    if order_by is not None:
+        sql += f" ORDER BY {check_column(table, order_by)}" + (" DESC" if descending else "")
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(int(limit))
+    return sql, params
+
+
+# Агрегаты числовых столбцов за один проход -> (sql, параметры); строка результата -
+# значения functions для каждого столбца fields по порядку
+def aggregate_query(table, fields, functions=('SUM', 'MIN', 'MAX', 'AVG'), where=None):
+    expressions = []
+    for field in fields:
+        check_column(table, field, 'numeric')
+        for function in functions:
+            if function.upper() not in AGGREGATES:
+                raise ValueError(f"Неизвестная агрегатная функция: {function!r}")
+            expressions.append(f"{function.upper()}({field})")
+    clause, params = where_clause(table, where)
+    return f"SELECT {', '.join(expressions)} FROM {table}{clause}", params
+
+
+# Частоты значений столбца -> (sql, параметры); строки результата - (значение, частота)
+def frequency_query(table, field, where=None):
+    check_column(table, field)
+    clause, params = where_clause(table, where)
+    return f"SELECT {field}, COUNT({field}) AS frequency FROM {table}{clause} GROUP BY {field}", params
+
+
+def _filter_key(where):
+    if isinstance(where, str):
+        where = parse_filter(where)
+    return tuple((c[0], c[1].upper(), tuple(c[2]) if len(c) > 2 and isinstance(c[2], (list, tuple)) else c[2:])
+                 for c in where or ())
+
+
+# Пакет агрегатов для многих сочетаний (поле, фильтр): сочетания с одинаковым фильтром считаются
+# одним запросом за один проход по таблице. Возвращает список кортежей значений functions
+# в порядке combinations
+def batch_aggregates(conn, table, combinations, functions=('SUM', 'MIN', 'MAX', 'AVG')):
+    groups = {}
+    for field, where in combinations:
+        group = groups.setdefault(_filter_key(where), {'where': where, 'fields': []})
+        if field not in group['fields']:
+            group['fields'].append(field)
+
+    values = {}
+    for key, group in groups.items():
+        sql, params = aggregate_query(table, group['fields'], functions, group['where'])
+        row = cached_query(conn, sql, params)[0]
+        width = len(functions)
+        for n, field in enumerate(group['fields']):
+            values[(field, key)] = tuple(row[n * width:(n + 1) * width])
+    return [values[(field, _filter_key(where))] for field, where in combinations]
+
+
+# Пакет произвольных запросов (sql, параметры): список результатов в том же порядке.
+# Запросы одной формы выполняются подряд, чтобы подготовленный запрос брался из кэша соединения
+def execute_batch(conn, queries):
+    queries = list(queries)
+    order = sorted(range(len(queries)), key=lambda n: queries[n][0])
+    results = [None] * len(queries)
+    for n in order:
+        sql, params = queries[n]
+        results[n] = cached_query(conn, sql, params)
+    return results
@@ -0,0 +1,213 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+
+# Кэш результатов запросов отчётов. Ключ - (файл базы, версия файла, нормализованный SQL, параметры),
+# версия файла - размер и время изменения файла базы и его WAL-журнала, поэтому любая зафиксированная
+# запись в базу (из этого или другого процесса) даёт новый ключ. Изменения, сделанные в этом процессе,
+# дополнительно отслеживаются по PRAGMA data_version и total_changes соединения: если они изменились,
+# а версия файла ещё нет (запись в пределах одного тика часов файловой системы), записи базы сбрасываются.
+#
+# Кэш в памяти ограничен числом записей и суммарным размером результатов (LRU). Дисковый уровень
+# включается переменной окружения LAB4_QUERY_CACHE_DIR=<каталог> и переживает перезапуск скриптов.
+# LAB4_QUERY_CACHE=0 выключает кэш.
+CACHE_ENABLED = os.environ.get('LAB4_QUERY_CACHE', '1') != '0'
+DISK_DIR = os.environ.get('LAB4_QUERY_CACHE_DIR')
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_DISK_ENTRIES = 1024
+
+_lock = threading.RLock()
+_entries = OrderedDict()
+_settings = {
+    'max_entries': DEFAULT_MAX_ENTRIES,
+    'max_bytes': DEFAULT_MAX_BYTES,
+    'disk_dir': DISK_DIR,
+    'max_disk_entries': DEFAULT_MAX_DISK_ENTRIES,
+}
+_stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0, 'invalidations': 0, 'bytes': 0}
+# Последняя увиденная версия соединения: id(соединения) -> (файл, версия файла, data_version, total_changes)
+_seen = {}
+
+# Строковые литералы и идентификаторы в кавычках: пробелы внутри них значимы
+_QUOTED = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""")
+_SPACES = re.compile(r'\s+')
+
+
+def configure_cache(max_entries=None, max_bytes=None, disk_dir=None, max_disk_entries=None):
+    with _lock:
+        for name, value in (('max_entries', max_entries), ('max_bytes', max_bytes), ('disk_dir', disk_dir),
+                            ('max_disk_entries', max_disk_entries)):
+            if value is not None:
+                _settings[name] = value
+        _evict()
+
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries))
+
+
+# Текст запроса без лишних пробелов и завершающей ';'. Пробелы сжимаются только вне кавычек,
+# регистр не меняется: WHERE name = 'a  b' и WHERE name = 'a b' - разные запросы
+def normalize_sql(sql):
+    parts = _QUOTED.split(sql)
+    parts[::2] = [_SPACES.sub(' ', part) for part in parts[::2]]
+    return ''.join(parts).strip().rstrip(';').rstrip()
+
+
+# Путь к файлу основной базы соединения ('' для базы в памяти, в том числе рабочей копии
+# common.db в режиме LAB4_IN_MEMORY: у базы memdb есть имя, но нет файла, по версии которого
+# можно было бы проверять кэш)
+def database_path(conn):
+    for _, name, filename in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return os.path.abspath(filename) if filename and os.path.exists(filename) else ''
+    return ''
+
+
+def _stat(filename):
+    try:
+        stat = os.stat(filename)
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+# Версия файла базы: размер и время изменения базы и непустого WAL-журнала
+# (пустой журнал создаётся заново при каждом открытии базы и на данные не влияет)
+def file_version(path):
+    wal = _stat(path + '-wal')
+    return _stat(path), wal if wal and wal[0] else None
+
+
+def _disk_prefix(path):
+    return hashlib.sha256(path.encode('utf-8')).hexdigest()[:16]
+
+
+def _disk_file(key):
+    digest = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+    return os.path.join(_settings['disk_dir'], f"{_disk_prefix(key[0])}-{digest}.pkl")
+
+
+def _evict():
+    while _entries and (len(_entries) > _settings['max_entries'] or _stats['bytes'] > _settings['max_bytes']):
+        _, (_, size) = _entries.popitem(last=False)
+        _stats['bytes'] -= size
+        _stats['evictions'] += 1
+
+
+def _remember(key, rows, blob):
+    if key in _entries:
+        _stats['bytes'] -= _entries.pop(key)[1]
+    _entries[key] = (rows, len(blob))
+    _stats['bytes'] += len(blob)
+    _evict()
+
+
+def _disk_get(key):
+    if not _settings['disk_dir']:
+        return None
+    filename = _disk_file(key)
+    try:
+        with open(filename, 'rb') as f:
+            stored_key, rows = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        return None
+    if stored_key != key:
+        return None
+    os.utime(filename)
+    return rows
+
+
+# Запись на диск через временный файл и os.replace, чтобы параллельный читатель не увидел половину файла;
+# при превышении числа файлов удаляются давно не использованные
+def _disk_put(key, blob):
+    directory = _settings['disk_dir']
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    filename = _disk_file(key)
+    tmp = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(blob)
+    os.replace(tmp, filename)
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.pkl')]
+    if len(files) > _settings['max_disk_entries']:
+        files.sort(key=lambda name: _stat(name) or (0, 0))
+        for name in files[:len(files) - _settings['max_disk_entries']]:
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+
+# Сброс кэша: всех записей или только записей одного файла базы (вызывается после загрузки данных)
+def invalidate(path=None):
+    with _lock:
+        _stats['invalidations'] += 1
+        if path is None:
+            _entries.clear()
+            _stats['bytes'] = 0
+        else:
+            path = os.path.abspath(path)
+            for key in [key for key in _entries if key[0] == path]:
+                _stats['bytes'] -= _entries.pop(key)[1]
+        directory = _settings['disk_dir']
+        if not directory or not os.path.isdir(directory):
+            return
+        prefix = _disk_prefix(path) + '-' if path is not None else ''
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith('.pkl'):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+# Версия данных для ключа кэша; изменения этого процесса, не отразившиеся на файле, сбрасывают кэш базы
+def _current_version(conn, path):
+    version = file_version(path)
+    local = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    previous = _seen.get(id(conn))
+    _seen[id(conn)] = (path, version, local)
+    if previous is not None and previous[0] == path and previous[1] == version and previous[2] != local:
+        invalidate(path)
+    return version
+
+
+# Строки результата запроса (список кортежей) из кэша или из базы. Внутри открытой транзакции
+# и для базы в памяти кэш не используется: незафиксированные изменения не видны по версии файла
+def cached_query(conn, sql, params=()):
+    params = tuple(params)
+    path = database_path(conn) if CACHE_ENABLED else ''
+    if not path or conn.in_transaction:
+        with _lock:
+            _stats['bypassed'] += 1
+        return conn.execute(sql, params).fetchall()
+
+    with _lock:
+        key = (path, _current_version(conn, path), normalize_sql(sql), params)
+        if key in _entries:
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return list(_entries[key][0])
+        rows = _disk_get(key)
+        if rows is not None:
+            _stats['disk_hits'] += 1
+            _remember(key, rows, pickle.dumps((key, rows)))
+            return list(rows)
+        _stats['misses'] += 1
+
+    rows = [tuple(row) for row in conn.execute(sql, params).fetchall()]
+    blob = pickle.dumps((key, rows))
+    with _lock:
+        # Если за время запроса файл изменился, результат мог устареть и не сохраняется
+        if file_version(path) == key[1]:
+            _remember(key, rows, blob)
+            _disk_put(key, blob)
+    return list(rows)
@@ -0,0 +1,455 @@
+# Локальный HTTP/JSON-сервис отчётов по уже загруженным базам: запросы скриптов lab4_1 ... task5
+# выполняются по требованию, без пересборки базы и перезаписи JSON-файлов.
+#
+# Запросы выполняются в рабочих потоках на пуле соединений только для чтения (у каждой базы свой пул),
+# цикл asyncio только принимает запросы и пересылает ответ. Тело ответа передаётся потоково
+# (Transfer-Encoding: chunked) по мере чтения курсора, поэтому память не зависит от размера результата:
+#   {"report": "...", "columns": [...], "rows": [[...], ...], "truncated": false}
+# Если запрос прервался после начала ответа, в конце тела вместо "truncated" стоит "error".
+#
+# Ограничения запроса: число строк (limit, не больше max_rows), время выполнения (timeout),
+# число одновременных запросов (max_concurrent, лишние получают 503), размер строки запроса и заголовков.
+#
+# Запуск из корня репозитория:
+#   python -m common.report_service --port 8066
+#   curl 'http://127.0.0.1:8066/reports/songs/filtered?where=year%20>%202000&field=year&limit=5'
+import argparse
+import asyncio
+import functools
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+
+from common.db import STATEMENT_CACHE_SIZE
+from common.query_builder import aggregate_query, frequency_query, select_query
+from common.reports import extrema_query, plan_reports, report
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Базы скриптов: имя -> путь
+DATABASES = {
+    'books': os.path.join(ROOT, 'books.db'),
+    'sales': os.path.join(ROOT, 'books_and_sales.db'),
+    'songs': os.path.join(ROOT, 'task3', 'songs_database.db'),
+    'products': os.path.join(ROOT, 'task4', 'fourth_task.db'),
+    'cars': os.path.join(ROOT, 'task5', 'data_frame.db'),
+}
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8066
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_ROWS = 10000
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MAX_CONCURRENT = 64
+
+# Строк в одном фрагменте ответа и фрагментов в очереди между рабочим потоком и циклом asyncio
+FETCH_SIZE = 500
+QUEUE_CHUNKS = 4
+# Обработчик прогресса проверяет время и отмену запроса раз в PROGRESS_STEPS инструкций SQLite
+PROGRESS_STEPS = 1000
+# Ограничения HTTP-запроса: длина строки, число заголовков, ожидание следующего запроса в соединении
+MAX_LINE = 8192
+MAX_HEADERS = 64
+KEEP_ALIVE_TIMEOUT = 15.0
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               431: 'Request Header Fields Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable',
+               504: 'Gateway Timeout'}
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _number(args, name, default):
+    try:
+        return float(args.get(name, default))
+    except ValueError:
+        raise ServiceError(400, f"Параметр {name} должен быть числом")
+
+
+def _plan(rep):
+    return plan_reports([rep])[0][0], []
+
+
+BOOK_SALES_SOURCE = "books JOIN subitems ON books.title = subitems.title"
+
+# Отчёты: имя -> (база, функция параметров запроса -> (sql, параметры), число строк по умолчанию).
+# Запросы те же, что в скриптах; имена полей и фильтры песен проверяются построителем запросов
+REPORTS = {
+    'books/top': ('books', lambda args: ("SELECT * FROM books ORDER BY views DESC", []), 76),
+    'books/filtered': ('books', lambda args: ("SELECT * FROM books WHERE rating > ? ORDER BY views DESC",
+                                              [_number(args, 'min_rating', 4)]), 76),
+    'books/rating-stats': ('books', lambda args: (
+        "SELECT SUM(rating) AS total_rating, MIN(rating) AS min_rating, MAX(rating) AS max_rating, "
+        "AVG(rating) AS avg_rating FROM books", []), 1),
+    'books/genres': ('books', lambda args: (
+        "SELECT genre, COUNT(*) AS frequency FROM books GROUP BY genre ORDER BY frequency DESC", []), None),
+    'sales/prices-and-places': ('sales', lambda args: (
+        f"SELECT books.title, subitems.price, subitems.place FROM {BOOK_SALES_SOURCE} "
+        "ORDER BY books.rowid, subitems.price, subitems.place", []), None),
+    'sales/genre-stats': ('sales', lambda args: _plan(report(
+        'genre_stats', BOOK_SALES_SOURCE, ['AVG(subitems.price)', 'COUNT(subitems.price)'],
+        group_by='books.genre')), None),
+    'sales/price-extrema': ('sales', lambda args: (
+        extrema_query(BOOK_SALES_SOURCE, 'subitems.price', 'books.title'), []), 1),
+    'songs/first-sorted': ('songs', lambda args: select_query(
+        'songs', order_by=args.get('field', 'duration_ms')), 76),
+    'songs/aggregate': ('songs', lambda args: aggregate_query('songs', [args.get('field', 'tempo')]), 1),
+    'songs/frequency': ('songs', lambda args: frequency_query('songs', args.get('field', 'genre')), None),
+    'songs/filtered': ('songs', lambda args: select_query(
+        'songs', where=args.get('where', 'year > 2000'), order_by=args.get('field', 'year')), 81),
+    'products/top-updated': ('products', lambda args: (
+        "SELECT name, update_counter FROM products ORDER BY update_counter DESC", []), 10),
+    'products/price-analysis': ('products', lambda args: _plan(report(
+        'price_analysis', 'products', ['SUM(price)', 'MIN(price)', 'MAX(price)', 'AVG(price)', 'COUNT(*)'],
+        group_by='category')), None),
+    'products/quantity-analysis': ('products', lambda args: _plan(report(
+        'quantity_analysis', 'products',
+        ['SUM(quantity)', 'MIN(quantity)', 'MAX(quantity)', 'AVG(quantity)', 'COUNT(*)'],
+        group_by='category')), None),
+    'products/custom': ('products', lambda args: (
+        "SELECT name, price, quantity FROM products WHERE price > ? AND quantity < ?",
+        [_number(args, 'min_price', 50000), _number(args, 'max_quantity', 50)]), None),
+    'cars/sales-over': ('cars', lambda args: (
+        "SELECT * FROM Car WHERE Sales_in_thousands > ?", [_number(args, 'min_sales', 200)]), None),
+    'cars/most-expensive': ('cars', lambda args: (
+        "SELECT * FROM CarDetails ORDER BY Price_in_thousands DESC", []), 5),
+    'cars/vehicle-types': ('cars', lambda args: (
+        "SELECT COUNT(*), Vehicle_type FROM CarDetails GROUP BY Vehicle_type", []), None),
+    'cars/manufacturer-sales': ('cars', lambda args: (
+        "SELECT Manufacturer.name, AVG(Car.Sales_in_thousands) FROM Manufacturer "
+        "JOIN Car ON Manufacturer.id = Car.Manufacturer_id GROUP BY Manufacturer.name", []), None),
+    'cars/largest-engine': ('cars', lambda args: (
+        "SELECT * FROM CarDetails WHERE Engine_size = (SELECT MAX(Engine_size) FROM CarDetails)", []), None),
+    'cars/long': ('cars', lambda args: (
+        "SELECT * FROM CarDimensions WHERE Length > ? ORDER BY rowid", [_number(args, 'min_length', 180)]), None),
+}
+
+
+# Соединение только для чтения (mode=ro и query_only)
+def open_read_only(path):
+    conn = sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE_SIZE)
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+# Пул соединений одной базы: соединения открываются по мере надобности, не больше size.
+# Соединение используется одним рабочим потоком за раз, поэтому check_same_thread отключён
+class ConnectionPool:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout):
+        with self._lock:
+            if self._idle.empty() and self._opened < self.size:
+                if not os.path.exists(self.path):
+                    raise ServiceError(503, f"База не найдена: {self.path}")
+                self._opened += 1
+                try:
+                    return open_read_only(self.path)
+                except sqlite3.Error:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=max(timeout, 0))
+        except queue.Empty:
+            raise ServiceError(503, "Нет свободных соединений")
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# Состояние сервиса: пулы соединений, рабочие потоки и ограничения запросов
+def create_service(databases=None, workers=DEFAULT_WORKERS, max_rows=DEFAULT_MAX_ROWS, timeout=DEFAULT_TIMEOUT,
+                   max_concurrent=DEFAULT_MAX_CONCURRENT):
+    databases = {**DATABASES, **(databases or {})}
+    return {
+        'pools': {name: ConnectionPool(path, workers) for name, path in databases.items()},
+        'executor': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='report'),
+        'max_rows': max_rows,
+        'timeout': timeout,
+        'max_concurrent': max_concurrent,
+        'active': 0,
+    }
+
+
+def close_service(service):
+    service['executor'].shutdown(wait=True)
+    for pool in service['pools'].values():
+        pool.close()
+
+
+class _Cancelled(Exception):
+    pass
+
+
+# Выполнение отчёта в рабочем потоке. emit передаёт в цикл asyncio элементы
+# ('start', начало тела), ('chunk', фрагмент), ('end', конец тела) или ('error', статус, сообщение).
+# Прерывание по времени и по отмене - через обработчик прогресса SQLite
+def produce_report(pool, name, sql, params, limit, deadline, cancelled, emit):
+    try:
+        conn = pool.acquire(deadline - time.monotonic())
+    except ServiceError as e:
+        emit(('error', e.status, str(e)))
+        return
+    except sqlite3.Error as e:
+        emit(('error', 503, str(e)))
+        return
+    except _Cancelled:
+        return
+    started = False
+    conn.set_progress_handler(lambda: cancelled.is_set() or time.monotonic() > deadline, PROGRESS_STEPS)
+    try:
+        cursor = conn.execute(f"SELECT * FROM ({sql}) LIMIT ?", [*params, limit + 1])
+        columns = [description[0] for description in cursor.description]
+        emit(('start', f'{{"report": {json.dumps(name)}, "columns": {json.dumps(columns, ensure_ascii=False)}, '
+                       f'"rows": ['.encode('utf-8')))
+        started = True
+        sent = 0
+        truncated = False
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if sent + len(rows) > limit:
+                rows = rows[:limit - sent]
+                truncated = True
+            if not rows:
+                break
+            text = ', '.join(json.dumps(list(row), ensure_ascii=False) for row in rows)
+            emit(('chunk', ((', ' if sent else '') + text).encode('utf-8')))
+            sent += len(rows)
+            if truncated:
+                break
+        cursor.close()
+        emit(('end', f'], "truncated": {json.dumps(truncated)}}}'.encode('utf-8')))
+    except _Cancelled:
+        pass
+    except Exception as e:
+        interrupted = isinstance(e, sqlite3.OperationalError) and 'interrupted' in str(e)
+        if interrupted:
+            status, message = 504, "Превышено время выполнения запроса"
+        else:
+            status, message = (400 if isinstance(e, sqlite3.Error) else 500), str(e)
+        try:
+            if started:
+                emit(('end', f'], "error": {json.dumps(message, ensure_ascii=False)}}}'.encode('utf-8')))
+            else:
+                emit(('error', status, message))
+        except _Cancelled:
+            pass
+    finally:
+        conn.set_progress_handler(None, 0)
+        pool.release(conn)
+
+
+def _response_head(status, headers):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}"]
+    lines += [f"{name}: {value}" for name, value in headers]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+async def send_json(writer, status, data, keep_alive=True):
+    body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    writer.write(_response_head(status, [('Content-Type', 'application/json; charset=utf-8'),
+                                         ('Content-Length', len(body)),
+                                         ('Connection', 'keep-alive' if keep_alive else 'close')]) + body)
+    await writer.drain()
+
+
+def _chunk(data):
+    return b'%x\r\n' % len(data) + data + b'\r\n'
+
+
+# Потоковый ответ: рабочий поток кладёт фрагменты в ограниченную очередь (при медленном клиенте
+# он ждёт), цикл asyncio пересылает их клиенту. При обрыве соединения запрос отменяется
+async def stream_report(service, writer, name, args, keep_alive):
+    database, build, default_limit = REPORTS[name]
+    try:
+        limit = int(args.get('limit', default_limit or service['max_rows']))
+    except ValueError:
+        raise ServiceError(400, "Параметр limit должен быть целым числом")
+    if limit < 0:
+        raise ServiceError(400, "Параметр limit должен быть неотрицательным")
+    limit = min(limit, service['max_rows'])
+    try:
+        sql, params = build(args)
+    except ValueError as e:
+        raise ServiceError(400, str(e))
+
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(QUEUE_CHUNKS)
+    cancelled = threading.Event()
+
+    def emit(item):
+        if cancelled.is_set():
+            raise _Cancelled()
+        asyncio.run_coroutine_threadsafe(chunks.put(item), loop).result()
+
+    deadline = time.monotonic() + service['timeout']
+    producer = loop.run_in_executor(service['executor'], produce_report, service['pools'][database], name, sql,
+                                    params, limit, deadline, cancelled, emit)
+    try:
+        item = await chunks.get()
+        if item[0] == 'error':
+            await send_json(writer, item[1], {'error': item[2]}, keep_alive)
+            return
+        writer.write(_response_head(200, [('Content-Type', 'application/json; charset=utf-8'),
+                                          ('Transfer-Encoding', 'chunked'),
+                                          ('Connection', 'keep-alive' if keep_alive else 'close')])
+                     + _chunk(item[1]))
+        while item[0] != 'end':
+            item = await chunks.get()
+            writer.write(_chunk(item[1]))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+    finally:
+        cancelled.set()
+        while not producer.done():
+            try:
+                chunks.get_nowait()
+            except asyncio.QueueEmpty:
+                await asyncio.sleep(0.001)
+
+
+# Строка запроса и заголовки; None - клиент закрыл соединение
+async def read_request(reader):
+    try:
+        line = await asyncio.wait_for(reader.readline(), KEEP_ALIVE_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ServiceError(400, "Некорректная строка запроса")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise ServiceError(431, "Слишком много заголовков")
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return parts[0], parts[1], parts[2], headers
+
+
+def report_index():
+    return {'reports': [{'name': name, 'database': database, 'default_limit': default_limit}
+                        for name, (database, _, default_limit) in REPORTS.items()]}
+
+
+async def dispatch(service, writer, method, target, keep_alive):
+    if method != 'GET':
+        raise ServiceError(405, "Поддерживается только GET")
+    url = urlsplit(target)
+    path = unquote(url.path).strip('/')
+    args = dict(parse_qsl(url.query))
+    if path in ('', 'reports'):
+        await send_json(writer, 200, report_index(), keep_alive)
+        return
+    name = path[len('reports/'):] if path.startswith('reports/') else None
+    if name not in REPORTS:
+        raise ServiceError(404, f"Неизвестный отчёт: {path}")
+    if service['active'] >= service['max_concurrent']:
+        raise ServiceError(503, "Слишком много одновременных запросов")
+    service['active'] += 1
+    try:
+        await stream_report(service, writer, name, args, keep_alive)
+    finally:
+        service['active'] -= 1
+
+
+# Обработка соединения клиента: запросы HTTP/1.1 подряд, пока клиент держит соединение
+async def handle_client(service, reader, writer):
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                if headers.get('content-length', '0') != '0':
+                    raise ServiceError(400, "Тело запроса не поддерживается")
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+                await dispatch(service, writer, method, target, keep_alive)
+            except ServiceError as e:
+                keep_alive = False
+                await send_json(writer, e.status, {'error': str(e)}, keep_alive)
+            except (ValueError, asyncio.LimitOverrunError):
+                # Строка запроса или заголовок длиннее MAX_LINE
+                keep_alive = False
+                await send_json(writer, 431, {'error': "Слишком длинная строка запроса или заголовок"}, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    return await asyncio.start_server(functools.partial(handle_client, service), host, port, limit=MAX_LINE)
+
+
+async def serve(service, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    server = await start_server(service, host, port)
+    print(f"Сервис отчётов: http://{host}:{server.sockets[0].getsockname()[1]}/reports")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Локальный HTTP/JSON-сервис отчётов')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--max-rows', type=int, default=DEFAULT_MAX_ROWS)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='секунд на запрос')
+    parser.add_argument('--max-concurrent', type=int, default=DEFAULT_MAX_CONCURRENT)
+    parser.add_argument('--db', action='append', default=[], metavar='ИМЯ=ПУТЬ',
+                        help=f"путь к базе ({', '.join(DATABASES)})")
+    args = parser.parse_args(argv)
+
+    databases = {}
+    for item in args.db:
+        name, _, path = item.partition('=')
+        if name not in DATABASES or not path:
+            parser.error(f"--db: ожидается ИМЯ=ПУТЬ, ИМЯ из {', '.join(DATABASES)}")
+        databases[name] = path
+    service = create_service(databases, args.workers, args.max_rows, args.timeout, args.max_concurrent)
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        close_service(service)
+
+
+if __name__ == '__main__':
+    main()
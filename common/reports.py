@@ -0,0 +1,57 @@
+from common.profiling import profiled
+from common.query_cache import cached_query
+
+# Планировщик отчётов: агрегаты нескольких отчётов с одним источником и одной группировкой
+# вычисляются за один проход по таблице, затем результат раскладывается обратно по отчётам
+
+
+# Значение столбца payload в строке с минимумом и в строке с максимумом value и сами минимум и максимум
+# одной строкой: (payload, MIN, payload, MAX). Встроенные MIN и MAX SQLite берут "голый" столбец из строки
+# с найденным значением (при равных значениях - из первой такой строки в порядке обхода), без сортировки.
+# Два агрегата с голыми столбцами в одном SELECT неоднозначны, поэтому это два однострочных подзапроса
+def extrema_query(source, value, payload):
+    return (f"SELECT * FROM (SELECT {payload} AS min_payload, MIN({value}) AS min_value FROM {source}), "
+            f"(SELECT {payload} AS max_payload, MAX({value}) AS max_value FROM {source})")
+
+
+# Описание отчёта: имя, источник (всё, что идёт после FROM), список агрегатных выражений
+# и необязательная группировка. Строка результата - (ключ группы, *агрегаты) или (*агрегаты)
+def report(name, source, columns, group_by=None):
+    return {'name': name, 'source': source, 'columns': list(columns), 'group_by': group_by}
+
+
+# Объединение отчётов в запросы: по одному запросу на пару (источник, группировка),
+# одинаковые выражения вычисляются один раз
+def plan_reports(reports):
+    plans = {}
+    for rep in reports:
+        plan = plans.setdefault((rep['source'], rep['group_by']), {'columns': [], 'reports': []})
+        for column in rep['columns']:
+            if column not in plan['columns']:
+                plan['columns'].append(column)
+        plan['reports'].append(rep)
+
+    queries = []
+    for (source, group_by), plan in plans.items():
+        select = ([group_by] if group_by else []) + plan['columns']
+        query = f"SELECT {', '.join(select)} FROM {source}"
+        if group_by:
+            query += f" GROUP BY {group_by}"
+        queries.append((query, group_by, plan['columns'], plan['reports']))
+    return queries
+
+
+# Выполнение отчётов; возвращает словарь {имя отчёта: список строк}.
+# Результаты запросов кэшируются до изменения базы (common.query_cache)
+@profiled
+def run_reports(cursor, reports):
+    results = {}
+    for query, group_by, columns, planned in plan_reports(reports):
+        rows = cached_query(cursor.connection, query)
+        offset = 1 if group_by else 0
+        for rep in planned:
+            positions = [offset + columns.index(column) for column in rep['columns']]
+            if group_by:
+                positions = [0] + positions
+            results[rep['name']] = [tuple(row[i] for i in positions) for row in rows]
+    return results
@@ -0,0 +1,266 @@
+import functools
+import os
+import sqlite3
+import sys
+from datetime import date, datetime, timedelta
+
+# Продажи по времени. Дата продажи subitems.date хранится текстом как в источнике ("8.6.2002"),
+# при загрузке она приводится к целому номеру дня от 1970-01-01 (epoch-day) в столбце subitems.date_day,
+# по которому построен индекс. Сводки продаж по дням, неделям и месяцам (включаются переменной окружения
+# LAB4_ROLLUPS=1) пересчитываются после каждой загрузки subitems: для каждого периода и значения измерения
+# (жанр книги, место продажи или вся таблица) хранятся количество продаж и сумма, минимум и максимум цен.
+# Запрос за период покрывает его наименьшим числом целых месяцев, недель и дней и читает только эти
+# строки сводок, поэтому его стоимость зависит от длины периода, а не от размера таблицы.
+# Без сводок запросы за период читают subitems по индексу на date_day
+ROLLUPS_ENABLED = os.environ.get('LAB4_ROLLUPS') == '1'
+
+EPOCH = date(1970, 1, 1)
+
+# Форматы текстовых дат, в порядке проверки (после них пробуется ISO 8601)
+DATE_FORMATS = ('%d.%m.%Y', '%d.%m.%y', '%d/%m/%Y')
+
+# Периоды сводок от крупного к мелкому: период -> таблица
+GRANULARITIES = {
+    'month': 'sales_rollup_month',
+    'week': 'sales_rollup_week',
+    'day': 'sales_rollup_day',
+}
+
+# Измерения сводок: имя -> (выражение значения, источник строк). Продажа учитывается в жанре каждой книги
+# с её названием, как в отчётах lab4_2.py (books JOIN subitems); ALL - итог по всем продажам
+ALL = 'all'
+DIMENSIONS = {
+    'genre': ('books.genre', "subitems JOIN books ON books.title = subitems.title"),
+    'place': ('subitems.place', "subitems"),
+    ALL: ('NULL', "subitems"),
+}
+
+
+# ---------- Дни ----------
+
+# Номер дня от 1970-01-01 для текстовой даты; None, если дату не удалось разобрать.
+# Дат в продажах намного меньше, чем строк, поэтому разбор кэшируется
+@functools.lru_cache(maxsize=65536)
+def epoch_day(text):
+    if text is None:
+        return None
+    text = str(text).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return (datetime.strptime(text, fmt).date() - EPOCH).days
+        except ValueError:
+            pass
+    try:
+        return (datetime.fromisoformat(text).date() - EPOCH).days
+    except ValueError:
+        return None
+
+
+# Номер дня для границы периода: целое число (уже номер дня), date/datetime или текст
+def to_epoch_day(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        value = value.date()
+    if isinstance(value, date):
+        return (value - EPOCH).days
+    day = epoch_day(value)
+    if day is None:
+        raise ValueError(f"Не удалось разобрать дату: {value!r}")
+    return day
+
+
+def day_to_date(day):
+    return EPOCH + timedelta(days=day)
+
+
+# Первый день недели (понедельник); 1970-01-01 - четверг
+def week_start(day):
+    return day - (day + 3) % 7
+
+
+def month_start(day):
+    return (day_to_date(day).replace(day=1) - EPOCH).days
+
+
+def next_month_start(day):
+    first = day_to_date(day).replace(day=1)
+    return ((first.replace(year=first.year + 1, month=1) if first.month == 12 else first.replace(month=first.month + 1))
+            - EPOCH).days
+
+
+# DataFrame продаж со столбцом target - номером дня даты из столбца column
+def with_epoch_days(df, column='date', target='date_day'):
+    return df.assign(**{target: df[column].map(epoch_day)})
+
+
+# ---------- Сводки ----------
+
+def _rollup_ddl(table):
+    return f'''CREATE TABLE IF NOT EXISTS {table} (
+    bucket INTEGER NOT NULL,
+    dimension TEXT NOT NULL,
+    value,
+    sales_count INTEGER NOT NULL,
+    price_count INTEGER NOT NULL,
+    price_sum NOT NULL,
+    price_min,
+    price_max)'''
+
+
+# Начало недели и месяца в SQL (остаток от деления в SQLite сохраняет знак, поэтому для дней до 1970
+# он приводится к неотрицательному)
+BUCKET_SQL = {
+    'day': "bucket",
+    'week': "bucket - ((bucket + 3) % 7 + 7) % 7",
+    'month': "CAST(julianday(date(bucket * 86400, 'unixepoch', 'start of month')) - 2440587.5 AS INTEGER)",
+}
+
+
+def drop_rollups(cursor):
+    for table in GRANULARITIES.values():
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+# Полный пересчёт сводок: дневная - группировкой subitems по дню и значению измерения (таблица
+# читается подряд, а не по индексу на date_day), итог ALL - из дневных строк мест продажи, которые делят
+# продажи без пересечений; недельная и месячная - группировкой дневной (строк в ней меньше, чем продаж)
+def rebuild_rollups(cursor):
+    for granularity, table in GRANULARITIES.items():
+        cursor.execute(_rollup_ddl(table))
+        cursor.execute(f"DELETE FROM {table}")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table} (dimension, bucket)")
+    day_table = GRANULARITIES['day']
+    for dimension in ('genre', 'place'):
+        value, source = DIMENSIONS[dimension]
+        cursor.execute(f'''INSERT INTO {day_table}
+                           SELECT subitems.date_day, ?, {value}, COUNT(*), COUNT(subitems.price),
+                                  IFNULL(SUM(subitems.price), 0), MIN(subitems.price), MAX(subitems.price)
+                           FROM {source}
+                           WHERE +subitems.date_day IS NOT NULL
+                           GROUP BY subitems.date_day, {value}''', (dimension,))
+    cursor.execute(f'''INSERT INTO {day_table}
+                       SELECT bucket, ?, NULL, SUM(sales_count), SUM(price_count), SUM(price_sum),
+                              MIN(price_min), MAX(price_max)
+                       FROM {day_table} WHERE dimension = 'place' GROUP BY bucket''', (ALL,))
+    for granularity in ('week', 'month'):
+        cursor.execute(f'''INSERT INTO {GRANULARITIES[granularity]}
+                           SELECT {BUCKET_SQL[granularity]} AS period, dimension, value, SUM(sales_count),
+                                  SUM(price_count), SUM(price_sum), MIN(price_min), MAX(price_max)
+                           FROM {day_table}
+                           GROUP BY period, dimension, value''')
+
+
+def has_rollups(cursor):
+    row = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                         (GRANULARITIES['day'],)).fetchone()
+    return row is not None
+
+
+# Покрытие периода [start, end] (номера дней, включительно) целыми месяцами, неделями и днями:
+# список (период сводки, первое начало периода, последнее начало периода) для соседних периодов
+# одного вида. Неделя берётся, только если она не мешает взять целиком месяц, который в ней начинается
+def cover_range(start, end):
+    parts = []
+    day = start
+    while day <= end:
+        following = next_month_start(day)
+        if month_start(day) == day and following - 1 <= end:
+            granularity, length = 'month', following - day
+        elif week_start(day) == day and day + 6 <= end and (following > day + 6
+                                                             or next_month_start(following) - 1 > end):
+            granularity, length = 'week', 7
+        else:
+            granularity, length = 'day', 1
+        if parts and parts[-1][0] == granularity:
+            parts[-1][2] = day
+        else:
+            parts.append([granularity, day, day])
+        day += length
+    return [tuple(part) for part in parts]
+
+
+# ---------- Запросы за период ----------
+
+def _stats_row(value, sales_count, price_count, price_sum, price_min, price_max):
+    return value, sales_count, price_sum * 1.0 / price_count if price_count else None, price_min, price_max
+
+
+# Продажи за период [start, end] (даты включительно: номера дней, date или текст) по значениям измерения
+# dimension ('genre', 'place' или ALL): [(значение, количество продаж, средняя цена, MIN цены, MAX цены)]
+# по возрастанию значения. Читаются сводки, а если их нет - subitems по индексу на date_day
+def sales_by_range(cursor, start, end, dimension='genre'):
+    start, end = to_epoch_day(start), to_epoch_day(end)
+    if end < start:
+        return []
+    if not has_rollups(cursor):
+        value, source = DIMENSIONS[dimension]
+        rows = cursor.execute(f'''SELECT {value} AS value, COUNT(*), COUNT(subitems.price),
+                                         IFNULL(SUM(subitems.price), 0), MIN(subitems.price), MAX(subitems.price)
+                                  FROM {source}
+                                  WHERE subitems.date_day BETWEEN ? AND ?
+                                  GROUP BY value ORDER BY value''', (start, end)).fetchall()
+        return [_stats_row(*row) for row in rows]
+    parts, params = [], []
+    for granularity, first, last in cover_range(start, end):
+        parts.append(f"SELECT value, sales_count, price_count, price_sum, price_min, price_max "
+                     f"FROM {GRANULARITIES[granularity]} WHERE dimension = ? AND bucket BETWEEN ? AND ?")
+        params += [dimension, first, last]
+    rows = cursor.execute(f'''SELECT value, SUM(sales_count), SUM(price_count), SUM(price_sum),
+                                     MIN(price_min), MAX(price_max)
+                              FROM ({' UNION ALL '.join(parts)})
+                              GROUP BY value ORDER BY value''', params).fetchall()
+    return [_stats_row(*row) for row in rows]
+
+
+# Средняя цена за период по значениям измерения: [(значение, средняя цена)]
+def average_price_by_range(cursor, start, end, dimension='genre'):
+    return [(value, average) for value, _, average, _, _ in sales_by_range(cursor, start, end, dimension)]
+
+
+# Ряд по периодам granularity ('day', 'week', 'month') за [start, end] для одного значения измерения
+# (при dimension=ALL - по всем продажам): [(начало периода ISO, количество продаж, средняя цена, MIN, MAX)].
+# Крайние периоды, выходящие за границы, в ряд не попадают целиком: они считаются только по дням периода
+def sales_series(cursor, start, end, granularity='month', dimension=ALL, value=None):
+    start, end = to_epoch_day(start), to_epoch_day(end)
+    series = []
+    bucket = start
+    while bucket <= end:
+        following = {'day': bucket + 1, 'week': week_start(bucket) + 7, 'month': next_month_start(bucket)}[granularity]
+        rows = [row for row in sales_by_range(cursor, bucket, min(following - 1, end), dimension)
+                if dimension == ALL or row[0] == value]
+        if rows:
+            series.append((day_to_date(bucket).isoformat(),) + rows[0][1:])
+        bucket = following
+    return series
+
+
+# Запуск из командной строки:
+#   python -m common.rollups rebuild <файл базы>
+#   python -m common.rollups range <файл базы> <начало> <конец> [genre|place|all]
+def main(argv):
+    if not ((len(argv) == 2 and argv[0] == 'rebuild') or (len(argv) in (4, 5) and argv[0] == 'range')):
+        print("Использование: python -m common.rollups rebuild <файл базы>\n"
+              "               python -m common.rollups range <файл базы> <начало> <конец> [genre|place|all]")
+        return 2
+    conn = sqlite3.connect(argv[1])
+    cursor = conn.cursor()
+    try:
+        if argv[0] == 'rebuild':
+            rebuild_rollups(cursor)
+            conn.commit()
+            print("Сводки продаж по дням, неделям и месяцам пересчитаны")
+            return 0
+        dimension = argv[4] if len(argv) == 5 else 'genre'
+        for value, sales_count, average, low, high in sales_by_range(cursor, argv[2], argv[3], dimension):
+            print(f"{value}\t{sales_count}\t{average}\t{low}\t{high}")
+        return 0
+    except (ValueError, KeyError) as e:
+        print(f"Ошибка: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,131 @@
+# Вторичные индексы и запросы каждой рабочей нагрузки.
+# Индексы строятся после массовой загрузки данных (строить их до загрузки дороже),
+# а планы зарегистрированных запросов выводятся при запуске, чтобы полные просмотры таблиц были видны сразу
+
+# Индексы: список кортежей (имя индекса, таблица, столбцы)
+INDEXES = {
+    'books': [
+        ('idx_books_views', 'books', 'views'),
+    ],
+    'books_and_sales': [
+        ('idx_books_title', 'books', 'title'),
+        ('idx_subitems_title', 'subitems', 'title'),
+        ('idx_subitems_date_day', 'subitems', 'date_day'),
+    ],
+    'songs': [
+        ('idx_songs_year', 'songs', 'year'),
+        ('idx_songs_duration_ms', 'songs', 'duration_ms'),
+    ],
+    'products': [
+        ('idx_products_name', 'products', 'name'),
+    ],
+    'cars': [
+        ('idx_car_manufacturer_id', 'Car', 'Manufacturer_id'),
+        ('idx_cardimensions_length', 'CarDimensions', 'Length'),
+    ],
+}
+
+# Естественные ключи таблиц: по ним строится уникальный индекс, и повторная загрузка
+# тех же записей обновляет строки (INSERT ... ON CONFLICT DO UPDATE) вместо добавления дублей
+NATURAL_KEYS = {
+    'songs': ('artist', 'song'),
+    'products': ('name',),
+    'Manufacturer': ('name',),
+    'Car': ('Manufacturer_id', 'Model'),
+}
+
+# Запросы, планы которых проверяются при запуске
+QUERIES = {
+    'books': [
+        "SELECT * FROM books ORDER BY views DESC LIMIT 76",
+        "SELECT * FROM books WHERE rating > 4 ORDER BY views DESC LIMIT 76",
+        "SELECT genre, COUNT(*) AS frequency FROM books GROUP BY genre ORDER BY frequency DESC",
+    ],
+    'books_and_sales': [
+        "SELECT books.title, subitems.price, subitems.place FROM books JOIN subitems ON books.title = subitems.title "
+        "ORDER BY books.rowid, subitems.price, subitems.place",
+        "SELECT books.genre, AVG(subitems.price), COUNT(subitems.price) FROM books JOIN subitems ON books.title = subitems.title GROUP BY books.genre",
+        "SELECT books.title, subitems.price FROM books JOIN subitems ON books.title = subitems.title ORDER BY subitems.price ASC LIMIT 1",
+        "SELECT books.genre, AVG(subitems.price) FROM books JOIN subitems ON books.title = subitems.title "
+        "WHERE subitems.date_day BETWEEN 12000 AND 12030 GROUP BY books.genre",
+    ],
+    'songs': [
+        "SELECT * FROM songs ORDER BY duration_ms LIMIT 76",
+        "SELECT * FROM songs WHERE year > 2000 ORDER BY year LIMIT 81",
+        "SELECT genre, COUNT(genre) AS frequency FROM songs GROUP BY genre",
+        "SELECT v.value AS genre, COUNT(*) AS frequency FROM song_genres AS j JOIN genres AS v ON v.id = j.genre_id "
+        "GROUP BY j.genre_id",
+    ],
+    'products': [
+        "UPDATE products SET price = price + 1 WHERE name = 'x'",
+        "DELETE FROM products WHERE name = 'x'",
+        "SELECT name, update_counter FROM products ORDER BY update_counter DESC LIMIT 10",
+        "SELECT category, SUM(price), MIN(price), MAX(price), AVG(price), COUNT(*) FROM products GROUP BY category",
+    ],
+    'cars': [
+        "SELECT Manufacturer.name, AVG(Car.Sales_in_thousands) FROM Manufacturer JOIN Car ON Manufacturer.id = Car.Manufacturer_id GROUP BY Manufacturer.name",
+        "SELECT * FROM CarDimensions WHERE Length > 180 ORDER BY rowid",
+        "SELECT * FROM CarDetails ORDER BY Price_in_thousands DESC LIMIT 5",
+    ],
+}
+
+
+# Удаление индексов нагрузки перед массовой загрузкой (при table - только индексы этой таблицы)
+def drop_indexes(cursor, workload, table=None):
+    for name, index_table, _ in INDEXES[workload]:
+        if table is None or index_table == table:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+# Построение индексов нагрузки после загрузки данных и обновление статистики планировщика
+# (только если какой-то индекс строился: при дозагрузке небольшого хвоста таблица заново не анализируется)
+def create_indexes(cursor, workload):
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    missing = [(name, table, columns) for name, table, columns in INDEXES[workload] if name not in existing]
+    for name, table, columns in missing:
+        cursor.execute(f"CREATE INDEX {name} ON {table} ({columns})")
+    if missing:
+        cursor.execute("ANALYZE")
+
+
+# Полный просмотр таблицы: SCAN без использования индекса
+def is_full_scan(detail):
+    return detail.startswith('SCAN ') and 'INDEX' not in detail
+
+
+# Вывод EXPLAIN QUERY PLAN для всех запросов нагрузки; запросы с полным просмотром таблицы
+# помечаются и возвращаются списком кортежей (запрос, шаги плана с SCAN)
+def report_query_plans(cursor, workload):
+    full_scans = []
+    for query in QUERIES[workload]:
+        details = [row[3] for row in cursor.execute(f"EXPLAIN QUERY PLAN {query}")]
+        scans = [detail for detail in details if is_full_scan(detail)]
+        mark = 'ПОЛНЫЙ ПРОСМОТР' if scans else 'ok'
+        print(f"[{mark}] {query}\n    " + "\n    ".join(details))
+        if scans:
+            full_scans.append((query, scans))
+    return full_scans
+
+
+# Уникальный индекс по естественному ключу таблицы. При первом построении дубли, накопленные
+# прежними запусками, удаляются (остаётся последняя вставленная строка), иначе индекс не построить
+def ensure_natural_key(cursor, table):
+    name = f"uq_{table.lower()}_key"
+    if cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)).fetchone():
+        return
+    columns = ', '.join(NATURAL_KEYS[table])
+    cursor.execute(f"DELETE FROM {table} WHERE rowid NOT IN (SELECT MAX(rowid) FROM {table} GROUP BY {columns})")
+    cursor.execute(f"CREATE UNIQUE INDEX {name} ON {table} ({columns})")
+
+
+# INSERT с обновлением строки при совпадении естественного ключа; update - столбцы, которые
+# перезаписываются (по умолчанию все неключевые), пустой список - оставить строку без изменений
+def upsert_sql(table, columns, update=None):
+    keys = NATURAL_KEYS[table]
+    if update is None:
+        update = [column for column in columns if column not in keys]
+    placeholders = ', '.join('?' * len(columns))
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders}) ON CONFLICT ({', '.join(keys)}) DO "
+    if not update:
+        return sql + "NOTHING"
+    return sql + "UPDATE SET " + ', '.join(f"{column} = excluded.{column}" for column in update)
@@ -0,0 +1,152 @@
+import json
+import os
+import re
+import sqlite3
+import sys
+
+from common.dictionary import data_table, encoded_columns
+
+# Полнотекстовый поиск FTS5 (включается переменной окружения LAB4_SEARCH=1).
+# Индекс - таблица FTS5 с внешним содержимым (content=<таблица>): сами строки хранятся только в исходной
+# таблице, в индексе - токены и статистика для ранжирования bm25. Индекс поддерживается триггерами при
+# вставке, изменении и удалении строк (в том числе при дозагрузке хвоста файла и применении журнала
+# изменений); на время полной загрузки триггеры снимаются, а индекс затем перестраивается целиком.
+# Поиск - префиксный по всем словам запроса, результаты упорядочены по bm25 и ограничены limit,
+# поэтому время поиска зависит от числа совпадений, а не от размера таблицы (в отличие от LIKE '%...%')
+SEARCH_ENABLED = os.environ.get('LAB4_SEARCH') == '1'
+
+# Индексы: имя -> исходная таблица, таблица FTS5, индексируемые текстовые столбцы
+SEARCH_INDEXES = {
+    'books': {
+        'table': 'books',
+        'index': 'books_fts',
+        'columns': ['title', 'author'],
+    },
+    'songs': {
+        'table': 'songs',
+        'index': 'songs_fts',
+        'columns': ['artist', 'song'],
+    },
+    'products': {
+        'table': 'products',
+        'index': 'products_fts',
+        'columns': ['name'],
+    },
+}
+
+# unicode61 с remove_diacritics 2 приводит регистр и снимает диакритику (в том числе у кириллицы);
+# префиксные индексы на 2 и 3 символа ускоряют короткие префиксные запросы
+TOKENIZE = 'unicode61 remove_diacritics 2'
+PREFIX_LENGTHS = '2 3'
+
+DEFAULT_LIMIT = 10
+
+
+def _create_index_sql(spec):
+    return (f"CREATE VIRTUAL TABLE IF NOT EXISTS {spec['index']} USING fts5("
+            f"{', '.join(spec['columns'])}, content='{spec['table']}', content_rowid='rowid', "
+            f"tokenize='{TOKENIZE}', prefix='{PREFIX_LENGTHS}')")
+
+
+# Триггеры синхронизации индекса с внешним содержимым: удаление из индекса требует прежних значений столбцов
+def _triggers(spec):
+    table, index, columns = spec['table'], spec['index'], spec['columns']
+    names = ', '.join(columns)
+    new = ', '.join(f"new.{column}" for column in columns)
+    old = ', '.join(f"old.{column}" for column in columns)
+    insert = f"INSERT INTO {index} (rowid, {names}) VALUES (new.rowid, {new});"
+    delete = f"INSERT INTO {index} ({index}, rowid, {names}) VALUES ('delete', old.rowid, {old});"
+    return {
+        f"{index}_ai": f"CREATE TRIGGER IF NOT EXISTS {index}_ai AFTER INSERT ON {table} BEGIN\n    {insert}\nEND",
+        f"{index}_ad": f"CREATE TRIGGER IF NOT EXISTS {index}_ad AFTER DELETE ON {table} BEGIN\n    {delete}\nEND",
+        f"{index}_au": f"CREATE TRIGGER IF NOT EXISTS {index}_au AFTER UPDATE OF {names} ON {table} BEGIN\n"
+                       f"    {delete}\n    {insert}\nEND",
+    }
+
+
+# Снятие триггеров индекса перед полной загрузкой таблицы (индекс после неё перестраивается)
+def drop_search_triggers(cursor, name):
+    for trigger in _triggers(SEARCH_INDEXES[name]):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+
+
+# Включение индекса: таблица FTS5 и триггеры. Индекс перестраивается по исходной таблице, только если
+# триггеров не было (индекс создаётся впервые или таблица загружалась без них), иначе он уже актуален
+def create_search_index(cursor, name):
+    spec = SEARCH_INDEXES[name]
+    triggers = _triggers(spec)
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    cursor.execute(_create_index_sql(spec))
+    if not all(trigger in existing for trigger in triggers):
+        cursor.execute(f"INSERT INTO {spec['index']} ({spec['index']}) VALUES ('rebuild')")
+    for sql in triggers.values():
+        cursor.execute(sql)
+
+
+# Выражение MATCH из текста запроса: каждое слово берётся в кавычки (операторы FTS5 в тексте не действуют),
+# при prefix=True ищутся слова, начинающиеся с него; column ограничивает поиск одним столбцом
+def match_expression(text, prefix=True, column=None):
+    words = re.findall(r'\w+', text)
+    if not words:
+        raise ValueError(f"В поисковом запросе нет слов: {text!r}")
+    expression = ' '.join('"' + word.replace('"', '""') + '"' + ('*' if prefix else '') for word in words)
+    if column is not None:
+        expression = f"{column} : ({expression})"
+    return expression
+
+
+# Запрос поиска: лучшие limit совпадений выбираются в индексе (ORDER BY rank - bm25), затем по rowid
+# читаются строки исходной таблицы (у таблицы, закодированной common.dictionary, - таблицы <таблица>_data:
+# индексируемые столбцы не кодируются)
+def search_query(cursor, name, text, limit=DEFAULT_LIMIT, prefix=True, column=None):
+    spec = SEARCH_INDEXES[name]
+    if column is not None and column not in spec['columns']:
+        raise ValueError(f"Столбец {column!r} не входит в индекс {name}: {', '.join(spec['columns'])}")
+    table, index = spec['table'], spec['index']
+    source = data_table(table) if encoded_columns(cursor, table) else table
+    columns = ', '.join(f"t.{column}" for column in spec['columns'])
+    sql = (f"SELECT {columns}, m.rank AS rank FROM "
+           f"(SELECT rowid, rank FROM {index} WHERE {index} MATCH ? ORDER BY rank LIMIT ?) AS m "
+           f"JOIN {source} AS t ON t.rowid = m.rowid ORDER BY m.rank")
+    return sql, [match_expression(text, prefix, column), limit]
+
+
+# Поиск по индексу name: список словарей {столбец: значение, ..., 'rank': bm25} (меньше rank - лучше)
+def search(cursor, name, text, limit=DEFAULT_LIMIT, prefix=True, column=None):
+    sql, params = search_query(cursor, name, text, limit, prefix, column)
+    cursor = cursor.execute(sql, params)
+    headers = [description[0] for description in cursor.description]
+    return [dict(zip(headers, row)) for row in cursor]
+
+
+# Запуск из каталога с базой:
+#   python -m common.search <файл базы> books|songs|products <запрос> [limit]
+#   python -m common.search <файл базы> books|songs|products --rebuild
+def main(argv):
+    if len(argv) not in (3, 4) or argv[1] not in SEARCH_INDEXES:
+        print("Использование: python -m common.search <файл базы> books|songs|products <запрос> [limit]\n"
+              "               python -m common.search <файл базы> books|songs|products --rebuild")
+        return 2
+    db_file, name, text = argv[:3]
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    try:
+        if text == '--rebuild':
+            drop_search_triggers(cursor, name)
+            create_search_index(cursor, name)
+            conn.commit()
+            print(f"Индекс {SEARCH_INDEXES[name]['index']} перестроен")
+            return 0
+        limit = int(argv[3]) if len(argv) == 4 else DEFAULT_LIMIT
+        for row in search(cursor, name, text, limit):
+            print(json.dumps(row, ensure_ascii=False))
+        return 0
+    except (ValueError, sqlite3.OperationalError) as e:
+        print(f"Ошибка: {e}")
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,508 @@
+import bisect
+import functools
+import hashlib
+import heapq
+import json
+import math
+import os
+import random
+import sqlite3
+import sys
+
+# Потоковые приближённые сводки (включаются переменной окружения LAB4_SKETCHES=1).
+# Во время загрузки каждый вставленный пакет строк передаётся в observe_batch, которая обновляет
+# по группам (вся таблица и значения столбцов группировки) три объединяемых (mergeable) скетча:
+# - квантили числового столбца - KLL (Karnin, Lang, Liberty): ошибка ранга не больше
+#   quantile_rank_error(k) (около 1.3% при k = 200) с вероятностью 99%;
+# - число различных ключей - HyperLogLog с 2^p регистрами: стандартная относительная ошибка 1.04 / sqrt(2^p)
+#   (1.6% при p = 12);
+# - равномерная выборка без возвращения из sample_size строк (каждой строке назначается случайный приоритет,
+#   хранятся строки с наименьшими приоритетами, поэтому выборки объединяются без искажения).
+# Скетчи хранятся в таблице sketches базы и после загрузки хвоста сливаются с сохранёнными, так что
+# отчёты о перцентилях и числе различных значений читают O(число групп) строк без сортировки таблицы.
+# Скетчи описывают строки таблицы: если загрузка обновила строки с уже загруженным естественным ключом
+# (учтённых строк больше, чем прибавилось в таблице) или источник перезагружен целиком, скетчи
+# пересобираются одним проходом по таблице, а не сливаются с потоком, в котором такие строки учтены дважды
+SKETCHES_ENABLED = os.environ.get('LAB4_SKETCHES') == '1'
+
+SKETCHES_TABLE = 'sketches'
+
+# Размер компактора KLL, число битов индекса регистра HyperLogLog и размер выборки
+DEFAULT_K = 200
+DEFAULT_P = 12
+DEFAULT_SAMPLE_SIZE = 20
+
+# Перцентили отчётов по умолчанию
+DEFAULT_FRACTIONS = (0.5, 0.9, 0.99)
+
+# Нагрузки: таблица и порядок столбцов вставляемых строк (как в SQL вставки загрузчика), столбцы
+# группировки (dimension -> столбец строки или справочник lookup: значение берётся из другой таблицы
+# по ключу, например жанр продажи - по названию книги; у названия может быть несколько книг), числовой
+# столбец квантилей, столбцы ключа для подсчёта различных значений и столбцы строк выборки
+SKETCH_SPECS = {
+    'books_and_sales': {
+        'table': 'subitems',
+        'columns': ['title', 'price', 'place', 'date'],
+        'dimensions': {
+            'place': {'column': 'place'},
+            'genre': {'lookup': ('books', 'title', 'genre'), 'column': 'title'},
+        },
+        'value': 'price',
+        'distinct': ['title'],
+        'sample': ['title', 'price', 'place'],
+    },
+    'songs': {
+        'table': 'songs',
+        'columns': ['artist', 'song', 'duration_ms', 'year', 'tempo', 'genre', 'instrumentalness', 'explicit',
+                    'loudness'],
+        'dimensions': {
+            'genre': {'column': 'genre'},
+        },
+        'value': 'duration_ms',
+        'distinct': ['artist', 'song'],
+        'sample': ['artist', 'song', 'duration_ms'],
+    },
+}
+
+# Группа всей таблицы
+ALL = 'all'
+
+SKETCHES_DDL = f'''CREATE TABLE IF NOT EXISTS {SKETCHES_TABLE} (
+    workload TEXT NOT NULL,
+    dimension TEXT NOT NULL,
+    value,
+    row_count INTEGER NOT NULL,
+    quantiles TEXT NOT NULL,
+    distinct_registers BLOB NOT NULL,
+    sample TEXT NOT NULL)'''
+
+# Случайность компакций KLL и приоритетов выборки; фиксированное зерно делает результаты повторяемыми
+_random = random.Random(20240)
+
+
+# ---------- KLL: квантили ----------
+
+# Граница ошибки ранга KLL с вероятностью 99% (эмпирическая формула Apache DataSketches для KLL)
+def quantile_rank_error(k=DEFAULT_K):
+    return 2.296 / k ** 0.9723
+
+
+def kll_new(k=DEFAULT_K):
+    return {'k': k, 'n': 0, 'min': None, 'max': None, 'compactors': [[]]}
+
+
+# Вместимость компактора уровня h: верхние уровни держат k элементов, нижние - в (2/3)^глубина раз меньше
+def _kll_capacity(sketch, h):
+    depth = len(sketch['compactors']) - h - 1
+    return int(math.ceil(sketch['k'] * (2 / 3) ** depth)) + 1
+
+
+# Сжатие начиная с уровня h: переполненный компактор сортируется, и половина его элементов (чётные
+# или нечётные позиции) поднимается на уровень выше с удвоенным весом; при нечётном числе последний
+# элемент остаётся на уровне. Переполнение верхнего уровня добавляет новый, и вместимость нижних уменьшается
+def _kll_compact(sketch, h=0):
+    compactors = sketch['compactors']
+    while h < len(compactors) and len(compactors[h]) >= _kll_capacity(sketch, h):
+        if h + 1 == len(compactors):
+            compactors.append([])
+        items = compactors[h]
+        items.sort()
+        keep = items.pop() if len(items) % 2 else None
+        compactors[h + 1].extend(items[_random.getrandbits(1)::2])
+        items[:] = [] if keep is None else [keep]
+        h += 1
+
+
+def kll_update(sketch, value):
+    sketch['compactors'][0].append(value)
+    sketch['n'] += 1
+    if sketch['min'] is None or value < sketch['min']:
+        sketch['min'] = value
+    if sketch['max'] is None or value > sketch['max']:
+        sketch['max'] = value
+    if len(sketch['compactors'][0]) >= _kll_capacity(sketch, 0):
+        _kll_compact(sketch)
+
+
+# Добавление пакета значений: уровень 0 пополняется целиком и затем сжимается (как при слиянии)
+def kll_extend(sketch, values):
+    if not values:
+        return
+    sketch['compactors'][0].extend(values)
+    sketch['n'] += len(values)
+    low, high = min(values), max(values)
+    if sketch['min'] is None or low < sketch['min']:
+        sketch['min'] = low
+    if sketch['max'] is None or high > sketch['max']:
+        sketch['max'] = high
+    _kll_compact(sketch)
+
+
+def kll_merge(sketch, other):
+    compactors = sketch['compactors']
+    while len(compactors) < len(other['compactors']):
+        compactors.append([])
+    for h, items in enumerate(other['compactors']):
+        compactors[h].extend(items)
+    sketch['n'] += other['n']
+    for name, better in (('min', min), ('max', max)):
+        values = [v for v in (sketch[name], other[name]) if v is not None]
+        sketch[name] = better(values) if values else None
+    for h in range(len(compactors)):
+        _kll_compact(sketch, h)
+
+
+# Значения скетча с весами 2^уровень, отсортированные по значению, и накопленные веса
+def _kll_weighted(sketch):
+    weighted = sorted((value, 1 << h) for h, items in enumerate(sketch['compactors']) for value in items)
+    cumulative, total = [], 0
+    for _, weight in weighted:
+        total += weight
+        cumulative.append(total)
+    return [value for value, _ in weighted], cumulative
+
+
+# Квантили скетча для долей fractions (0 - минимум, 1 - максимум); None у пустого скетча
+def kll_quantiles(sketch, fractions):
+    if not sketch['n']:
+        return [None] * len(fractions)
+    values, cumulative = _kll_weighted(sketch)
+    total = cumulative[-1]
+    result = []
+    for fraction in fractions:
+        if fraction <= 0:
+            result.append(sketch['min'])
+        elif fraction >= 1:
+            result.append(sketch['max'])
+        else:
+            result.append(values[min(bisect.bisect_left(cumulative, fraction * total), len(values) - 1)])
+    return result
+
+
+# ---------- HyperLogLog: число различных значений ----------
+
+# Стандартная относительная ошибка оценки HyperLogLog с 2^p регистрами
+def distinct_relative_error(p=DEFAULT_P):
+    return 1.04 / math.sqrt(1 << p)
+
+
+def hll_new(p=DEFAULT_P):
+    return bytearray(1 << p)
+
+
+# 64-битный хеш ключа; встроенный hash() строк зависит от запуска, поэтому используется blake2b
+def key_hash(key):
+    return int.from_bytes(hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def hll_update(registers, hashed):
+    hll_extend(registers, [hashed])
+
+
+def hll_extend(registers, hashes):
+    p = (len(registers) - 1).bit_length()
+    shift, mask = 64 - p, (1 << (64 - p)) - 1
+    for hashed in hashes:
+        index = hashed >> shift
+        rank = shift - (hashed & mask).bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+
+
+def hll_merge(registers, other):
+    for index, rank in enumerate(other):
+        if rank > registers[index]:
+            registers[index] = rank
+
+
+# Оценка числа различных значений; при малом числе значений (много пустых регистров) - линейный подсчёт
+def hll_estimate(registers):
+    m = len(registers)
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -rank for rank in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+
+# ---------- Выборка ----------
+
+# Выборка - куча пар (-приоритет, строка): в вершине строка с наибольшим приоритетом, которая
+# вытесняется первой
+def sample_update(sample, item, size=DEFAULT_SAMPLE_SIZE):
+    priority = _random.random()
+    if len(sample) < size:
+        heapq.heappush(sample, (-priority, item))
+    elif priority < -sample[0][0]:
+        heapq.heapreplace(sample, (-priority, item))
+
+
+def sample_merge(sample, other, size=DEFAULT_SAMPLE_SIZE):
+    merged = heapq.nsmallest(size, ((-negative, item) for negative, item in sample + other))
+    sample[:] = [(-priority, item) for priority, item in merged]
+    heapq.heapify(sample)
+
+
+def sample_rows(sample):
+    return [list(item) for _, item in sorted(sample, reverse=True)]
+
+
+# ---------- Скетчи групп ----------
+
+def _group_new():
+    return {'row_count': 0, 'quantiles': kll_new(), 'distinct': hll_new(), 'sample': []}
+
+
+def _group_merge(group, other):
+    group['row_count'] += other['row_count']
+    kll_merge(group['quantiles'], other['quantiles'])
+    hll_merge(group['distinct'], other['distinct'])
+    sample_merge(group['sample'], other['sample'])
+
+
+# Состояние загрузки: скетчи групп {(dimension, значение): скетч} и справочники столбцов группировки.
+# Справочники читаются при создании состояния, поэтому таблицы справочников (books для жанров продаж)
+# должны быть загружены раньше
+def new_sketches(cursor, workload):
+    spec = SKETCH_SPECS[workload]
+    lookups = {}
+    for dimension, source in spec['dimensions'].items():
+        if 'lookup' in source:
+            table, key, column = source['lookup']
+            mapping = {}
+            for k, v in cursor.execute(f"SELECT {key}, {column} FROM {table}"):
+                mapping.setdefault(k, []).append(v)
+            lookups[dimension] = mapping
+    return {'workload': workload, 'groups': {}, 'lookups': lookups}
+
+
+# Обновление скетчей пакетом строк в порядке столбцов SKETCH_SPECS[workload]['columns']: строки
+# раскладываются по группам, и скетч каждой группы обновляется сразу всеми её строками
+def observe_batch(state, rows):
+    spec = SKETCH_SPECS[state['workload']]
+    position = {column: n for n, column in enumerate(spec['columns'])}
+    value_at = position[spec['value']]
+    distinct_at = [position[column] for column in spec['distinct']]
+    sample_at = [position[column] for column in spec['sample']]
+    dimensions = [(dimension, position[source['column']], state['lookups'].get(dimension))
+                  for dimension, source in spec['dimensions'].items()]
+    by_group = {}
+    for row in rows:
+        entry = (row[value_at], key_hash(tuple(row[n] for n in distinct_at)), tuple(row[n] for n in sample_at))
+        keys = [(ALL, None)]
+        for dimension, at, lookup in dimensions:
+            if lookup is None:
+                keys.append((dimension, row[at]))
+            else:
+                keys.extend((dimension, v) for v in lookup.get(row[at], ()))
+        for key in keys:
+            entries = by_group.get(key)
+            if entries is None:
+                entries = by_group[key] = []
+            entries.append(entry)
+    groups = state['groups']
+    for key, entries in by_group.items():
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = _group_new()
+        group['row_count'] += len(entries)
+        kll_extend(group['quantiles'], [value for value, _, _ in entries if value is not None])
+        hll_extend(group['distinct'], [hashed for _, hashed, _ in entries])
+        for _, _, item in entries:
+            sample_update(group['sample'], item)
+
+
+# Функция on_batch для загрузчиков (None, если скетчи не ведутся)
+def batch_observer(state):
+    return None if state is None else functools.partial(observe_batch, state)
+
+
+# ---------- Хранение ----------
+
+def _load_groups(cursor, workload):
+    cursor.execute(SKETCHES_DDL)
+    groups = {}
+    for dimension, value, row_count, quantiles, registers, sample in cursor.execute(
+            f"SELECT dimension, value, row_count, quantiles, distinct_registers, sample FROM {SKETCHES_TABLE} "
+            f"WHERE workload = ?", (workload,)):
+        groups[(dimension, value)] = {
+            'row_count': row_count,
+            'quantiles': json.loads(quantiles),
+            'distinct': bytearray(registers),
+            'sample': [(-priority, tuple(item)) for priority, item in json.loads(sample)],
+        }
+    return groups
+
+
+def has_sketches(cursor, workload):
+    cursor.execute(SKETCHES_DDL)
+    row = cursor.execute(f"SELECT 1 FROM {SKETCHES_TABLE} WHERE workload = ? LIMIT 1", (workload,)).fetchone()
+    return row is not None
+
+
+# Сохранение скетчей загрузки: слияние с сохранёнными (reset=True - замена сохранённых)
+def save_sketches(cursor, state, reset=False):
+    workload = state['workload']
+    groups = {} if reset else _load_groups(cursor, workload)
+    for key, group in state['groups'].items():
+        if key in groups:
+            _group_merge(groups[key], group)
+        else:
+            groups[key] = group
+    cursor.execute(SKETCHES_DDL)
+    cursor.execute(f"DELETE FROM {SKETCHES_TABLE} WHERE workload = ?", (workload,))
+    cursor.executemany(
+        f"INSERT INTO {SKETCHES_TABLE} (workload, dimension, value, row_count, quantiles, distinct_registers, sample) "
+        f"VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(workload, dimension, value, group['row_count'], json.dumps(group['quantiles']), bytes(group['distinct']),
+          json.dumps([(-priority, list(item)) for priority, item in group['sample']], ensure_ascii=False))
+         for (dimension, value), group in groups.items()])
+
+
+# Пересборка скетчей нагрузки одним проходом по таблице (без сортировки)
+def rebuild_sketches(cursor, workload):
+    spec = SKETCH_SPECS[workload]
+    state = new_sketches(cursor, workload)
+    rows = cursor.connection.execute(f"SELECT {', '.join(spec['columns'])} FROM {spec['table']}")
+    while True:
+        batch = rows.fetchmany(1000)
+        if not batch:
+            break
+        observe_batch(state, batch)
+    save_sketches(cursor, state, reset=True)
+
+
+# Число строк, учтённых сохранёнными скетчами всей таблицы (None, если скетчей нет)
+def _saved_row_count(cursor, workload):
+    cursor.execute(SKETCHES_DDL)
+    row = cursor.execute(f"SELECT row_count FROM {SKETCHES_TABLE} WHERE workload = ? AND dimension = ? "
+                         f"AND value IS NULL", (workload, ALL)).fetchone()
+    return None if row is None else row[0]
+
+
+# Завершение загрузки нагрузки со скетчами state: fresh - таблица была пуста до загрузки (скетчи
+# заменяются накопленными), reloaded - какой-то источник перезагружен целиком в непустую таблицу,
+# иначе накопленное по дописанным записям сливается с сохранённым. Если после этого учтённых строк
+# не столько, сколько строк в таблице (загрузка обновила строки по ключу, или скетчей нет),
+# скетчи пересобираются по таблице
+def finish_sketches(cursor, state, fresh, reloaded=False):
+    workload = state['workload']
+    group = state['groups'].get((ALL, None))
+    observed = group['row_count'] if group is not None else 0
+    saved = 0 if fresh else _saved_row_count(cursor, workload)
+    table_rows = cursor.execute(f"SELECT COUNT(*) FROM {SKETCH_SPECS[workload]['table']}").fetchone()[0]
+    if reloaded or saved is None or saved + observed != table_rows:
+        rebuild_sketches(cursor, workload)
+    else:
+        save_sketches(cursor, state, reset=fresh)
+
+
+# ---------- Отчёты ----------
+
+# Границы ошибок отчётов: ошибка ранга квантилей (99%), относительная стандартная ошибка числа
+# различных значений и размер выборки
+def error_bounds():
+    return {
+        'quantile_rank_error': quantile_rank_error(),
+        'distinct_relative_error': distinct_relative_error(),
+        'sample_size': DEFAULT_SAMPLE_SIZE,
+    }
+
+
+def _groups(cursor, workload, dimension):
+    cursor.execute(SKETCHES_DDL)
+    return cursor.execute(
+        f"SELECT value, row_count, quantiles, distinct_registers, sample FROM {SKETCHES_TABLE} "
+        f"WHERE workload = ? AND dimension = ? ORDER BY value", (workload, dimension)).fetchall()
+
+
+# Перцентили числового столбца по группам: (группа, число строк, [квантиль для каждой доли fractions])
+def sketch_quantiles(cursor, workload, dimension=ALL, fractions=DEFAULT_FRACTIONS):
+    return [(value, row_count, kll_quantiles(json.loads(quantiles), fractions))
+            for value, row_count, quantiles, _, _ in _groups(cursor, workload, dimension)]
+
+
+# Оценка числа различных ключей по группам: (группа, оценка)
+def sketch_distinct_counts(cursor, workload, dimension=ALL):
+    return [(value, round(hll_estimate(registers)))
+            for value, _, _, registers, _ in _groups(cursor, workload, dimension)]
+
+
+# Выборки строк по группам: (группа, [строка со столбцами SKETCH_SPECS[workload]['sample']])
+def sketch_samples(cursor, workload, dimension=ALL):
+    return [(value, sample_rows([(-priority, item) for priority, item in json.loads(sample)]))
+            for value, _, _, _, sample in _groups(cursor, workload, dimension)]
+
+
+# Сверка с точным расчётом по таблице (сортировка всех значений): для каждого измерения - наибольшая
+# ошибка ранга квантилей DEFAULT_FRACTIONS и наибольшая относительная ошибка числа различных ключей
+def check_sketches(cursor, workload):
+    spec = SKETCH_SPECS[workload]
+    exact = new_sketches(cursor, workload)
+    values, keys = {}, {}
+    position = {column: n for n, column in enumerate(spec['columns'])}
+    for row in cursor.connection.execute(f"SELECT {', '.join(spec['columns'])} FROM {spec['table']}"):
+        groups = [(ALL, None)]
+        for dimension, source in spec['dimensions'].items():
+            at = position[source['column']]
+            lookup = exact['lookups'].get(dimension)
+            groups += [(dimension, row[at])] if lookup is None else [(dimension, v) for v in lookup.get(row[at], ())]
+        for group in groups:
+            if row[position[spec['value']]] is not None:
+                values.setdefault(group, []).append(row[position[spec['value']]])
+            keys.setdefault(group, set()).add(tuple(row[position[column]] for column in spec['distinct']))
+    errors = {}
+    for dimension in [ALL] + list(spec['dimensions']):
+        rank_error = distinct_error = 0.0
+        for value, _, estimates in sketch_quantiles(cursor, workload, dimension):
+            exact_values = sorted(values.get((dimension, value), []))
+            for fraction, estimate in zip(DEFAULT_FRACTIONS, estimates):
+                if exact_values and estimate is not None:
+                    low = bisect.bisect_left(exact_values, estimate) / len(exact_values)
+                    high = bisect.bisect_right(exact_values, estimate) / len(exact_values)
+                    rank_error = max(rank_error, 0.0 if low <= fraction <= high else min(abs(low - fraction),
+                                                                                         abs(high - fraction)))
+        for value, estimate in sketch_distinct_counts(cursor, workload, dimension):
+            count = len(keys.get((dimension, value), ()))
+            if count:
+                distinct_error = max(distinct_error, abs(estimate - count) / count)
+        errors[dimension] = (rank_error, distinct_error)
+    return errors
+
+
+# Запуск из командной строки:
+#   python -m common.sketches rebuild|check <файл базы> books_and_sales|songs
+#   python -m common.sketches report <файл базы> books_and_sales|songs [измерение]
+def main(argv):
+    if len(argv) not in (3, 4) or argv[0] not in ('rebuild', 'check', 'report') or argv[2] not in SKETCH_SPECS:
+        print("Использование: python -m common.sketches rebuild|check <файл базы> books_and_sales|songs\n"
+              "               python -m common.sketches report <файл базы> books_and_sales|songs [измерение]")
+        return 2
+    command, db_file, workload = argv[:3]
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    try:
+        if command == 'rebuild':
+            rebuild_sketches(cursor, workload)
+            conn.commit()
+            print(f"Скетчи {workload} пересобраны")
+        elif command == 'check':
+            bounds = error_bounds()
+            for dimension, (rank_error, distinct_error) in check_sketches(cursor, workload).items():
+                print(f"{dimension}: ошибка ранга {rank_error:.4f} (граница {bounds['quantile_rank_error']:.4f}), "
+                      f"ошибка числа различных {distinct_error:.4f} "
+                      f"(стандартная {bounds['distinct_relative_error']:.4f})")
+        else:
+            dimension = argv[3] if len(argv) == 4 else ALL
+            distinct = dict(sketch_distinct_counts(cursor, workload, dimension))
+            for value, row_count, quantiles in sketch_quantiles(cursor, workload, dimension):
+                row = {'group': value, 'rows': row_count, 'distinct': distinct[value]}
+                row.update((f"p{round(fraction * 100)}", q) for fraction, q in zip(DEFAULT_FRACTIONS, quantiles))
+                print(json.dumps(row, ensure_ascii=False))
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
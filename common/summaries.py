@@ -0,0 +1,305 @@
+import math
+import os
+import sqlite3
+import sys
+
+# Режим сводных таблиц (включается переменной окружения LAB4_SUMMARIES=1).
+# Агрегаты по группам хранятся в отдельных таблицах и поддерживаются триггерами при каждой
+# вставке, изменении и удалении строк, поэтому отчёты читают O(число групп) строк вместо всей таблицы.
+# На время массовой загрузки триггеры снимаются, а сводка после загрузки пересчитывается целиком
+SUMMARIES_ENABLED = os.environ.get('LAB4_SUMMARIES') == '1'
+
+# Сводки по одной таблице: сводная таблица, исходная таблица, столбец группировки, числовые столбцы.
+# Для каждого числового столбца v хранятся v_count, v_sum, v_min, v_max
+TABLE_SUMMARIES = {
+    'books': {
+        'summary': 'books_genre_summary',
+        'source': 'books',
+        'group': 'genre',
+        'values': ['rating'],
+    },
+    'products': {
+        'summary': 'products_category_summary',
+        'source': 'products',
+        'group': 'category',
+        'values': ['price', 'quantity'],
+    },
+}
+
+# Сводка продаж по жанрам (books JOIN subitems ON title): количество продаж и сумма цен
+SALES_SUMMARY = 'genre_sales_summary'
+SALES_SUMMARY_WORKLOAD = 'books_and_sales'
+
+
+# ---------- Сводки по одной таблице ----------
+
+def _table_summary_ddl(spec):
+    columns = [f"{spec['group']}", "row_count INTEGER NOT NULL DEFAULT 0"]
+    for v in spec['values']:
+        columns += [f"{v}_count INTEGER NOT NULL DEFAULT 0", f"{v}_sum NOT NULL DEFAULT 0", f"{v}_min", f"{v}_max"]
+    return f"CREATE TABLE IF NOT EXISTS {spec['summary']} ({', '.join(columns)})"
+
+
+# Операторы добавления строки (row = 'NEW') в сводку
+def _add_row_sql(spec, row):
+    summary, group = spec['summary'], spec['group']
+    sets = ["row_count = row_count + 1"]
+    for v in spec['values']:
+        sets += [
+            f"{v}_count = {v}_count + ({row}.{v} IS NOT NULL)",
+            f"{v}_sum = {v}_sum + IFNULL({row}.{v}, 0)",
+            f"{v}_min = CASE WHEN {row}.{v} IS NOT NULL AND ({v}_min IS NULL OR {row}.{v} < {v}_min) "
+            f"THEN {row}.{v} ELSE {v}_min END",
+            f"{v}_max = CASE WHEN {row}.{v} IS NOT NULL AND ({v}_max IS NULL OR {row}.{v} > {v}_max) "
+            f"THEN {row}.{v} ELSE {v}_max END",
+        ]
+    return [
+        f"INSERT INTO {summary} ({group}) SELECT {row}.{group} "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {summary} WHERE {group} IS {row}.{group});",
+        f"UPDATE {summary} SET {', '.join(sets)} WHERE {group} IS {row}.{group};",
+    ]
+
+
+# Операторы удаления строки (row = 'OLD') из сводки; минимум и максимум группы
+# пересчитываются только если удалённое значение было экстремальным
+def _remove_row_sql(spec, row):
+    summary, source, group = spec['summary'], spec['source'], spec['group']
+    sets = ["row_count = row_count - 1"]
+    for v in spec['values']:
+        sets += [
+            f"{v}_count = {v}_count - ({row}.{v} IS NOT NULL)",
+            f"{v}_sum = {v}_sum - IFNULL({row}.{v}, 0)",
+        ]
+    statements = [f"UPDATE {summary} SET {', '.join(sets)} WHERE {group} IS {row}.{group};"]
+    for v in spec['values']:
+        for func in ('min', 'max'):
+            statements.append(
+                f"UPDATE {summary} SET {v}_{func} = "
+                f"(SELECT {func.upper()}({v}) FROM {source} WHERE {group} IS {row}.{group}) "
+                f"WHERE {group} IS {row}.{group} AND {row}.{v} = {v}_{func};")
+    statements.append(f"DELETE FROM {summary} WHERE {group} IS {row}.{group} AND row_count = 0;")
+    return statements
+
+
+def _table_summary_triggers(spec):
+    summary, source = spec['summary'], spec['source']
+    watched = ', '.join([spec['group']] + spec['values'])
+    body_insert = '\n    '.join(_add_row_sql(spec, 'NEW'))
+    body_delete = '\n    '.join(_remove_row_sql(spec, 'OLD'))
+    return {
+        f"{summary}_ai": f"CREATE TRIGGER IF NOT EXISTS {summary}_ai AFTER INSERT ON {source} BEGIN\n    "
+                         f"{body_insert}\nEND",
+        f"{summary}_ad": f"CREATE TRIGGER IF NOT EXISTS {summary}_ad AFTER DELETE ON {source} BEGIN\n    "
+                         f"{body_delete}\nEND",
+        f"{summary}_au": f"CREATE TRIGGER IF NOT EXISTS {summary}_au AFTER UPDATE OF {watched} ON {source} BEGIN\n    "
+                         f"{body_delete}\n    {body_insert}\nEND",
+    }
+
+
+def _table_summary_rebuild_query(spec):
+    columns = [spec['group'], "COUNT(*)"]
+    for v in spec['values']:
+        columns += [f"COUNT({v})", f"IFNULL(SUM({v}), 0)", f"MIN({v})", f"MAX({v})"]
+    return f"SELECT {', '.join(columns)} FROM {spec['source']} GROUP BY {spec['group']}"
+
+
+def _table_summary_columns(spec):
+    columns = [spec['group'], "row_count"]
+    for v in spec['values']:
+        columns += [f"{v}_count", f"{v}_sum", f"{v}_min", f"{v}_max"]
+    return columns
+
+
+# ---------- Сводка продаж по жанрам (books JOIN subitems) ----------
+
+SALES_SUMMARY_DDL = f'''CREATE TABLE IF NOT EXISTS {SALES_SUMMARY} (
+    genre,
+    sales_count INTEGER NOT NULL DEFAULT 0,
+    price_count INTEGER NOT NULL DEFAULT 0,
+    price_sum NOT NULL DEFAULT 0)'''
+
+
+# Вклад продажи (NEW/OLD из subitems) во все жанры книг с таким названием, sign = +1 или -1
+def _sales_subitem_sql(row, sign):
+    statements = []
+    if sign > 0:
+        statements.append(
+            f"INSERT INTO {SALES_SUMMARY} (genre) SELECT DISTINCT b.genre FROM books b WHERE b.title = {row}.title "
+            f"AND NOT EXISTS (SELECT 1 FROM {SALES_SUMMARY} s WHERE s.genre IS b.genre);")
+    statements.append(
+        f"UPDATE {SALES_SUMMARY} SET sales_count = sales_count + {sign} * m.n, "
+        f"price_count = price_count + {sign} * m.n * ({row}.price IS NOT NULL), "
+        f"price_sum = price_sum + {sign} * m.n * IFNULL({row}.price, 0) "
+        f"FROM (SELECT genre, COUNT(*) AS n FROM books WHERE title = {row}.title GROUP BY genre) AS m "
+        f"WHERE {SALES_SUMMARY}.genre IS m.genre;")
+    statements.append(f"DELETE FROM {SALES_SUMMARY} WHERE sales_count = 0;")
+    return statements
+
+
+# Вклад книги (NEW/OLD из books) - все продажи книги с этим названием в жанр книги, sign = +1 или -1
+def _sales_book_sql(row, sign):
+    statements = []
+    if sign > 0:
+        statements.append(
+            f"INSERT INTO {SALES_SUMMARY} (genre) SELECT {row}.genre "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {SALES_SUMMARY} WHERE genre IS {row}.genre);")
+    statements.append(
+        f"UPDATE {SALES_SUMMARY} SET sales_count = sales_count + {sign} * m.n, "
+        f"price_count = price_count + {sign} * m.c, price_sum = price_sum + {sign} * m.s "
+        f"FROM (SELECT COUNT(*) AS n, COUNT(price) AS c, IFNULL(SUM(price), 0) AS s "
+        f"FROM subitems WHERE title = {row}.title) AS m "
+        f"WHERE {SALES_SUMMARY}.genre IS {row}.genre;")
+    statements.append(f"DELETE FROM {SALES_SUMMARY} WHERE sales_count = 0;")
+    return statements
+
+
+def _sales_summary_triggers():
+    def trigger(name, event, table, statements):
+        body = '\n    '.join(statements)
+        return f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN\n    {body}\nEND"
+
+    return {
+        f"{SALES_SUMMARY}_subitems_ai": trigger(f"{SALES_SUMMARY}_subitems_ai", "INSERT", "subitems",
+                                                _sales_subitem_sql('NEW', 1)),
+        f"{SALES_SUMMARY}_subitems_ad": trigger(f"{SALES_SUMMARY}_subitems_ad", "DELETE", "subitems",
+                                                _sales_subitem_sql('OLD', -1)),
+        f"{SALES_SUMMARY}_subitems_au": trigger(f"{SALES_SUMMARY}_subitems_au", "UPDATE OF title, price", "subitems",
+                                                _sales_subitem_sql('OLD', -1) + _sales_subitem_sql('NEW', 1)),
+        f"{SALES_SUMMARY}_books_ai": trigger(f"{SALES_SUMMARY}_books_ai", "INSERT", "books",
+                                             _sales_book_sql('NEW', 1)),
+        f"{SALES_SUMMARY}_books_ad": trigger(f"{SALES_SUMMARY}_books_ad", "DELETE", "books",
+                                             _sales_book_sql('OLD', -1)),
+        f"{SALES_SUMMARY}_books_au": trigger(f"{SALES_SUMMARY}_books_au", "UPDATE OF title, genre", "books",
+                                             _sales_book_sql('OLD', -1) + _sales_book_sql('NEW', 1)),
+    }
+
+
+SALES_SUMMARY_REBUILD_QUERY = '''SELECT books.genre, COUNT(*), COUNT(subitems.price), IFNULL(SUM(subitems.price), 0)
+                                 FROM books JOIN subitems ON books.title = subitems.title
+                                 GROUP BY books.genre'''
+SALES_SUMMARY_COLUMNS = ['genre', 'sales_count', 'price_count', 'price_sum']
+
+
+# ---------- Общий интерфейс ----------
+
+def _definition(workload):
+    if workload == SALES_SUMMARY_WORKLOAD:
+        return (SALES_SUMMARY, SALES_SUMMARY_DDL, _sales_summary_triggers(),
+                SALES_SUMMARY_REBUILD_QUERY, SALES_SUMMARY_COLUMNS)
+    spec = TABLE_SUMMARIES[workload]
+    return (spec['summary'], _table_summary_ddl(spec), _table_summary_triggers(spec),
+            _table_summary_rebuild_query(spec), _table_summary_columns(spec))
+
+
+# Снятие триггеров перед массовой загрузкой
+def drop_summary_triggers(cursor, workload):
+    _, _, triggers, _, _ = _definition(workload)
+    for name in triggers:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+# Полный пересчёт сводки по исходным таблицам
+def rebuild_summaries(cursor, workload):
+    summary, ddl, _, rebuild_query, columns = _definition(workload)
+    cursor.execute(ddl)
+    cursor.execute(f"DELETE FROM {summary}")
+    cursor.execute(f"INSERT INTO {summary} ({', '.join(columns)}) {rebuild_query}")
+
+
+# Включение сводок: таблица, пересчёт и триггеры для дальнейшего поддержания
+def create_summaries(cursor, workload):
+    rebuild_summaries(cursor, workload)
+    _, _, triggers, _, _ = _definition(workload)
+    for sql in triggers.values():
+        cursor.execute(sql)
+
+
+def _same(a, b):
+    if isinstance(a, float) or isinstance(b, float):
+        return a is not None and b is not None and math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9)
+    return a == b
+
+
+# Сверка сводки с полным пересчётом; возвращает список расхождений (группа, в сводке, при пересчёте)
+def check_summaries(cursor, workload):
+    summary, _, _, rebuild_query, columns = _definition(workload)
+    stored = {row[0]: row for row in cursor.execute(f"SELECT {', '.join(columns)} FROM {summary}")}
+    expected = {row[0]: row for row in cursor.execute(rebuild_query)}
+    mismatches = []
+    for group in stored.keys() | expected.keys():
+        a, b = stored.get(group), expected.get(group)
+        if a is None or b is None or not all(_same(x, y) for x, y in zip(a, b)):
+            mismatches.append((group, a, b))
+    return mismatches
+
+
+# ---------- Отчёты по сводкам ----------
+
+# Статистика числового столбца по группам: (группа, SUM, MIN, MAX, AVG, COUNT(*)),
+# в той же форме, что и GROUP BY по исходной таблице
+def summary_group_stats(cursor, workload, value):
+    spec = TABLE_SUMMARIES[workload]
+    return cursor.execute(f'''SELECT {spec['group']},
+                                     CASE WHEN {value}_count > 0 THEN {value}_sum END,
+                                     {value}_min,
+                                     {value}_max,
+                                     CASE WHEN {value}_count > 0 THEN {value}_sum * 1.0 / {value}_count END,
+                                     row_count
+                              FROM {spec['summary']}
+                              ORDER BY {spec['group']}''').fetchall()
+
+
+# Итоги числового столбца по всей таблице: (SUM, MIN, MAX, AVG)
+def summary_totals(cursor, workload, value):
+    spec = TABLE_SUMMARIES[workload]
+    return cursor.execute(f'''SELECT CASE WHEN SUM({value}_count) > 0 THEN SUM({value}_sum) END,
+                                     MIN({value}_min),
+                                     MAX({value}_max),
+                                     CASE WHEN SUM({value}_count) > 0 THEN SUM({value}_sum) * 1.0 / SUM({value}_count) END
+                              FROM {spec['summary']}''').fetchone()
+
+
+# Частота значений столбца группировки: (группа, количество) по убыванию количества; равные частоты -
+# в обратном порядке групп, как у запроса с GROUP BY по исходной таблице
+def summary_frequency(cursor, workload):
+    spec = TABLE_SUMMARIES[workload]
+    return cursor.execute(f'''SELECT {spec['group']}, row_count FROM {spec['summary']}
+                              ORDER BY row_count DESC, {spec['group']} DESC''').fetchall()
+
+
+# Средняя цена и количество продаж по жанрам: (жанр, AVG(price), COUNT(price))
+def summary_sales_by_genre(cursor):
+    return cursor.execute(f'''SELECT genre,
+                                     CASE WHEN price_count > 0 THEN price_sum * 1.0 / price_count END,
+                                     price_count
+                              FROM {SALES_SUMMARY}
+                              ORDER BY genre''').fetchall()
+
+
+# Запуск из командной строки:
+#   python -m common.summaries rebuild <файл базы> <нагрузка>
+#   python -m common.summaries check <файл базы> <нагрузка>
+def main(argv):
+    if len(argv) != 3 or argv[0] not in ('rebuild', 'check'):
+        print("Использование: python -m common.summaries rebuild|check <файл базы> <нагрузка>")
+        return 2
+    command, db_file, workload = argv
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    if command == 'rebuild':
+        create_summaries(cursor, workload)
+        conn.commit()
+        print(f"Сводка {workload} пересчитана")
+        result = 0
+    else:
+        mismatches = check_summaries(cursor, workload)
+        for group, stored, expected in mismatches:
+            print(f"Расхождение в группе {group!r}: в сводке {stored}, при пересчёте {expected}")
+        print("Сводка совпадает с полным пересчётом" if not mismatches else f"Расхождений: {len(mismatches)}")
+        result = 1 if mismatches else 0
+    conn.close()
+    return result
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
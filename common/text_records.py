@@ -0,0 +1,210 @@
+import codecs
+import os
+
+from common.profiling import profiled
+
+# Разделитель записей в текстовых файлах формата key::value
+RECORD_SEPARATOR = '====='
+
+# Размер блока чтения файла по умолчанию (1 МБ)
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+# Преобразование строкового флага 'True'/'False' в bool
+def parse_bool(value):
+    return value.strip().lower() == 'true'
+
+
+# Описание полей записи: список кортежей (ключ, функция преобразования, значение по умолчанию)
+SONG_FIELDS = [
+    ('artist', str, ''),
+    ('song', str, ''),
+    ('duration_ms', int, 0),
+    ('year', int, 0),
+    ('tempo', float, 0.0),
+    ('genre', str, ''),
+    ('instrumentalness', float, 0.0),
+    ('explicit', parse_bool, False),
+    ('loudness', float, 0.0),
+]
+
+PRODUCT_FIELDS = [
+    ('name', str, 'Unknown'),
+    ('price', float, 0.0),
+    ('quantity', int, 0),
+    ('category', str, None),
+    ('fromCity', str, 'Unknown'),
+    ('isAvailable', parse_bool, False),
+    ('views', int, 0),
+]
+
+
+# Построчное чтение файла блоками фиксированного размера:
+# в памяти находится только текущий блок и хвост незавершённой строки.
+# start - байтовое смещение начала строки, с которого начинается чтение, end - байт, до которого
+# читается файл (None - до конца); байты, дописанные после end, не читаются
+def iter_lines(filename, chunk_size=DEFAULT_CHUNK_SIZE, start=0, end=None):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(filename, 'rb') as f:
+        if start:
+            f.seek(start)
+        remaining = None if end is None else end - start
+        tail = ''
+        while remaining is None or remaining > 0:
+            data = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            chunk = decoder.decode(data)
+            if not chunk:
+                continue
+            lines = (tail + chunk).splitlines(keepends=True)
+            tail = lines.pop() if not lines[-1].endswith(('\n', '\r')) else ''
+            for line in lines:
+                yield line.rstrip('\r\n')
+        if tail:
+            yield tail
+
+
+# Потоковый разбор записей: каждая строка блока обрабатывается один раз,
+# позиция поля в кортеже находится по словарю, т.е. запись разбирается за O(число полей)
+def iter_records(filename, fields, chunk_size=DEFAULT_CHUNK_SIZE, start=0, end=None):
+    return parse_record_lines(iter_lines(filename, chunk_size, start, end), fields)
+
+
+# Разбор записей из последовательности строк
+def parse_record_lines(lines, fields):
+    positions = {key: i for i, (key, _, _) in enumerate(fields)}
+    defaults = [default for _, _, default in fields]
+    converters = [convert for _, convert, _ in fields]
+
+    raw = [None] * len(fields)
+    has_data = False
+    for line in lines:
+        if line.strip() == RECORD_SEPARATOR:
+            if has_data:
+                record = _build_record(raw, converters, defaults)
+                if record is not None:
+                    yield record
+            raw = [None] * len(fields)
+            has_data = False
+            continue
+
+        key, sep, value = line.partition('::')
+        if not sep:
+            continue
+        pos = positions.get(key.strip())
+        if pos is not None:
+            raw[pos] = value.strip()
+            has_data = True
+
+    # Последняя запись может не завершаться разделителем (дозагрузка через common.incremental.load_end
+    # читает файл только до последнего разделителя, чтобы не вставить недописанную запись)
+    if has_data:
+        record = _build_record(raw, converters, defaults)
+        if record is not None:
+            yield record
+
+
+# Байт сразу после последней полной записи в первых end байтах файла (0, если полных записей нет):
+# после последней строки-разделителя separator, а при separator=None - после последнего перевода строки.
+# За границей может лежать недописанная запись, поэтому дозагрузка файла продолжается с границы, а не с end.
+# Файл просматривается с конца окнами, которые растут, пока граница не найдена
+def record_boundary(filename, end, separator=RECORD_SEPARATOR):
+    marker = separator.encode() if separator is not None else None
+    window = 1 << 16
+    with open(filename, 'rb') as f:
+        while True:
+            begin = max(0, end - window)
+            f.seek(begin)
+            lines = f.read(end - begin).split(b'\n')
+            position = end - len(lines[-1])
+            # Первая строка окна, начатого не с начала файла, может быть неполной
+            for line in reversed(lines[1:-1] if begin else lines[:-1]):
+                if marker is None or line.strip() == marker:
+                    return position
+                position -= len(line) + 1
+            if not begin:
+                return 0
+            window *= 4
+
+
+# Граница последней полной строки (для CSV, где запись - строка)
+def line_boundary(filename, end):
+    return record_boundary(filename, end, separator=None)
+
+
+# Разбиение файла на parts диапазонов байтов по границам строк. Если задан separator,
+# граница ставится сразу после строки-разделителя записей, т.е. записи не разрываются.
+# skip_header=True исключает первую строку (заголовок CSV) из первого диапазона;
+# end - байт, до которого делится файл (None - до конца)
+def split_line_ranges(filename, parts, separator=None, skip_header=False, end=None):
+    size = os.path.getsize(filename) if end is None else end
+    with open(filename, 'rb') as f:
+        start = len(f.readline()) if skip_header else 0
+        bounds = [start]
+        for i in range(1, parts):
+            target = max(start + (size - start) * i // parts, bounds[-1])
+            f.seek(target)
+            if target > 0:
+                f.readline()
+            if separator is not None:
+                while True:
+                    line = f.readline()
+                    if not line or line.strip() == separator.encode():
+                        break
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+        bounds.append(size)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+# Строки из диапазона байтов [start, end) файла
+def read_lines_range(filename, start, end):
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8').splitlines()
+
+
+# Разбор записей из диапазона байтов файла (для параллельного разбора частей одного файла)
+def parse_text_range(filename, fields, start, end):
+    return list(parse_record_lines(read_lines_range(filename, start, end), fields))
+
+
+def _build_record(raw, converters, defaults):
+    try:
+        return tuple(default if value is None else convert(value)
+                     for value, convert, default in zip(raw, converters, defaults))
+    except ValueError as e:
+        print(f"Ошибка обработки записи: {raw}, ошибка: {e}")
+        return None
+
+
+# Группировка записей в пакеты для executemany
+def iter_batches(records, batch_size=1000):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Вставка записей из текстового файла пакетами (байты с start до end, None - до конца файла);
+# возвращает число вставленных строк. on_batch(строки) вызывается после вставки каждого пакета
+@profiled
+def insert_records_from_text(cursor, filename, fields, insert_sql, batch_size=1000,
+                             chunk_size=DEFAULT_CHUNK_SIZE, start=0, on_batch=None, end=None):
+    total = 0
+    for batch in iter_batches(iter_records(filename, fields, chunk_size, start, end), batch_size):
+        cursor.executemany(insert_sql, batch)
+        total += len(batch)
+        if on_batch is not None:
+            on_batch(batch)
+    return total
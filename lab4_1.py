@@ -1,101 +1,158 @@
-import sqlite3
-import pandas as pd
-import msgpack
-import json
+from common.db import bulk_load, close_all, get_connection
+from common.dictionary import DICTIONARY_ENABLED, decode_tables, encode_tables, encoded_frequency_query
+from common.json_export import write_json_rows
+from common.msgpack_records import BOOK_COLUMNS, book_row, load_msgpack_to_db
+from common.paths import data_path
+from common.profiling import span
+from common.schema import create_indexes, drop_indexes, report_query_plans
+from common.search import SEARCH_ENABLED, create_search_index, drop_search_triggers
+from common.summaries import (SUMMARIES_ENABLED, create_summaries, drop_summary_triggers, summary_frequency,
+                              summary_totals)
+
+# Загрузка данных из файла msgpack (каталог задаётся переменной окружения LAB4_DATA_DIR, common.paths)
+file_path = data_path('item.msgpack')
+
+DB_FILE = 'books.db'
 
-# Загрузка данных из файла msgpack
-file_path = r"E:\66\lab4\task1-2\item.msgpack"  # Укажите путь к вашему файлу
-
-# Чтение данных с использованием msgpack
-with open(file_path, 'rb') as file:
-    unpacked_data = msgpack.unpack(file)
+# Выполнение запросов
+VAR = 66
 
-# Если данные представляют собой список словарей, преобразуем их в DataFrame
-data_frame = pd.DataFrame(unpacked_data)
+# Знаков после запятой в статистике рейтинга: сумма по сводке складывается по жанрам, а не по строкам,
+# и расходится с запросом по таблице в последних знаках, округление делает вывод одинаковым в обоих режимах
+STATS_DIGITS = 10
 
-# Создание базы данных SQLite
-conn = sqlite3.connect('books.db')
-cursor = conn.cursor()
 
 # Создание таблицы
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS books (
-    title TEXT,
-    author TEXT,
-    genre TEXT,
-    pages INTEGER,
-    published_year INTEGER,
-    isbn TEXT,
-    rating REAL,
-    views INTEGER
-);
-''')
-
-# Загрузка данных в SQLite
-data_frame.to_sql('books', conn, if_exists='replace', index=False)
+def create_books_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS books (
+        title TEXT,
+        author TEXT,
+        genre TEXT,
+        pages INTEGER,
+        published_year INTEGER,
+        isbn TEXT,
+        rating REAL,
+        views INTEGER
+    );
+    ''')
+
+
+# Загрузка данных в SQLite: потоковое чтение msgpack пакетами в одной транзакции,
+# объявленная схема таблицы сохраняется, старые строки заменяются новыми
+def load_books(filename=file_path):
+    conn = get_connection(DB_FILE)
+    decode_tables(conn)
+    cursor = conn.cursor()
+    create_books_table(cursor)
+    with span('загрузка books'), bulk_load(conn):
+        drop_summary_triggers(cursor, 'books')
+        drop_search_triggers(cursor, 'books')
+        cursor.execute('DELETE FROM books')
+        drop_indexes(cursor, 'books')
+        load_msgpack_to_db(conn, filename, 'INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)', book_row)
+
+
+# Индексы строятся после загрузки (в режиме LAB4_DICTIONARY жанры затем кодируются словарём),
+# после чего выводятся планы запросов
+def build_indexes():
+    conn = get_connection(DB_FILE)
+    cursor = conn.cursor()
+    with span('индексы books'):
+        create_indexes(cursor, 'books')
+        if SUMMARIES_ENABLED:
+            # Сводка по жанрам пересчитывается после загрузки и дальше поддерживается триггерами
+            create_summaries(cursor, 'books')
+        if SEARCH_ENABLED:
+            # Поиск по названию и автору (common.search): индекс перестраивается после загрузки
+            create_search_index(cursor, 'books')
+        conn.commit()
+        if DICTIONARY_ENABLED:
+            encode_tables(conn, 'books')
+    report_query_plans(cursor, 'books')
 
-# Выполнение запросов
-VAR = 66
 
 # 1. Первые VAR+10 строк
-cursor.execute('''
-SELECT * FROM books
-ORDER BY views DESC
-LIMIT ?;
-''', (VAR + 10,))
-top_rows = cursor.fetchall()
-
-# Преобразование результата запроса в формат словаря для удобства сериализации
-columns = ['title', 'author', 'genre', 'pages', 'published_year', 'isbn', 'rating', 'views']
-top_books = [dict(zip(columns, row)) for row in top_rows]
-
-# Сохранение в JSON с нормализованным форматом
-with open('top_books.json', 'w', encoding="utf-8") as file:
-    json.dump(top_books, file, ensure_ascii=False, indent=4)
-
-# 2. Статистика по числовому полю
-cursor.execute('''
-SELECT 
-    SUM(rating) AS total_rating,
-    MIN(rating) AS min_rating,
-    MAX(rating) AS max_rating,
-    AVG(rating) AS avg_rating
-FROM books;
-''')
-stats = cursor.fetchone()
-stats_dict = {
-    'total_rating': stats[0],
-    'min_rating': stats[1],
-    'max_rating': stats[2],
-    'avg_rating': stats[3]
-}
-print("Статистика:", stats_dict)
-
-# 3. Частота встречаемости категориального поля
-cursor.execute('''
-SELECT genre, COUNT(*) AS frequency
-FROM books
-GROUP BY genre
-ORDER BY frequency DESC;
-''')
-genre_frequency = cursor.fetchall()
-genre_frequency_dict = [{'genre': row[0], 'frequency': row[1]} for row in genre_frequency]
-print("Частота жанров:", genre_frequency_dict)
+def export_top_books():
+    cursor = get_connection(DB_FILE).cursor()
+    cursor.execute('''
+    SELECT * FROM books
+    ORDER BY views DESC
+    LIMIT ?;
+    ''', (VAR + 10,))
+
+    # Строки преобразуются в словари и пишутся в JSON по мере чтения курсора
+    columns = BOOK_COLUMNS
+    write_json_rows('top_books.json', cursor, lambda row: dict(zip(columns, row)), indent=4)
+
+
+# 2. Статистика по числовому полю (в режиме сводок - по таблице books_genre_summary)
+def print_rating_stats():
+    cursor = get_connection(DB_FILE).cursor()
+    if SUMMARIES_ENABLED:
+        stats = summary_totals(cursor, 'books', 'rating')
+    else:
+        cursor.execute('''
+        SELECT
+            SUM(rating) AS total_rating,
+            MIN(rating) AS min_rating,
+            MAX(rating) AS max_rating,
+            AVG(rating) AS avg_rating
+        FROM books;
+        ''')
+        stats = cursor.fetchone()
+    stats = [round(value, STATS_DIGITS) if isinstance(value, float) else value for value in stats]
+    stats_dict = {
+        'total_rating': stats[0],
+        'min_rating': stats[1],
+        'max_rating': stats[2],
+        'avg_rating': stats[3]
+    }
+    print("Статистика:", stats_dict)
+
+
+# 3. Частота встречаемости категориального поля (у закодированной таблицы - группировка по коду жанра)
+def print_genre_frequency():
+    cursor = get_connection(DB_FILE).cursor()
+    encoded_query = encoded_frequency_query(cursor, 'books', 'genre', count_nulls=True)
+    if SUMMARIES_ENABLED:
+        genre_frequency = summary_frequency(cursor, 'books')
+    elif encoded_query:
+        # Равные частоты - в обратном порядке жанров, как у сортировки групп в запросе по тексту
+        genre_frequency = cursor.execute(
+            f"SELECT * FROM ({encoded_query}) ORDER BY frequency DESC, genre DESC").fetchall()
+    else:
+        cursor.execute('''
+        SELECT genre, COUNT(*) AS frequency
+        FROM books
+        GROUP BY genre
+        ORDER BY frequency DESC;
+        ''')
+        genre_frequency = cursor.fetchall()
+    genre_frequency_dict = [{'genre': row[0], 'frequency': row[1]} for row in genre_frequency]
+    print("Частота жанров:", genre_frequency_dict)
+
 
 # 4. Отфильтрованные строки
-cursor.execute('''
-SELECT * FROM books
-WHERE rating > 4
-ORDER BY views DESC
-LIMIT ?;
-''', (VAR + 10,))
-filtered_rows = cursor.fetchall()
-
-# Преобразование в формат словаря
-filtered_books = [dict(zip(columns, row)) for row in filtered_rows]
-
-# Сохранение отфильтрованных данных в JSON с нормализованным форматом
-with open('filtered_books.json', 'w', encoding="utf-8") as file:
-    json.dump(filtered_books, file, ensure_ascii=False, indent=4)
-
-conn.close()
+def export_filtered_books():
+    cursor = get_connection(DB_FILE).cursor()
+    cursor.execute('''
+    SELECT * FROM books
+    WHERE rating > 4
+    ORDER BY views DESC
+    LIMIT ?;
+    ''', (VAR + 10,))
+
+    # Сохранение отфильтрованных данных в JSON по мере чтения курсора
+    columns = BOOK_COLUMNS
+    write_json_rows('filtered_books.json', cursor, lambda row: dict(zip(columns, row)), indent=4)
+
+
+if __name__ == '__main__':
+    load_books()
+    build_indexes()
+    export_top_books()
+    print_rating_stats()
+    print_genre_frequency()
+    export_filtered_books()
+    close_all()
@@ -1,105 +1,169 @@
 import sqlite3
-import pandas as pd
 import json
-import msgpack
 
+from common.columnar import load_dataframe_to_db, read_pickle_frame
+from common.db import bulk_load, close_all, get_connection
+from common.dictionary import DICTIONARY_ENABLED, data_table, decode_tables, encode_tables, encoded_columns
+from common.json_export import write_json_rows
+from common.msgpack_records import book_row, load_msgpack_to_db
+from common.paths import data_path
+from common.profiling import profiled
+from common.query_cache import cached_query
+from common.reports import extrema_query, report, run_reports
+from common.rollups import ROLLUPS_ENABLED, drop_rollups, rebuild_rollups, with_epoch_days
+from common.schema import create_indexes, drop_indexes, report_query_plans
+from common.sketches import (SKETCHES_ENABLED, batch_observer, error_bounds, new_sketches, save_sketches,
+                             sketch_distinct_counts, sketch_quantiles)
+from common.summaries import SUMMARIES_ENABLED, create_summaries, drop_summary_triggers, summary_sales_by_genre
+
+DB_FILE = 'books_and_sales.db'
+
+
+# Загрузка данных из файлов (каталог задаётся переменной окружения LAB4_DATA_DIR, common.paths)
+def load_data(filename=None):
+    # Загрузка данных из subitem.pkl
+    return read_pickle_frame(filename or data_path('subitem.pkl'))
 
-# Загрузка данных из файлов
-def load_data():
-    # Загрузка данных из item.msgpack
-    with open(r"E:\66\lab4\task1-2\item.msgpack", 'rb') as f:
-        books_data = pd.DataFrame(msgpack.unpack(f, raw=False))
 
-    # Загрузка данных из subitem.pkl
-    sales_data = pd.read_pickle(r"E:\66\lab4\task1-2\subitem.pkl")
-    if isinstance(sales_data, list):
-        sales_data = pd.DataFrame(sales_data)
+# Создание таблицы для данных книг
+def create_books_table():
+    conn = get_connection(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute('''CREATE TABLE IF NOT EXISTS books
+                      (title TEXT, author TEXT, genre TEXT, pages INTEGER, published_year INTEGER,
+                       isbn TEXT, rating REAL, views INTEGER)''')
+    conn.commit()
+
 
-    return books_data, sales_data
+# Наполнение таблицы books потоковым чтением item.msgpack (пакетами, в одной транзакции)
+@profiled
+def populate_books_from_msgpack(filename, use_mmap=False):
+    conn = get_connection(DB_FILE)
+    with bulk_load(conn):
+        drop_summary_triggers(conn.cursor(), 'books_and_sales')
+        conn.execute("DELETE FROM books")
+        drop_indexes(conn.cursor(), 'books_and_sales', table='books')
+        load_msgpack_to_db(conn, filename, "INSERT INTO books VALUES (?, ?, ?, ?, ?, ?, ?, ?)", book_row,
+                           use_mmap=use_mmap)
 
 
-# Создание таблицы для данных subitems
+# Создание таблицы для данных subitems. Кроме даты продажи в исходном виде хранится её номер дня
+# от 1970-01-01 (date_day, common.rollups); в таблицу прежних запусков столбец добавляется
 def create_subitems_table():
-    conn = sqlite3.connect('books_and_sales.db')
+    conn = get_connection(DB_FILE)
     cursor = conn.cursor()
     cursor.execute('''CREATE TABLE IF NOT EXISTS subitems
-                      (title TEXT REFERENCES books (title), price INTEGER, place TEXT, date TEXT)''')
+                      (title TEXT REFERENCES books (title), price INTEGER, place TEXT, date TEXT, date_day INTEGER)''')
+    if 'date_day' not in [row[1] for row in cursor.execute("PRAGMA table_info(subitems)")]:
+        cursor.execute("ALTER TABLE subitems ADD COLUMN date_day INTEGER")
     conn.commit()
-    conn.close()
 
 
-# Наполнение таблицы subitems данными из DataFrame
+# Наполнение таблицы subitems данными из DataFrame: столбцы приводятся к типам таблицы один раз
+# и вставляются порциями без построчного преобразования всего DataFrame в списки.
+# Старые строки заменяются новыми, как и в books, поэтому повторный запуск не удваивает продажи.
+# Скетчи цен и названий (LAB4_SKETCHES) собираются по вставляемым порциям и заменяют прежние,
+# сводки продаж по дням, неделям и месяцам (LAB4_ROLLUPS) пересчитываются в той же транзакции
+@profiled
 def populate_subitems_from_dataframe(df):
-    conn = sqlite3.connect('books_and_sales.db')
+    conn = get_connection(DB_FILE)
+    with bulk_load(conn):
+        cursor = conn.cursor()
+        drop_summary_triggers(cursor, 'books_and_sales')
+        cursor.execute("DELETE FROM subitems")
+        drop_indexes(cursor, 'books_and_sales', table='subitems')
+        sketches = new_sketches(cursor, 'books_and_sales') if SKETCHES_ENABLED else None
+        load_dataframe_to_db(conn, with_epoch_days(df), 'subitems', ['title', 'price', 'place', 'date', 'date_day'],
+                             on_batch=batch_observer(sketches))
+        if sketches is not None:
+            save_sketches(cursor, sketches, reset=True)
+        # Без LAB4_ROLLUPS устаревшие сводки удаляются, и запросы за период читают subitems по индексу
+        if ROLLUPS_ENABLED:
+            rebuild_rollups(cursor)
+        else:
+            drop_rollups(cursor)
+
+
+# Построение индексов (и сводки продаж по жанрам, если включены сводки) после загрузки данных,
+# кодирование жанров и мест продаж словарями (LAB4_DICTIONARY) и вывод планов запросов
+@profiled
+def build_indexes():
+    conn = get_connection(DB_FILE)
     cursor = conn.cursor()
-    values = df[['title', 'price', 'place', 'date']].values.tolist()
-    cursor.executemany("INSERT INTO subitems VALUES (?, ?, ?, ?)", values)
+    create_indexes(cursor, 'books_and_sales')
+    if SUMMARIES_ENABLED:
+        create_summaries(cursor, 'books_and_sales')
     conn.commit()
-    conn.close()
+    if DICTIONARY_ENABLED:
+        encode_tables(conn, 'books_and_sales')
+    report_query_plans(cursor, 'books_and_sales')
 
 
-# Запрос 1: Вывод цен и мест продаж
+# Запрос 1: Вывод цен и мест продаж. Порядок строк задан явно (книги в порядке таблицы, продажи книги -
+# по цене и месту), как у соединения без индексов: индекс по названию меняет порядок обхода. У представления
+# закодированной таблицы rowid нет, поэтому книги читаются из books_data (название не кодируется)
+@profiled
 def display_book_prices_and_places():
-    conn = sqlite3.connect('books_and_sales.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_connection(DB_FILE)
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
+    books = data_table('books') if encoded_columns(cursor, 'books') else 'books'
     cursor.execute(
-        "SELECT books.title, subitems.price, subitems.place FROM books JOIN subitems ON books.title = subitems.title")
-    results = cursor.fetchall()
-    data = []
-    for result in results:
-        book_info = {
+        f"SELECT books.title, subitems.price, subitems.place FROM {books} AS books "
+        "JOIN subitems ON books.title = subitems.title ORDER BY books.rowid, subitems.price, subitems.place")
+    write_json_rows(
+        r'book_prices_and_places.json', cursor,
+        lambda result: {
             "Книга": result['title'],
             "Цена": result['price'],
             "Место продажи": result['place']
-        }
-        data.append(book_info)
-    with open(r'book_prices_and_places.json', 'w', encoding='utf-8') as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
-    conn.close()
+        },
+        indent=4)
+
+
+# Источник данных для отчётов по продажам книг
+BOOK_SALES_SOURCE = "books JOIN subitems ON books.title = subitems.title"
+
+# Отчёты по продажам: статистика по жанрам и самая дешёвая/дорогая книга (название и цена)
+GENRE_STATS_REPORT = report(
+    'genre_stats', BOOK_SALES_SOURCE, ['AVG(subitems.price)', 'COUNT(subitems.price)'], group_by='books.genre')
+PRICE_EXTREMA_QUERY = extrema_query(BOOK_SALES_SOURCE, 'subitems.price', 'books.title')
 
 
 # Запрос 2: Средняя цена и количество продаж по жанрам
-def average_price_and_sales_by_genre():
-    conn = sqlite3.connect('books_and_sales.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT books.genre, AVG(subitems.price), COUNT(subitems.price) FROM books JOIN subitems ON books.title = subitems.title GROUP BY books.genre")
-    results = cursor.fetchall()
-    data = []
-    for result in results:
-        genre_info = {
-            "Категория": result['genre'],
+@profiled
+def average_price_and_sales_by_genre(rows=None):
+    if rows is None:
+        cursor = get_connection(DB_FILE).cursor()
+        if SUMMARIES_ENABLED:
+            rows = summary_sales_by_genre(cursor)
+        else:
+            rows = run_reports(cursor, [GENRE_STATS_REPORT])['genre_stats']
+    write_json_rows(
+        r'average_price_and_sales_by_genre.json', rows,
+        lambda result: {
+            "Категория": result[0],
             "Средняя цена": result[1],
             "Количество продаж": result[2]
-        }
-        data.append(genre_info)
-    with open(r'average_price_and_sales_by_genre.json', 'w', encoding='utf-8') as file:
-        json.dump(data, file, indent=4, ensure_ascii=False)
-    conn.close()
+        },
+        indent=4)
 
 
-# Запрос 3: Самая дорогая и самая дешевая книга
-def find_cheapest_and_most_expensive_books():
-    conn = sqlite3.connect('books_and_sales.db')
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT books.title, subitems.price FROM books JOIN subitems ON books.title = subitems.title ORDER BY subitems.price ASC LIMIT 1")
-    cheapest_book = cursor.fetchone()
-    cursor.execute(
-        "SELECT books.title, subitems.price FROM books JOIN subitems ON books.title = subitems.title ORDER BY subitems.price DESC LIMIT 1")
-    most_expensive_book = cursor.fetchone()
+# Запрос 3: Самая дорогая и самая дешевая книга (встроенные MIN и MAX)
+@profiled
+def find_cheapest_and_most_expensive_books(rows=None):
+    if rows is None:
+        rows = cached_query(get_connection(DB_FILE), PRICE_EXTREMA_QUERY)
+    cheapest_title, cheapest_price, most_expensive_title, most_expensive_price = rows[0]
 
     cheapest_book_info = {
-        "Самая дешевая книга": cheapest_book['title'],
-        "Цена": cheapest_book['price']
+        "Самая дешевая книга": cheapest_title,
+        "Цена": cheapest_price
     }
 
     most_expensive_book_info = {
-        "Самая дорогая книга": most_expensive_book['title'],
-        "Цена": most_expensive_book['price']
+        "Самая дорогая книга": most_expensive_title,
+        "Цена": most_expensive_price
     }
 
     data = {
@@ -109,13 +173,62 @@ def find_cheapest_and_most_expensive_books():
 
     with open(r'cheapest_and_most_expensive_books.json', 'w', encoding='utf-8') as file:
         json.dump(data, file, indent=4, ensure_ascii=False)
-    conn.close()
 
 
+# Запрос 4 (LAB4_SKETCHES): перцентили цен и число различных книг в продажах по жанрам и местам продажи.
+# Читаются скетчи, собранные при загрузке (O(число групп)), вместе с границами их ошибок
+@profiled
+def export_price_percentiles():
+    cursor = get_connection(DB_FILE).cursor()
+    data = {}
+    for dimension, title in (('genre', "По жанрам"), ('place', "По местам продажи")):
+        distinct = dict(sketch_distinct_counts(cursor, 'books_and_sales', dimension))
+        data[title] = [{
+            "Группа": value,
+            "Количество продаж": row_count,
+            "Медиана цены": quantiles[0],
+            "90-й перцентиль цены": quantiles[1],
+            "99-й перцентиль цены": quantiles[2],
+            "Различных книг": distinct[value]
+        } for value, row_count, quantiles in sketch_quantiles(cursor, 'books_and_sales', dimension)]
+    bounds = error_bounds()
+    data["Точность"] = {
+        "Ошибка ранга перцентилей (99%)": bounds['quantile_rank_error'],
+        "Относительная ошибка числа различных книг": bounds['distinct_relative_error']
+    }
+
+    with open(r'price_percentiles.json', 'w', encoding='utf-8') as file:
+        json.dump(data, file, indent=4, ensure_ascii=False)
+
 
-books_data, sales_data = load_data()
-create_subitems_table()
-populate_subitems_from_dataframe(sales_data)
-display_book_prices_and_places()
-average_price_and_sales_by_genre()
-find_cheapest_and_most_expensive_books()
+# Все отчёты по продажам одним вызовом: отчёты с общим источником и группировкой
+# выполняются одним проходом, результаты раскладываются по прежним JSON-файлам
+@profiled
+def run_book_reports():
+    if SUMMARIES_ENABLED:
+        # Статистика по жанрам читается из сводки
+        average_price_and_sales_by_genre()
+    else:
+        results = run_reports(get_connection(DB_FILE).cursor(), [GENRE_STATS_REPORT])
+        average_price_and_sales_by_genre(results['genre_stats'])
+    find_cheapest_and_most_expensive_books()
+
+
+# Таблицы books и subitems из исходных файлов (закодированные прежним запуском таблицы сначала раскодируются)
+def load_tables(msgpack_filename=None, pickle_filename=None):
+    sales_data = load_data(pickle_filename)
+    decode_tables(get_connection(DB_FILE))
+    create_books_table()
+    populate_books_from_msgpack(msgpack_filename or data_path('item.msgpack'))
+    create_subitems_table()
+    populate_subitems_from_dataframe(sales_data)
+
+
+if __name__ == '__main__':
+    load_tables()
+    build_indexes()
+    display_book_prices_and_places()
+    run_book_reports()
+    if SKETCHES_ENABLED:
+        export_price_percentiles()
+    close_all()
@@ -1,11 +1,38 @@
+import os
+import sys
 import sqlite3
-import msgpack
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.db import bulk_load, close_all, get_connection
+from common.dictionary import (DICTIONARY_ENABLED, build_junction, decode_tables, encode_tables,
+                               encoded_frequency_query, value_frequency_query)
+from common.json_export import write_json_rows
+from common.msgpack_records import load_msgpack_to_db, song_row
+from common.parallel_ingest import (DEFAULT_WORKERS, PARALLEL_ENABLED, msgpack_source_task, run_parallel_ingest,
+                                    text_source_tasks)
+from common.profiling import profiled
+from common.query_builder import aggregate_query, frequency_query, select_query
+from common.query_cache import cached_query
+from common.incremental import FULL, ingest_source, load_end, record_source, source_state
+from common.schema import create_indexes, drop_indexes, ensure_natural_key, report_query_plans, upsert_sql
+from common.search import SEARCH_ENABLED, create_search_index, drop_search_triggers
+from common.sketches import (SKETCHES_ENABLED, batch_observer, error_bounds, finish_sketches, new_sketches,
+                             sketch_distinct_counts, sketch_quantiles)
+from common.text_records import SONG_FIELDS, insert_records_from_text, record_boundary
+
+DB_FILE = 'songs_database.db'
+
+# Повторная загрузка той же песни (artist, song) обновляет строку, а не добавляет дубль
+SONG_INSERT_SQL = upsert_sql('songs', ['artist', 'song', 'duration_ms', 'year', 'tempo', 'genre', 'instrumentalness',
+                                       'explicit', 'loudness'])
+
 
 # 1. Создание таблицы для песен
 def create_songs_table():
-    conn = sqlite3.connect('songs_database.db')
+    conn = get_connection(DB_FILE)
+    decode_tables(conn)
     cursor = conn.cursor()
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS songs (
@@ -20,103 +47,86 @@ def create_songs_table():
         explicit BOOLEAN,
         loudness REAL
     )''')
+    ensure_natural_key(cursor, 'songs')
     conn.commit()
-    conn.close()
 
 
-# 2. Заполнение таблицы из файла MessagePack
-def populate_songs_from_msgpack(filename):
-    conn = sqlite3.connect('songs_database.db')
-    cursor = conn.cursor()
-
-    with open(filename, 'rb') as file:
-        data = msgpack.load(file, raw=False)
-
-        # Преобразуем данные в формат для вставки в таблицу
-        values = []
-        for item in data:
-            artist = item.get('artist', '')
-            song = item.get('song', '')
-            duration_ms = int(item.get('duration_ms', 0))
-            year = int(item.get('year', 0))
-            tempo = float(item.get('tempo', 0.0))
-            genre = item.get('genre', '')
-            instrumentalness = float(item.get('instrumentalness', 0.0))
-            explicit = item.get('explicit', 'False').lower() == 'true'
-            loudness = float(item.get('loudness', 0.0))
-
-            # Добавляем запись в список значений
-            values.append((artist, song, duration_ms, year, tempo, genre, instrumentalness, explicit, loudness))
-
-        # Вставляем данные в таблицу
-        cursor.executemany(
-            "INSERT INTO songs (artist, song, duration_ms, year, tempo, genre, instrumentalness, explicit, loudness) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            values)
-        conn.commit()
-
-    conn.close()
+# 2. Заполнение таблицы из файла MessagePack (потоковое чтение пакетами в одной транзакции;
+# on_batch получает каждый вставленный пакет строк)
+@profiled
+def populate_songs_from_msgpack(filename, use_mmap=False, on_batch=None):
+    conn = get_connection(DB_FILE)
+    with bulk_load(conn):
+        drop_indexes(conn.cursor(), 'songs')
+        drop_search_triggers(conn.cursor(), 'songs')
+        load_msgpack_to_db(conn, filename, SONG_INSERT_SQL, song_row, use_mmap=use_mmap, on_batch=on_batch)
+
+
+# 3. Заполнение таблицы из текстового файла формата key::value (потоковое чтение пакетами,
+# start - байт, с которого читаются дописанные записи, end - до которого; индекс поиска получает
+# дописанные записи через триггеры)
+@profiled
+def populate_songs_from_txt(filename, start=0, on_batch=None, end=None):
+    conn = get_connection(DB_FILE)
+    with bulk_load(conn):
+        cursor = conn.cursor()
+        if not start:
+            drop_indexes(cursor, 'songs')
+            drop_search_triggers(cursor, 'songs')
+        insert_records_from_text(cursor, filename, SONG_FIELDS, SONG_INSERT_SQL, start=start, on_batch=on_batch,
+                                 end=end)
+
+
+# 2-3. Параллельная загрузка обоих источников: части текстового файла разбираются в пуле процессов,
+# msgpack - потоково пакетами, вставка идёт в одном потоке в том же порядке, что и при последовательной загрузке
+@profiled
+def populate_songs_parallel(msgpack_filename, txt_filename, workers=DEFAULT_WORKERS, on_batch=None):
+    conn = get_connection(DB_FILE)
+    drop_indexes(conn.cursor(), 'songs')
+    drop_search_triggers(conn.cursor(), 'songs')
+    conn.commit()
+    tasks = [msgpack_source_task(msgpack_filename, song_row, SONG_INSERT_SQL)]
+    tasks += text_source_tasks(txt_filename, SONG_FIELDS, SONG_INSERT_SQL, end=load_end(txt_filename, record_boundary))
+    run_parallel_ingest(DB_FILE, tasks, max_workers=workers, on_batch=on_batch)
 
 
-# 3. Заполнение таблицы из текстового файла
-def populate_songs_from_txt(filename):
-    conn = sqlite3.connect('songs_database.db')
+# Построение индексов, таблицы связей песен с отдельными жанрами и индекса поиска по исполнителю
+# и названию (LAB4_SEARCH) после загрузки данных, кодирование жанров словарём (LAB4_DICTIONARY) и вывод планов запросов
+@profiled
+def build_indexes():
+    conn = get_connection(DB_FILE)
     cursor = conn.cursor()
-
-    with open(filename, 'r', encoding='utf-8') as txtfile:
-        lines = txtfile.readlines()
-
-        values = []
-        for line in lines:
-            parts = line.strip().split('  ')  # Допустим, данные разделены двумя пробелами
-            if len(parts) == 9:  # Проверяем, что строка имеет 9 элементов
-                artist, song, duration_ms, year, tempo, genre, instrumentalness, explicit, loudness = parts
-                try:
-                    duration_ms = int(duration_ms)
-                    year = int(year)
-                    tempo = float(tempo)
-                    instrumentalness = float(instrumentalness)
-                    explicit = explicit.lower() == 'true'
-                    loudness = float(loudness)
-
-                    values.append((artist, song, duration_ms, year, tempo, genre, instrumentalness, explicit, loudness))
-                except ValueError:
-                    print(f"Skipping invalid line: {line}")
-
-        cursor.executemany(
-            "INSERT INTO songs (artist, song, duration_ms, year, tempo, genre, instrumentalness, explicit, loudness) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            values)
-        conn.commit()
-    conn.close()
+    create_indexes(cursor, 'songs')
+    build_junction(cursor, 'songs')
+    if SEARCH_ENABLED:
+        create_search_index(cursor, 'songs')
+    conn.commit()
+    if DICTIONARY_ENABLED:
+        encode_tables(conn, 'songs')
+    report_query_plans(cursor, 'songs')
 
 
 # 4. Запрос 1: Вывод первых VAR+10 строк, отсортированных по произвольному числовому полю
+@profiled
 def export_first_sorted_to_json(var, sort_field):
-    conn = sqlite3.connect('songs_database.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_connection(DB_FILE)
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
 
-    query = f"SELECT * FROM songs ORDER BY {sort_field} LIMIT {var + 10}"
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    query, params = select_query('songs', order_by=sort_field, limit=var + 10)
+    cursor.execute(query, params)
 
     headers = [description[0] for description in cursor.description]
-    data = [dict(zip(headers, row)) for row in rows]
-
-    filename = "first_sorted.json"
-    with open(filename, 'w', encoding='utf-8') as outfile:
-        json.dump(data, outfile, indent=4)
-
-    conn.close()
+    write_json_rows("first_sorted.json", cursor, lambda row: dict(zip(headers, row)), indent=4, ensure_ascii=True)
 
 
 # 5. Запрос 2: Вывод суммы, минимума, максимума и среднего для произвольного числового поля
+@profiled
 def export_aggregate_results(numeric_field):
-    conn = sqlite3.connect('songs_database.db')
-    cursor = conn.cursor()
+    conn = get_connection(DB_FILE)
 
-    query = f"SELECT SUM({numeric_field}), MIN({numeric_field}), MAX({numeric_field}), AVG({numeric_field}) FROM songs"
-    cursor.execute(query)
-    result = cursor.fetchone()
+    query, params = aggregate_query('songs', [numeric_field])
+    result = cached_query(conn, query, params)[0]
 
     data = {
         "Сумма": result[0],
@@ -129,50 +139,114 @@ def export_aggregate_results(numeric_field):
     with open(filename, 'w', encoding='utf-8') as outfile:
         json.dump(data, outfile, indent=4, ensure_ascii=False)
 
-    conn.close()
-
 
 # 6. Запрос 3: Вывод частоты встречаемости для категориального поля
+# (у закодированного столбца - группировка по целому коду)
+@profiled
 def export_categorical_frequency(categorical_field):
-    conn = sqlite3.connect('songs_database.db')
-    cursor = conn.cursor()
+    conn = get_connection(DB_FILE)
+
+    query, params = frequency_query('songs', categorical_field)
+    query = encoded_frequency_query(conn.cursor(), 'songs', categorical_field) or query
+    rows = cached_query(conn, query, params)
 
-    query = f"SELECT {categorical_field}, COUNT({categorical_field}) AS frequency FROM songs GROUP BY {categorical_field}"
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    write_json_rows("categorical_frequency.json", rows, lambda row: {"category": row[0], "frequency": row[1]},
+                    indent=4, ensure_ascii=True)
 
-    data = [{"category": row[0], "frequency": row[1]} for row in rows]
 
-    with open("categorical_frequency.json", "w", encoding='utf-8') as json_file:
-        json.dump(data, json_file, indent=4)
+# 6a. Частота отдельных жанров: строка "hip hop, pop" учитывается в жанрах hip hop и pop
+@profiled
+def export_genre_frequency():
+    conn = get_connection(DB_FILE)
+    rows = cached_query(conn, value_frequency_query('songs'))
 
-    conn.close()
+    write_json_rows("genre_frequency.json", rows, lambda row: {"genre": row[0], "frequency": row[1]},
+                    indent=4, ensure_ascii=True)
+
+
+# 6b. Перцентили длительности и число различных песен по жанрам из скетчей (LAB4_SKETCHES), с границами ошибок
+@profiled
+def export_duration_percentiles():
+    cursor = get_connection(DB_FILE).cursor()
+    distinct = dict(sketch_distinct_counts(cursor, 'songs', 'genre'))
+    data = {
+        "error_bounds": error_bounds(),
+        "genres": [{
+            "genre": value,
+            "count": row_count,
+            "distinct_songs": distinct[value],
+            "p50": quantiles[0],
+            "p90": quantiles[1],
+            "p99": quantiles[2]
+        } for value, row_count, quantiles in sketch_quantiles(cursor, 'songs', 'genre')]
+    }
 
+    with open("duration_percentiles.json", 'w', encoding='utf-8') as outfile:
+        json.dump(data, outfile, indent=4, ensure_ascii=True)
 
-# 7. Запрос 4: Вывод первых VAR+15 строк, отфильтрованных по произвольному предикату, отсортированных по числовому полю
+
+# 7. Запрос 4: Вывод первых VAR+15 строк, отфильтрованных по произвольному предикату, отсортированных по числовому полю.
+# Предикат - список условий (столбец, оператор, значение) или строка вида "year > 2000" (common.query_builder)
+@profiled
 def export_filtered_sorted_to_json(var, filter_predicate, sort_field):
-    conn = sqlite3.connect('songs_database.db')
-    conn.row_factory = sqlite3.Row
+    conn = get_connection(DB_FILE)
     cursor = conn.cursor()
+    cursor.row_factory = sqlite3.Row
 
-    query = f"SELECT * FROM songs WHERE {filter_predicate} ORDER BY {sort_field} LIMIT {var + 15}"
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    query, params = select_query('songs', where=filter_predicate, order_by=sort_field, limit=var + 15)
+    cursor.execute(query, params)
 
     headers = [description[0] for description in cursor.description]
-    data = [dict(zip(headers, row)) for row in rows]
+    write_json_rows("filtered_sorted.json", cursor, lambda row: dict(zip(headers, row)), indent=4, ensure_ascii=True)
+
+
+# 2-3. Загрузка только новых данных: неизменённые файлы пропускаются, у текстового файла
+# дочитываются дописанные записи, изменённый msgpack загружается целиком (строки обновляются по ключу).
+# Скетчи длительностей (LAB4_SKETCHES) пополняются записями, загружаемыми в пустую таблицу, и дописанным
+# хвостом; после перезагрузки источника в непустую таблицу или обновления песен по ключу (одна песня
+# в обоих источниках) они пересобираются по таблице
+def populate_songs(msgpack_filename, txt_filename):
+    conn = get_connection(DB_FILE)
+    cursor = conn.cursor()
+    sketches = new_sketches(cursor, 'songs') if SKETCHES_ENABLED else None
+    fresh = cursor.execute("SELECT 1 FROM songs LIMIT 1").fetchone() is None
+    observe = batch_observer(sketches) if fresh else None
+    if (PARALLEL_ENABLED and source_state(cursor, msgpack_filename, appendable=False)[0] == FULL
+            and source_state(cursor, txt_filename)[0] == FULL):
+        populate_songs_parallel(msgpack_filename, txt_filename, on_batch=observe)
+        record_source(cursor, msgpack_filename)
+        record_source(cursor, txt_filename, boundary=record_boundary)
+        conn.commit()
+        modes = [FULL]
+    else:
+        modes = [
+            ingest_source(conn, msgpack_filename,
+                          lambda start, end: populate_songs_from_msgpack(msgpack_filename, on_batch=observe),
+                          appendable=False),
+            ingest_source(conn, txt_filename,
+                          lambda start, end: populate_songs_from_txt(
+                              txt_filename, start, on_batch=batch_observer(sketches) if start else observe, end=end),
+                          boundary=record_boundary),
+        ]
+    if sketches is not None:
+        finish_sketches(cursor, sketches, fresh, reloaded=not fresh and FULL in modes)
+        conn.commit()
 
-    filename = "filtered_sorted.json"
-    with open(filename, 'w', encoding='utf-8') as outfile:
-        json.dump(data, outfile, indent=4)
 
-    conn.close()
+# 1-3. Таблица songs из обоих источников
+def build_songs_table(msgpack_filename='_part_2.msgpack', txt_filename='_part_1.text'):
+    create_songs_table()
+    populate_songs(msgpack_filename, txt_filename)
 
 
-create_songs_table()
-populate_songs_from_msgpack('_part_2.msgpack')
-populate_songs_from_txt('_part_1.text')
-export_first_sorted_to_json(66, 'duration_ms')
-export_aggregate_results('tempo')
-export_categorical_frequency('genre')
-export_filtered_sorted_to_json(66, 'year > 2000', 'year')
+if __name__ == '__main__':
+    build_songs_table()
+    build_indexes()
+    export_first_sorted_to_json(66, 'duration_ms')
+    export_aggregate_results('tempo')
+    export_categorical_frequency('genre')
+    export_genre_frequency()
+    if SKETCHES_ENABLED:
+        export_duration_percentiles()
+    export_filtered_sorted_to_json(66, [('year', '>', 2000)], 'year')
+    close_all()
@@ -1,6 +1,22 @@
+import os
+import sys
 import sqlite3
 import csv
-import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.db import bulk_load, close_all, get_connection, transaction
+from common.dictionary import DICTIONARY_ENABLED, decode_tables, encode_tables
+from common.json_export import write_json_rows
+from common.profiling import profiled
+from common.query_cache import cached_query, invalidate
+from common.reports import report, run_reports
+from common.incremental import FULL, TAIL, load_end, record_source, source_state
+from common.schema import create_indexes, drop_indexes, ensure_natural_key, report_query_plans, upsert_sql
+from common.search import SEARCH_ENABLED, create_search_index, drop_search_triggers
+from common.summaries import SUMMARIES_ENABLED, create_summaries, drop_summary_triggers, summary_group_stats
+from common.text_records import (PRODUCT_FIELDS, insert_records_from_text, iter_lines, line_boundary, parse_bool,
+                                 record_boundary)
 
 # Имена файлов
 product_data_file = '_product_data.text'
@@ -21,49 +37,51 @@ def create_products_table(cursor):
         views INTEGER,
         update_counter INTEGER DEFAULT 0  -- Счётчик обновлений
     )''')
+    ensure_natural_key(cursor, 'products')
 
-# Обработка данных из .text файла (товары)
-def insert_products_from_text(cursor, products_data):
-    products = products_data.split('=====\n')  # Разделим товары по разделителю
-    all_products = []
-    for product in products:
-        product_info = product.strip().split('\n')
-        try:
-            name = next((line.split('::')[1].strip() for line in product_info if line.startswith('name::')), 'Unknown')
-            price = float(next((line.split('::')[1].strip() for line in product_info if line.startswith('price::')), 0.0))
-            quantity = int(next((line.split('::')[1].strip() for line in product_info if line.startswith('quantity::')), 0))
-            category = next((line.split('::')[1].strip() for line in product_info if line.startswith('category::')), None)
-            fromCity = next((line.split('::')[1].strip() for line in product_info if line.startswith('fromCity::')), 'Unknown')
-            isAvailable = next((line.split('::')[1].strip() for line in product_info if line.startswith('isAvailable::')), 'False') == 'True'
-            views = int(next((line.split('::')[1].strip() for line in product_info if line.startswith('views::')), 0))
-            all_products.append((name, price, quantity, category, fromCity, isAvailable, views))
-        except Exception as e:
-            print(f"Ошибка обработки строки: {product_info}, ошибка: {e}")
-
-    cursor.executemany(
-        '''INSERT INTO products (name, price, quantity, category, fromCity, isAvailable, views) 
-           VALUES (?, ?, ?, ?, ?, ?, ?)''',
-        all_products)
+# Обработка данных из .text файла (товары): потоковый разбор записей и вставка пакетами, байты с start
+# до end (None - до конца файла). Товар с уже известным именем обновляется, счётчик обновлений при этом сохраняется
+@profiled
+def insert_products_from_text(cursor, filename, start=0, end=None):
+    insert_records_from_text(
+        cursor, filename, PRODUCT_FIELDS,
+        upsert_sql('products', ['name', 'price', 'quantity', 'category', 'fromCity', 'isAvailable', 'views']),
+        start=start, end=end)
 
-# Загрузка изменений из CSV файла
-def load_changes_from_csv(file_path):
+# Загрузка изменений из CSV файла (разделитель полей - ';'); start - байт, с которого читаются дописанные строки,
+# end - до которого (None - до конца файла). Читаются только полные строки: строка без перевода строки в конце
+# файла, возможно, ещё дописывается, а изменения не идемпотентны, поэтому она применяется следующим запуском
+def load_changes_from_csv(file_path, start=0, end=None):
     changes = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            changes.append({
-                "name": row.get("name", ""),
-                "method": row.get("method", ""),
-                "param": row.get("param", "")
-            })
+    with open(file_path, 'rb') as f:
+        header = f.readline()
+    fieldnames = next(csv.reader([header.decode('utf-8').rstrip('\r\n')], delimiter=';'))
+    end = line_boundary(file_path, os.path.getsize(file_path) if end is None else end)
+    reader = csv.DictReader(iter_lines(file_path, start=max(start, len(header)), end=end),
+                            fieldnames=fieldnames, delimiter=';')
+    for row in reader:
+        changes.append({
+            "name": row.get("name", ""),
+            "method": row.get("method", ""),
+            "param": row.get("param", "")
+        })
     return changes
 
-# Применение изменений
+# Преобразование параметра изменения: для 'available' это флаг True/False, для остальных методов - число
+def parse_change_param(method, param):
+    if not param:
+        return None
+    if method == 'available':
+        return parse_bool(param)
+    return float(param)
+
+# Применение изменений (построчно)
+@profiled
 def apply_changes(cursor, changes):
     for change in changes:
         name = change['name']
         method = change['method']
-        param = float(change['param']) if change['param'] else None
+        param = parse_change_param(method, change['param'])
 
         if method == 'available':
             cursor.execute("UPDATE products SET isAvailable = ?, update_counter = update_counter + 1 WHERE name = ?", (param, name))
@@ -78,71 +96,216 @@ def apply_changes(cursor, changes):
         elif method == 'remove':
             cursor.execute("DELETE FROM products WHERE name = ?", (name,))
 
+# Применение изменений пакетно: журнал загружается во временную таблицу, операции по каждому
+# товару сворачиваются по порядку рекурсивным CTE, итог применяется одним UPDATE ... FROM и одним DELETE.
+# Арифметика та же, что и в построчном режиме, поэтому итоговые цены, остатки и update_counter совпадают
+@profiled
+def apply_changes_bulk(cursor, changes):
+    cursor.execute("DROP TABLE IF EXISTS temp.change_log")
+    cursor.execute('''CREATE TEMP TABLE change_log (
+                          seq INTEGER PRIMARY KEY,
+                          name TEXT,
+                          method TEXT,
+                          param REAL,
+                          step INTEGER)''')
+    cursor.executemany(
+        "INSERT INTO temp.change_log (name, method, param) VALUES (?, ?, ?)",
+        ((change['name'], change['method'], parse_change_param(change['method'], change['param']))
+         for change in changes))
+
+    # Товар удаляется, если для него есть 'remove': после удаления остальные операции ни на что не влияют
+    cursor.execute("DELETE FROM products WHERE name IN (SELECT name FROM temp.change_log WHERE method = 'remove')")
+
+    # Порядковый номер операции внутри товара
+    cursor.execute('''UPDATE temp.change_log SET step = numbered.step
+                      FROM (SELECT seq, ROW_NUMBER() OVER (PARTITION BY name ORDER BY seq) AS step
+                            FROM temp.change_log
+                            WHERE method IN ('available', 'price_percent', 'price_abs', 'quantity_add', 'quantity_sub')) AS numbered
+                      WHERE change_log.seq = numbered.seq''')
+    cursor.execute("CREATE INDEX temp.change_log_name_step ON change_log (name, step)")
+
+    cursor.execute("DROP TABLE IF EXISTS temp.net_changes")
+    cursor.execute('''CREATE TEMP TABLE net_changes AS
+                      WITH RECURSIVE folded(id, name, step, price, quantity, isAvailable, update_counter) AS (
+                          SELECT id, name, 0, price, quantity, isAvailable, update_counter
+                          FROM products
+                          WHERE name IN (SELECT name FROM temp.change_log WHERE step IS NOT NULL)
+                          UNION ALL
+                          SELECT f.id, f.name, c.step,
+                                 CASE c.method
+                                     WHEN 'price_percent' THEN f.price * (1 + c.param)
+                                     WHEN 'price_abs' THEN f.price + c.param
+                                     ELSE f.price END,
+                                 CASE c.method
+                                     WHEN 'quantity_add' THEN f.quantity + c.param
+                                     WHEN 'quantity_sub' THEN f.quantity - c.param
+                                     ELSE f.quantity END,
+                                 CASE c.method WHEN 'available' THEN c.param ELSE f.isAvailable END,
+                                 f.update_counter + 1
+                          FROM folded f
+                          JOIN temp.change_log c ON c.name = f.name AND c.step = f.step + 1
+                      )
+                      SELECT id, price, quantity, isAvailable, update_counter
+                      FROM folded
+                      WHERE (id, step) IN (SELECT id, MAX(step) FROM folded GROUP BY id)''')
+
+    cursor.execute('''UPDATE products
+                      SET price = n.price,
+                          quantity = n.quantity,
+                          isAvailable = n.isAvailable,
+                          update_counter = n.update_counter
+                      FROM temp.net_changes AS n
+                      WHERE products.id = n.id''')
+
+    cursor.execute("DROP TABLE temp.net_changes")
+    cursor.execute("DROP TABLE temp.change_log")
+
+# Проверка, что пакетный и построчный режимы дают одинаковое состояние таблицы products
+def check_bulk_matches_rowwise(product_file, changes):
+    states = []
+    for apply in (apply_changes, apply_changes_bulk):
+        conn = sqlite3.connect(':memory:')
+        cursor = conn.cursor()
+        create_products_table(cursor)
+        insert_products_from_text(cursor, product_file)
+        apply(cursor, changes)
+        states.append(cursor.execute("SELECT * FROM products ORDER BY id").fetchall())
+        conn.close()
+    return states[0] == states[1]
+
 # Топ-10 самых обновляемых товаров
+@profiled
 def query_top_updated_products(cursor):
-    cursor.execute("SELECT name, update_counter FROM products ORDER BY update_counter DESC LIMIT 10")
-    return cursor.fetchall()
+    return cached_query(cursor.connection, "SELECT name, update_counter FROM products ORDER BY update_counter DESC LIMIT 10")
+
+# Анализ цен и остатков по категориям: оба отчёта группируют products по category,
+# поэтому планировщик вычисляет их за один проход по таблице
+PRICE_ANALYSIS_REPORT = report(
+    'price_analysis', 'products',
+    ['SUM(price)', 'MIN(price)', 'MAX(price)', 'AVG(price)', 'COUNT(*)'], group_by='category')
+QUANTITY_ANALYSIS_REPORT = report(
+    'quantity_analysis', 'products',
+    ['SUM(quantity)', 'MIN(quantity)', 'MAX(quantity)', 'AVG(quantity)', 'COUNT(*)'], group_by='category')
 
 # Анализ цен товаров по категориям
+@profiled
 def query_price_analysis(cursor):
-    cursor.execute('''SELECT category, 
-                             SUM(price), 
-                             MIN(price), 
-                             MAX(price), 
-                             AVG(price), 
-                             COUNT(*)
-                      FROM products 
-                      GROUP BY category''')
-    return cursor.fetchall()
+    return run_reports(cursor, [PRICE_ANALYSIS_REPORT])['price_analysis']
 
 # Анализ остатков товаров по категориям
+@profiled
 def query_quantity_analysis(cursor):
-    cursor.execute('''SELECT category, 
-                             SUM(quantity), 
-                             MIN(quantity), 
-                             MAX(quantity), 
-                             AVG(quantity), 
-                             COUNT(*)
-                      FROM products 
-                      GROUP BY category''')
-    return cursor.fetchall()
-
-# Произвольный запрос
+    return run_reports(cursor, [QUANTITY_ANALYSIS_REPORT])['quantity_analysis']
+
+# Анализ цен и остатков за один проход
+@profiled
+def query_category_analysis(cursor):
+    results = run_reports(cursor, [PRICE_ANALYSIS_REPORT, QUANTITY_ANALYSIS_REPORT])
+    return results['price_analysis'], results['quantity_analysis']
+
+# Произвольный запрос; результат может быть большим, поэтому возвращается курсор, который читается при записи в файл
+@profiled
 def query_custom(cursor):
-    cursor.execute('''SELECT name, price, quantity FROM products WHERE price > 50000 AND quantity < 50''')
-    return cursor.fetchall()
+    return cursor.execute('''SELECT name, price, quantity FROM products WHERE price > 50000 AND quantity < 50''')
+
 
+# Таблица products: загрузка товаров, индекс и применение журнала изменений.
+# summaries=True - статистика по категориям поддерживается в сводной таблице триггерами
+def build_products_table(product_file=product_data_file, update_file=update_data_file, bulk=True,
+                         summaries=SUMMARIES_ENABLED):
+    conn = get_connection(database_file)
+    cursor = conn.cursor()
 
-conn = sqlite3.connect(database_file)
-cursor = conn.cursor()
+    # Создание таблицы и загрузка данных. Журнал изменений не идемпотентен, поэтому если файл товаров
+    # или журнал изменён не дописыванием (или загружается впервые), таблица собирается заново:
+    # все товары и весь журнал. Иначе загружаются только дописанные товары и применяются новые изменения
+    decode_tables(conn)
+    create_products_table(cursor)
+    products_mode, products_start = source_state(cursor, product_file)
+    changes_mode, changes_start = source_state(cursor, update_file)
+    rebuild = FULL in (products_mode, changes_mode)
 
-# Создание таблицы и загрузка данных
-create_products_table(cursor)
+    if rebuild or products_mode == TAIL:
+        with bulk_load(conn):
+            drop_summary_triggers(cursor, 'products')
+            if rebuild:
+                drop_indexes(cursor, 'products')
+                drop_search_triggers(cursor, 'products')
+                cursor.execute("DELETE FROM products")
+            insert_products_from_text(cursor, product_file, 0 if rebuild else products_start,
+                                      load_end(product_file, record_boundary))
+        with transaction(conn):
+            record_source(cursor, product_file, boundary=record_boundary)
 
-with open(product_data_file, 'r', encoding='utf-8') as f:
-    products_data = f.read()
-insert_products_from_text(cursor, products_data)
+    # Индекс по name нужен для применения изменений, поэтому строится до apply_changes
+    create_indexes(cursor, 'products')
+    report_query_plans(cursor, 'products')
 
-changes = load_changes_from_csv(update_data_file)
-apply_changes(cursor, changes)
+    # Сводка строится после загрузки, изменения из CSV дальше учитываются триггерами
+    if summaries:
+        create_summaries(cursor, 'products')
 
-conn.commit()
+    # Индекс поиска по названию: дописанные товары и изменения из CSV учитываются триггерами
+    if SEARCH_ENABLED:
+        create_search_index(cursor, 'products')
 
+    # Изменения применяются и отмечаются в отпечатке в одной транзакции, чтобы не применить их дважды
+    if rebuild or changes_mode == TAIL:
+        changes = load_changes_from_csv(update_file, 0 if rebuild else changes_start,
+                                        load_end(update_file, line_boundary))
+        with transaction(conn):
+            if bulk:
+                apply_changes_bulk(cursor, changes)
+            else:
+                apply_changes(cursor, changes)
+            record_source(cursor, update_file, boundary=line_boundary)
+        invalidate(database_file)
 
-top_updated_products = query_top_updated_products(cursor)
-price_analysis = query_price_analysis(cursor)
-quantity_analysis = query_quantity_analysis(cursor)
-custom_query_result = query_custom(cursor)
+    conn.commit()
+
+    # Категории и города кодируются словарями после всех изменений: дальше таблица только читается
+    if DICTIONARY_ENABLED:
+        encode_tables(conn, 'products')
 
-conn.close()
 
 # Сохранение результатов в файлы
-with open('top_updated_products.json', 'w', encoding='utf-8') as f:
-    json.dump(top_updated_products, f, ensure_ascii=False, indent=4)
-with open('price_analysis.json', 'w', encoding='utf-8') as f:
-    json.dump(price_analysis, f, ensure_ascii=False, indent=4)
-with open('quantity_analysis.json', 'w', encoding='utf-8') as f:
-    json.dump(quantity_analysis, f, ensure_ascii=False, indent=4)
-with open('custom_query_result.json', 'w', encoding='utf-8') as f:
-    json.dump(custom_query_result, f, ensure_ascii=False, indent=4)
+def export_top_updated_products():
+    cursor = get_connection(database_file).cursor()
+    write_json_rows('top_updated_products.json', query_top_updated_products(cursor), indent=4)
+
+
+# Знаков после запятой в анализе по категориям: суммы в сводке накапливаются триггерами по мере изменений
+# и расходятся с GROUP BY по таблице в последних знаках, округление делает вывод одинаковым в обоих режимах
+STATS_DIGITS = 10
+
+
+def round_stats(rows):
+    return [tuple(round(value, STATS_DIGITS) if isinstance(value, float) else value for value in row) for row in rows]
+
+
+def export_category_analysis(summaries=SUMMARIES_ENABLED):
+    cursor = get_connection(database_file).cursor()
+    if summaries:
+        price_analysis = summary_group_stats(cursor, 'products', 'price')
+        quantity_analysis = summary_group_stats(cursor, 'products', 'quantity')
+    else:
+        price_analysis, quantity_analysis = query_category_analysis(cursor)
+    write_json_rows('price_analysis.json', round_stats(price_analysis), indent=4)
+    write_json_rows('quantity_analysis.json', round_stats(quantity_analysis), indent=4)
+
+
+def export_custom_query():
+    cursor = get_connection(database_file).cursor()
+    write_json_rows('custom_query_result.json', query_custom(cursor), indent=4)
+
+
+def main(bulk=True, summaries=SUMMARIES_ENABLED):
+    build_products_table(product_data_file, update_data_file, bulk, summaries)
+    export_top_updated_products()
+    export_category_analysis(summaries)
+    export_custom_query()
+    close_all()
+
 
+if __name__ == '__main__':
+    main()
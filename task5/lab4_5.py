@@ -1,8 +1,24 @@
-import sqlite3
-import json
+import functools
+import os
+import sys
 import csv
 from datetime import datetime
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from common.db import bulk_load, close_all, get_connection, transaction
+from common.dictionary import DICTIONARY_ENABLED, decode_tables, encode_tables, encoded_frequency_query
+from common.json_export import write_json_rows
+from common.parallel_ingest import DEFAULT_WORKERS, PARALLEL_ENABLED, parse_task, run_parallel_ingest, task_parts
+from common.profiling import profiled
+from common.json_records import iter_json_array
+from common.incremental import FULL, TAIL, load_end, record_source, source_state
+from common.schema import create_indexes, drop_indexes, ensure_natural_key, report_query_plans, upsert_sql
+from common.text_records import iter_batches, iter_lines, line_boundary, read_lines_range, split_line_ranges
+
+# Размер пакета строк для одного вызова executemany
+DEFAULT_BATCH_SIZE = 1000
+
 
 def create_tables(cursor):
     cursor.execute('''CREATE TABLE IF NOT EXISTS Manufacturer (
@@ -40,111 +56,295 @@ def create_tables(cursor):
                       Power_perf_factor REAL,
                       FOREIGN KEY (Car_id) REFERENCES Car(Manufacturer_id))''')
 
-
-def load_data_to_db(cursor, json_file, csv_file):
-    with open(json_file, 'r', encoding='utf-8') as file:
-        json_data = json.load(file)
-        manufacturers = list(set([data.get('Manufacturer') for data in json_data]))
-        cursor.executemany('INSERT INTO Manufacturer (name) VALUES (?)',
-                           [(manufacturer,) for manufacturer in manufacturers])
-        manufacturer_ids = {manufacturer: idx + 1 for idx, manufacturer in enumerate(manufacturers)}
-        cursor.executemany(
-            'INSERT INTO Car (Manufacturer_id, Model, Sales_in_thousands, __year_resale_value) VALUES (?, ?, ?, ?)',
-            [(manufacturer_ids[data.get('Manufacturer')], data.get('Model'), data.get('Sales_in_thousands') or None,
-              data.get('__year_resale_value') or None) for data in json_data])
-
-    with open(csv_file, 'r', newline='', encoding='utf-8') as file:
-        csv_data = csv.reader(file)
-        next(csv_data)
-        for row in csv_data:
-            manufacturer_id = manufacturer_ids.get(row[0])
-            horsepower = int(row[3]) if row[3] else None
-            wheelbase = float(row[4]) if row[4] else None
-            width = float(row[5]) if row[5] else None
-            length = float(row[6]) if row[6] else None
-            curb_weight = float(row[7]) if row[7] else None
-            fuel_capacity = float(row[8]) if row[8] else None
-            fuel_efficiency = float(row[9]) if row[9] else None
-            latest_launch = datetime.strptime(row[10], '%m/%d/%Y').date() if row[10] else None
-            power_perf_factor = float(row[11]) if row[11] else None
-
-            if row[1] and row[2]:
-                cursor.execute(
-                    'INSERT INTO CarDetails (Car_id, Vehicle_type, Price_in_thousands, Engine_size, Horsepower) VALUES (?, ?, ?, ?, ?)',
-                    (manufacturer_id, row[0], float(row[1]), float(row[2]), horsepower))
-
-            cursor.execute(
-                'INSERT INTO CarDimensions (Car_id, Wheelbase, Width, Length, Curb_weight) VALUES (?, ?, ?, ?, ?)',
-                (manufacturer_id, wheelbase, width, length, curb_weight))
-            cursor.execute(
-                'INSERT INTO CarPerformance (Car_id, Fuel_capacity, Fuel_efficiency, Latest_Launch, Power_perf_factor) VALUES (?, ?, ?, ?, ?)',
-                (manufacturer_id, fuel_capacity, fuel_efficiency, latest_launch, power_perf_factor))
-
-
+    ensure_natural_key(cursor, 'Manufacturer')
+    ensure_natural_key(cursor, 'Car')
+
+
+# Даты запуска в CSV сильно повторяются, поэтому разбор кэшируется. Дата сохраняется строкой ISO,
+# как её записывал стандартный адаптер sqlite3 для date
+@functools.lru_cache(maxsize=4096)
+def parse_launch_date(text):
+    return datetime.strptime(text, '%m/%d/%Y').date().isoformat()
+
+
+# Разбор строки CSV: строки для CarDetails (или None), CarDimensions и CarPerformance.
+# Первый элемент каждой строки - ключ для поиска id производителя
+def parse_csv_row(row):
+    horsepower = int(row[3]) if row[3] else None
+    wheelbase = float(row[4]) if row[4] else None
+    width = float(row[5]) if row[5] else None
+    length = float(row[6]) if row[6] else None
+    curb_weight = float(row[7]) if row[7] else None
+    fuel_capacity = float(row[8]) if row[8] else None
+    fuel_efficiency = float(row[9]) if row[9] else None
+    latest_launch = parse_launch_date(row[10]) if row[10] else None
+    power_perf_factor = float(row[11]) if row[11] else None
+
+    details = (row[0], row[0], float(row[1]), float(row[2]), horsepower) if row[1] and row[2] else None
+    dimensions = (row[0], wheelbase, width, length, curb_weight)
+    performance = (row[0], fuel_capacity, fuel_efficiency, latest_launch, power_perf_factor)
+    return details, dimensions, performance
+
+
+# Производители и модели загружаются по естественным ключам: повторная загрузка того же
+# производителя ничего не меняет, той же модели - обновляет продажи
+MANUFACTURER_INSERT_SQL = upsert_sql('Manufacturer', ['id', 'name'], update=[])
+CAR_INSERT_SQL = upsert_sql('Car', ['Manufacturer_id', 'Model', 'Sales_in_thousands', '__year_resale_value'])
+
+CAR_DETAILS_INSERT_SQL = ('INSERT INTO CarDetails (Car_id, Vehicle_type, Price_in_thousands, Engine_size, Horsepower) '
+                          'VALUES (?, ?, ?, ?, ?)')
+CAR_DIMENSIONS_INSERT_SQL = ('INSERT INTO CarDimensions (Car_id, Wheelbase, Width, Length, Curb_weight) '
+                             'VALUES (?, ?, ?, ?, ?)')
+CAR_PERFORMANCE_INSERT_SQL = ('INSERT INTO CarPerformance (Car_id, Fuel_capacity, Fuel_efficiency, Latest_Launch, '
+                              'Power_perf_factor) VALUES (?, ?, ?, ?, ?)')
+
+
+# Потоковый разбор car_sales.json: для каждой записи пара (строка Manufacturer или None, строка Car).
+# Новые производители получают id по порядку первого появления в файле после уже известных
+# (manufacturer_ids дополняется), поэтому id не меняются от запуска к запуску
+def iter_json_car_rows(json_file, manufacturer_ids):
+    next_id = max(manufacturer_ids.values(), default=0) + 1
+    for data in iter_json_array(json_file):
+        name = data.get('Manufacturer')
+        manufacturer = None
+        if name not in manufacturer_ids:
+            manufacturer_ids[name] = next_id
+            manufacturer = (next_id, name)
+            next_id += 1
+        yield manufacturer, (manufacturer_ids[name], data.get('Model'), data.get('Sales_in_thousands') or None,
+                             data.get('__year_resale_value') or None)
+
+
+# Загрузка car_sales.json пакетами; возвращает словарь {производитель: id}
+def load_cars_from_json(cursor, json_file, batch_size=DEFAULT_BATCH_SIZE):
+    manufacturer_ids = dict(cursor.execute("SELECT name, id FROM Manufacturer"))
+    for batch in iter_batches(iter_json_car_rows(json_file, manufacturer_ids), batch_size):
+        cursor.executemany(MANUFACTURER_INSERT_SQL, [manufacturer for manufacturer, _ in batch if manufacturer])
+        cursor.executemany(CAR_INSERT_SQL, [car for _, car in batch])
+    return manufacturer_ids
+
+
+# Загрузка строк car_sales1.csv, начиная с байта start (0 - с начала файла, после заголовка) до байта end
+# (None - до конца файла). Загружаются только полные строки: строку без перевода строки в конце файла,
+# возможно, ещё дописывают, а у строк нет ключа, так что повторная загрузка их бы удвоила.
+# Строки каждой таблицы копятся в своём буфере и вставляются пакетами по batch_size через executemany
+def load_car_rows_from_csv(cursor, csv_file, manufacturer_ids, start=0, batch_size=DEFAULT_BATCH_SIZE, end=None):
+    buffers = {CAR_DETAILS_INSERT_SQL: [], CAR_DIMENSIONS_INSERT_SQL: [], CAR_PERFORMANCE_INSERT_SQL: []}
+
+    def flush():
+        for sql, rows in buffers.items():
+            if rows:
+                cursor.executemany(sql, rows)
+                rows.clear()
+
+    with open(csv_file, 'rb') as file:
+        header = len(file.readline())
+    end = line_boundary(csv_file, os.path.getsize(csv_file) if end is None else end)
+    for row in csv.reader(iter_lines(csv_file, start=max(start, header), end=end)):
+        details, dimensions, performance = parse_csv_row(row)
+        manufacturer_id = manufacturer_ids.get(row[0])
+
+        if details is not None:
+            buffers[CAR_DETAILS_INSERT_SQL].append((manufacturer_id,) + details[1:])
+        buffers[CAR_DIMENSIONS_INSERT_SQL].append((manufacturer_id,) + dimensions[1:])
+        buffers[CAR_PERFORMANCE_INSERT_SQL].append((manufacturer_id,) + performance[1:])
+        if len(buffers[CAR_DIMENSIONS_INSERT_SQL]) >= batch_size:
+            flush()
+    flush()
+
+
+@profiled
+def load_data_to_db(cursor, json_file, csv_file, csv_end=None):
+    manufacturer_ids = load_cars_from_json(cursor, json_file)
+    load_car_rows_from_csv(cursor, csv_file, manufacturer_ids, end=csv_end)
+
+
+# У строк CSV нет естественного ключа, поэтому полная перезагрузка начинается с очистки всех таблиц
+def clear_tables(cursor):
+    for table in ('CarPerformance', 'CarDimensions', 'CarDetails', 'Car', 'Manufacturer'):
+        cursor.execute(f"DELETE FROM {table}")
+
+
+# Параллельная загрузка (только в пустые таблицы, id производителей нумеруются с 1): id производителя
+# для строк CSV ищется при вставке по временной таблице manufacturer_ids, которую заполняет задача
+# разбора JSON (она записывается первой)
+MANUFACTURER_ID = "(SELECT id FROM temp.manufacturer_ids WHERE name = ?)"
+
+
+# Запрос вставки, в котором первый параметр (имя производителя) заменяется его id
+def with_manufacturer_id(sql):
+    return sql.replace('VALUES (?', f'VALUES ({MANUFACTURER_ID}', 1)
+
+PARALLEL_SETUP = [
+    "CREATE TEMP TABLE IF NOT EXISTS manufacturer_ids (name TEXT PRIMARY KEY, id INTEGER)",
+    "DELETE FROM temp.manufacturer_ids",
+]
+
+
+# Задача разбора car_sales.json (таблицы пусты, поэтому id производителей нумеруются с 1
+# в том же порядке, что и при последовательной загрузке)
+def parse_json_source(json_file):
+    manufacturer_ids = {}
+    rows = list(iter_json_car_rows(json_file, manufacturer_ids))
+    return [
+        (MANUFACTURER_INSERT_SQL, [manufacturer for manufacturer, _ in rows if manufacturer]),
+        ('INSERT INTO temp.manufacturer_ids (name, id) VALUES (?, ?)', list(manufacturer_ids.items())),
+        (CAR_INSERT_SQL, [car for _, car in rows]),
+    ]
+
+
+# Задача разбора части car_sales1.csv (диапазон байтов по границам строк)
+def parse_csv_range(csv_file, start, end):
+    details_rows, dimensions_rows, performance_rows = [], [], []
+    for row in csv.reader(read_lines_range(csv_file, start, end)):
+        details, dimensions, performance = parse_csv_row(row)
+        if details is not None:
+            details_rows.append(details)
+        dimensions_rows.append(dimensions)
+        performance_rows.append(performance)
+    return [
+        (with_manufacturer_id(CAR_DETAILS_INSERT_SQL), details_rows),
+        (with_manufacturer_id(CAR_DIMENSIONS_INSERT_SQL), dimensions_rows),
+        (with_manufacturer_id(CAR_PERFORMANCE_INSERT_SQL), performance_rows),
+    ]
+
+
+# JSON и части CSV разбираются в пуле процессов, запись идёт в одном потоке в порядке задач
+@profiled
+def load_data_parallel(db_file, json_file, csv_file, workers=DEFAULT_WORKERS):
+    csv_end = load_end(csv_file, line_boundary)
+    tasks = [parse_task(parse_json_source, json_file)]
+    tasks += [parse_task(parse_csv_range, csv_file, start, end)
+              for start, end in split_line_ranges(csv_file, task_parts(csv_file, end=csv_end), skip_header=True,
+                                                  end=csv_end)]
+    run_parallel_ingest(db_file, tasks, max_workers=workers, setup=PARALLEL_SETUP)
+
+
+# Каждый запрос выполняется в отдельном курсоре; строки читаются лениво при сохранении в файл
+@profiled
 def execute_queries(cursor):
-    cursor.execute("SELECT * FROM Car WHERE Sales_in_thousands > 200")
-    result1 = cursor.fetchall()
+    conn = cursor.connection
 
-    cursor.execute("SELECT * FROM CarDetails ORDER BY Price_in_thousands DESC LIMIT 5")
-    result2 = cursor.fetchall()
+    result1 = conn.execute("SELECT * FROM Car WHERE Sales_in_thousands > 200")
 
-    cursor.execute("SELECT COUNT(*), Vehicle_type FROM CarDetails GROUP BY Vehicle_type")
-    result3 = cursor.fetchall()
+    result2 = conn.execute("SELECT * FROM CarDetails ORDER BY Price_in_thousands DESC LIMIT 5")
 
-    cursor.execute(
+    # У закодированного столбца группировка идёт по целому коду типа
+    encoded_query = encoded_frequency_query(cursor, 'CarDetails', 'Vehicle_type', count_nulls=True)
+    if encoded_query:
+        result3 = conn.execute(f"SELECT frequency, Vehicle_type FROM ({encoded_query})")
+    else:
+        result3 = conn.execute("SELECT COUNT(*), Vehicle_type FROM CarDetails GROUP BY Vehicle_type")
+
+    result4 = conn.execute(
         "SELECT Manufacturer.name, AVG(Car.Sales_in_thousands) FROM Manufacturer JOIN Car ON Manufacturer.id = Car.Manufacturer_id GROUP BY Manufacturer.name")
-    result4 = cursor.fetchall()
 
-    cursor.execute("SELECT * FROM CarDetails WHERE Engine_size = (SELECT MAX(Engine_size) FROM CarDetails)")
-    result5 = cursor.fetchall()
+    result5 = conn.execute("SELECT * FROM CarDetails WHERE Engine_size = (SELECT MAX(Engine_size) FROM CarDetails)")
 
-    cursor.execute("SELECT * FROM CarDimensions WHERE Length > 180")
-    result6 = cursor.fetchall()
+    # Порядок строк - как у полного просмотра таблицы (по индексу Length строки шли бы по длине)
+    result6 = conn.execute("SELECT * FROM CarDimensions WHERE Length > 180 ORDER BY rowid")
 
     return result1, result2, result3, result4, result5, result6
 
 
+@profiled
 def save_results_to_json(result1, result2, result3, result4, result5, result6):
-    with open('result1-выборка.json', 'w') as json_file:
-        json.dump(
-            [{'Manufacturer_id': row[0], 'Model': row[1], 'Sales_in_thousands': row[2], '__year_resale_value': row[3]}
-             for row in result1], json_file, indent=2)
-
-    with open('result2-сортировка.json', 'w') as json_file:
-        json.dump([{'Manufacturer_id': row[0], 'Vehicle_type': row[1], 'Price_in_thousands': row[2],
-                    'Engine_size': row[3], 'Horsepower': row[4]} for row in result2], json_file, indent=2)
+    write_json_rows(
+        'result1-выборка.json', result1,
+        lambda row: {'Manufacturer_id': row[0], 'Model': row[1], 'Sales_in_thousands': row[2],
+                     '__year_resale_value': row[3]},
+        indent=2, ensure_ascii=True)
+
+    write_json_rows(
+        'result2-сортировка.json', result2,
+        lambda row: {'Manufacturer_id': row[0], 'Vehicle_type': row[1], 'Price_in_thousands': row[2],
+                     'Engine_size': row[3], 'Horsepower': row[4]},
+        indent=2, ensure_ascii=True)
+
+    write_json_rows('result3-агрегация.json', result3, lambda row: {'Count': row[0], 'Vehicle_type': row[1]},
+                    indent=2, ensure_ascii=True)
+
+    write_json_rows('result4-группировка.json', result4,
+                    lambda row: {'Manufacturer': row[0], 'Average_Sales_in_thousands': row[1]},
+                    indent=2, ensure_ascii=True)
+
+    write_json_rows(
+        'result5-выборка_макс_объем.json', result5,
+        lambda row: {'Manufacturer_id': row[0], 'Vehicle_type': row[1], 'Price_in_thousands': row[2],
+                     'Engine_size': row[3], 'Horsepower': row[4]},
+        indent=2, ensure_ascii=True)
+
+    write_json_rows(
+        'result6-выборка_длина_более_180.json', result6,
+        lambda row: {'Manufacturer_id': row[0], 'Wheelbase': row[1], 'Width': row[2], 'Length': row[3],
+                     'Curb_weight': row[4]},
+        indent=2, ensure_ascii=True)
+
+
+DB_FILE = 'data_frame.db'
+JSON_FILE = 'car_sales.json'
+CSV_FILE = 'car_sales1.csv'
+
+
+# Загрузка таблиц. Неизменённые файлы пропускаются, дописанные строки CSV загружаются отдельно,
+# иначе (первая загрузка, изменённый JSON или CSV) таблицы собираются заново
+def load_tables(db_file=DB_FILE, json_file=JSON_FILE, csv_file=CSV_FILE):
+    conn = get_connection(db_file)
+    decode_tables(conn)
+    cursor = conn.cursor()
 
-    with open('result3-агрегация.json', 'w') as json_file:
-        json.dump([{'Count': row[0], 'Vehicle_type': row[1]} for row in result3], json_file, indent=2)
+    create_tables(cursor)
 
-    with open('result4-группировка.json', 'w') as json_file:
-        json.dump([{'Manufacturer': row[0], 'Average_Sales_in_thousands': row[1]} for row in result4], json_file,
-                  indent=2)
+    json_mode, _ = source_state(cursor, json_file, appendable=False)
+    csv_mode, csv_start = source_state(cursor, csv_file)
+    rebuild = FULL in (json_mode, csv_mode)
+    if rebuild and PARALLEL_ENABLED:
+        drop_indexes(cursor, 'cars')
+        clear_tables(cursor)
+        conn.commit()
+        load_data_parallel(db_file, json_file, csv_file)
+    elif rebuild:
+        with bulk_load(conn):
+            drop_indexes(cursor, 'cars')
+            clear_tables(cursor)
+            load_data_to_db(cursor, json_file, csv_file, load_end(csv_file, line_boundary))
+    elif csv_mode == TAIL:
+        with bulk_load(conn):
+            manufacturer_ids = dict(cursor.execute("SELECT name, id FROM Manufacturer"))
+            load_car_rows_from_csv(cursor, csv_file, manufacturer_ids, csv_start,
+                                   end=load_end(csv_file, line_boundary))
+    if rebuild or csv_mode == TAIL:
+        with transaction(conn):
+            if rebuild:
+                record_source(cursor, json_file)
+            record_source(cursor, csv_file, boundary=line_boundary)
+
+
+# Индексы строятся после загрузки (в режиме LAB4_DICTIONARY типы машин затем кодируются словарём),
+# после чего выводятся планы запросов
+def build_indexes(db_file=DB_FILE):
+    conn = get_connection(db_file)
+    cursor = conn.cursor()
+    create_indexes(cursor, 'cars')
+    conn.commit()
+    if DICTIONARY_ENABLED:
+        encode_tables(conn, 'cars')
+    report_query_plans(cursor, 'cars')
 
-    with open('result5-выборка_макс_объем.json', 'w') as json_file:
-        json.dump([{'Manufacturer_id': row[0], 'Vehicle_type': row[1], 'Price_in_thousands': row[2],
-                    'Engine_size': row[3], 'Horsepower': row[4]} for row in result5], json_file, indent=2)
 
-    with open('result6-выборка_длина_более_180.json', 'w') as json_file:
-        json.dump(
-            [{'Manufacturer_id': row[0], 'Wheelbase': row[1], 'Width': row[2], 'Length': row[3], 'Curb_weight': row[4]}
-             for row in result6], json_file, indent=2)
+def export_results(db_file=DB_FILE):
+    conn = get_connection(db_file)
+    results = execute_queries(conn.cursor())
+    save_results_to_json(*results)
+    conn.commit()
 
 
 def main():
-    db_file = r'data_frame.db'
-    json_file = r'car_sales.json'
-    csv_file = r'car_sales1.csv'
-
-    conn = sqlite3.connect(db_file)
-    cursor = conn.cursor()
-
-    create_tables(cursor)
-    load_data_to_db(cursor, json_file, csv_file)
-    results = execute_queries(cursor)
-    save_results_to_json(*results)
-
-    conn.commit()
-    conn.close()
+    load_tables()
+    build_indexes()
+    export_results()
+    close_all()
 
 
+if __name__ == '__main__':
+    main()
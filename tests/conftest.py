@@ -0,0 +1,24 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+# Запуск скрипта задачи (путь от корня репозитория) отдельным процессом в каталоге workdir.
+# Переменные LAB4_* окружения теста не наследуются, флаги задаются аргументом env;
+# исходные данные lab4_1.py/lab4_2.py берутся из task1-2 репозитория
+@pytest.fixture
+def run_script():
+    def run(script, workdir, **env):
+        environ = {name: value for name, value in os.environ.items() if not name.startswith('LAB4_')}
+        environ['LAB4_DATA_DIR'] = os.path.join(ROOT, 'task1-2')
+        environ.update(env)
+        result = subprocess.run([sys.executable, os.path.join(ROOT, script)], cwd=workdir, env=environ,
+                                capture_output=True, text=True)
+        assert result.returncode == 0, result.stderr
+        return result.stdout
+    return run
@@ -0,0 +1,69 @@
+import os
+import random
+import sqlite3
+
+from conftest import ROOT
+from task4.lab4_4 import (apply_changes, apply_changes_bulk, check_bulk_matches_rowwise, create_products_table,
+                          insert_products_from_text, load_changes_from_csv)
+
+PRODUCT_FILE = os.path.join(ROOT, 'task4', '_product_data.text')
+UPDATE_FILE = os.path.join(ROOT, 'task4', '_update_data.csv')
+
+# Методы изменений и их веса в случайном журнале: удаление редкое, чтобы большинство товаров доживало до конца
+METHODS = ['available', 'price_percent', 'price_abs', 'quantity_add', 'quantity_sub', 'remove']
+WEIGHTS = [20, 20, 20, 20, 20, 1]
+
+
+# Состояние products после применения журнала changes функцией apply
+def products_after(apply, changes):
+    conn = sqlite3.connect(':memory:')
+    try:
+        cursor = conn.cursor()
+        create_products_table(cursor)
+        insert_products_from_text(cursor, PRODUCT_FILE)
+        apply(cursor, changes)
+        return cursor.execute("SELECT * FROM products ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+# Случайный журнал изменений: товары из файла и неизвестные имена, все методы, пустые параметры,
+# несколько операций подряд для одного товара и операции после удаления
+def random_changes(seed, count):
+    rng = random.Random(seed)
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.cursor()
+    create_products_table(cursor)
+    insert_products_from_text(cursor, PRODUCT_FILE)
+    names = [name for name, in cursor.execute("SELECT name FROM products")]
+    conn.close()
+    names = rng.sample(names, 20) + ['unknown product']
+
+    changes = []
+    for _ in range(count):
+        method = rng.choices(METHODS, WEIGHTS)[0]
+        if method == 'remove' or rng.random() < 0.05:
+            param = ''
+        elif method == 'available':
+            param = rng.choice(['True', 'False'])
+        elif method == 'price_percent':
+            param = str(round(rng.uniform(-0.5, 0.5), 2))
+        else:
+            param = str(rng.randint(1, 100))
+        changes.append({'name': rng.choice(names), 'method': method, 'param': param})
+    return changes
+
+
+def test_bulk_matches_rowwise_on_fixtures():
+    changes = load_changes_from_csv(UPDATE_FILE)
+    assert changes
+    assert products_after(apply_changes_bulk, changes) == products_after(apply_changes, changes)
+    assert check_bulk_matches_rowwise(PRODUCT_FILE, changes)
+
+
+def test_bulk_matches_rowwise_on_random_log():
+    for seed in range(5):
+        changes = random_changes(seed, 500)
+        rowwise = products_after(apply_changes, changes)
+        assert products_after(apply_changes_bulk, changes) == rowwise
+        assert any(counter for *_, counter in rowwise)
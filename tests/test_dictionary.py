@@ -0,0 +1,31 @@
+import json
+import sqlite3
+
+from common.dictionary import encoded_columns
+
+OUTPUTS = ['book_prices_and_places.json', 'average_price_and_sales_by_genre.json',
+           'cheapest_and_most_expensive_books.json']
+
+
+def read_outputs(workdir):
+    return {name: json.loads((workdir / name).read_text(encoding='utf-8')) for name in OUTPUTS}
+
+
+# lab4_2.py со словарным кодированием и сводками: триггеры сводки продаж на subitems читают books,
+# поэтому кодирование books не должно на них ломаться. Второй запуск раскодирует базу прежнего запуска
+def test_lab4_2_with_dictionary_and_summaries(tmp_path, run_script):
+    plain, encoded = tmp_path / 'plain', tmp_path / 'encoded'
+    plain.mkdir()
+    encoded.mkdir()
+    run_script('lab4_2.py', plain)
+    expected = read_outputs(plain)
+
+    for _ in range(2):
+        run_script('lab4_2.py', encoded, LAB4_DICTIONARY='1', LAB4_SUMMARIES='1')
+        assert read_outputs(encoded) == expected
+        conn = sqlite3.connect(encoded / 'books_and_sales.db')
+        try:
+            assert encoded_columns(conn.cursor(), 'books') == ['genre']
+            assert encoded_columns(conn.cursor(), 'subitems') == ['place']
+        finally:
+            conn.close()
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+
+from common.incremental import ANCHOR_SIZE, FULL, SKIP, TAIL, ingest_source
+from common.text_records import record_boundary
+
+RECORD = "artist::Artist {n}\nsong::Song {n}\nduration_ms::{duration}\n=====\n"
+
+
+def write_records(path, count, mode='w', first=0):
+    with open(path, mode, encoding='utf-8', newline='\n') as f:
+        for n in range(first, first + count):
+            f.write(RECORD.format(n=n, duration=100000 + n))
+
+
+# Повторная загрузка с отметкой времени изменения, отличной от прежней (правки в пределах одного тика часов
+# файловой системы иначе могут остаться незамеченными самим тестом)
+def touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def ingest(conn, path, loads):
+    return ingest_source(conn, path, lambda start, end: loads.append((start, end)), boundary=record_boundary)
+
+
+def test_edit_in_place_is_reloaded(tmp_path):
+    path = str(tmp_path / '_part_1.text')
+    write_records(path, 3000)
+    assert os.path.getsize(path) > 2 * ANCHOR_SIZE
+    conn = sqlite3.connect(':memory:')
+    loads = []
+    assert ingest(conn, path, loads) == FULL
+
+    # Правка первой записи без изменения размера файла
+    with open(path, 'r+b') as f:
+        f.seek(0)
+        f.write(b'artist::Artist X')
+    touch(path)
+    assert ingest(conn, path, loads) == FULL
+    assert loads[-1] == (0, os.path.getsize(path))
+
+    # Правка первой записи вместе с дописыванием
+    with open(path, 'r+b') as f:
+        f.seek(0)
+        f.write(b'artist::Artist Y')
+    write_records(path, 1, mode='a', first=3000)
+    touch(path)
+    assert ingest(conn, path, loads) == FULL
+    assert loads[-1] == (0, os.path.getsize(path))
+
+
+def test_append_is_tailed_and_unchanged_is_skipped(tmp_path):
+    path = str(tmp_path / '_part_1.text')
+    write_records(path, 3000)
+    conn = sqlite3.connect(':memory:')
+    loads = []
+    assert ingest(conn, path, loads) == FULL
+    loaded = os.path.getsize(path)
+
+    write_records(path, 2, mode='a', first=3000)
+    touch(path)
+    assert ingest(conn, path, loads) == TAIL
+    assert loads[-1] == (loaded, os.path.getsize(path))
+
+    touch(path)
+    assert ingest(conn, path, loads) == SKIP
+    assert len(loads) == 2
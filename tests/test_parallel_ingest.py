@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+from common.db import close_connection
+from common.parallel_ingest import insert_rows, parse_task, run_parallel_ingest
+
+INSERT_SQL = "INSERT INTO numbers (n) VALUES (?)"
+
+
+# База с таблицей numbers и строками 0..count-1
+def create_numbers_database(path, count):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE numbers (n INTEGER)")
+    conn.executemany(INSERT_SQL, [(n,) for n in range(count)])
+    conn.commit()
+    conn.close()
+
+
+def numbers(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [n for n, in conn.execute("SELECT n FROM numbers ORDER BY rowid")]
+    finally:
+        conn.close()
+
+
+# Задача, вставляющая строки first..last-1 (встроенные функции, чтобы задача передавалась в пул процессов)
+def numbers_task(first, last):
+    return parse_task(insert_rows, INSERT_SQL, zip, range(first, last))
+
+
+def test_tasks_are_loaded_in_order(tmp_path):
+    path = str(tmp_path / 'numbers.db')
+    create_numbers_database(path, 3)
+    run_parallel_ingest(path, [numbers_task(3, 10), numbers_task(10, 20), numbers_task(20, 25)], max_workers=2,
+                        max_pending=1)
+    assert numbers(path) == list(range(25))
+
+
+def test_failed_task_rolls_back(tmp_path):
+    path = str(tmp_path / 'numbers.db')
+    create_numbers_database(path, 3)
+    # Первая задача успевает попасть в поток записи до того, как падает вторая
+    tasks = [numbers_task(3, 10), parse_task(insert_rows, INSERT_SQL, int, 'not a number'), numbers_task(10, 20)]
+    try:
+        with pytest.raises(ValueError):
+            run_parallel_ingest(path, tasks, max_workers=2, max_pending=1)
+    finally:
+        close_connection(path)
+    assert numbers(path) == list(range(3))
@@ -0,0 +1,23 @@
+import sqlite3
+
+from common.query_cache import cached_query, normalize_sql
+
+
+def test_whitespace_inside_literals_is_kept():
+    assert normalize_sql("SELECT  *\n  FROM t ;") == "SELECT * FROM t"
+    assert normalize_sql("SELECT * FROM t WHERE name = 'a  b'") == "SELECT * FROM t WHERE name = 'a  b'"
+    assert normalize_sql("SELECT \"x  y\" FROM t WHERE name = 'it''s  b'") == \
+        "SELECT \"x  y\" FROM t WHERE name = 'it''s  b'"
+
+
+def test_literals_differing_in_whitespace_are_cached_apart(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'names.db'))
+    conn.execute("CREATE TABLE t (name TEXT)")
+    conn.executemany("INSERT INTO t VALUES (?)", [('a b',), ('a  b',), ('a  b',)])
+    conn.commit()
+    try:
+        for _ in range(2):
+            assert cached_query(conn, "SELECT COUNT(*) FROM t WHERE name = 'a b'") == [(1,)]
+            assert cached_query(conn, "SELECT COUNT(*) FROM t WHERE name = 'a  b'") == [(2,)]
+    finally:
+        conn.close()
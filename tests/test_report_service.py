@@ -0,0 +1,174 @@
+import asyncio
+import http.client
+import json
+import sqlite3
+import threading
+from urllib.parse import quote
+
+import pytest
+
+from common.report_service import close_service, create_service, start_server
+
+SONG_ROWS = 3000
+GENRES = ['pop', 'rock', 'hip hop', 'latin']
+
+
+# База songs со схемой task3/lab4_3.py и SONG_ROWS строками
+def create_songs_database(path):
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE songs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        artist TEXT,
+        song TEXT,
+        duration_ms INTEGER,
+        year INTEGER,
+        tempo REAL,
+        genre TEXT,
+        instrumentalness REAL,
+        explicit BOOLEAN,
+        loudness REAL)''')
+    conn.executemany(
+        "INSERT INTO songs (artist, song, duration_ms, year, tempo, genre, instrumentalness, explicit, loudness) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(f'artist {n % 50}', f'song {n}', 100000 + n * 7919 % 200000, 1990 + n % 30, 60 + n % 120,
+          GENRES[n % len(GENRES)], n % 10 / 10, n % 2, -n % 20) for n in range(SONG_ROWS)])
+    conn.commit()
+    conn.close()
+
+
+# Остановка сервера: обработчики соединений, которые ещё дописывают ответ, успевают завершиться,
+# оставшиеся отменяются
+async def stop_server(server):
+    server.close()
+    await server.wait_closed()
+    tasks = asyncio.all_tasks() - {asyncio.current_task()}
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=5)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+# Запуск сервиса на свободном порту (port=0) в отдельном потоке с циклом asyncio:
+# start(**параметры create_service) -> (состояние сервиса, порт)
+@pytest.fixture
+def start_service(tmp_path):
+    path = str(tmp_path / 'songs.db')
+    create_songs_database(path)
+    started = []
+
+    def start(**options):
+        service = create_service({'songs': path}, **options)
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(start_server(service, port=0))
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        started.append((service, loop, server, thread))
+        return service, server.sockets[0].getsockname()[1]
+
+    yield start
+    for service, loop, server, thread in started:
+        asyncio.run_coroutine_threadsafe(stop_server(server), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        close_service(service)
+
+
+# GET-запрос: (статус, Transfer-Encoding, разобранное тело)
+def get(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    try:
+        conn.request('GET', path)
+        response = conn.getresponse()
+        return response.status, response.getheader('Transfer-Encoding'), json.loads(response.read())
+    finally:
+        conn.close()
+
+
+def test_streamed_report(start_service):
+    _, port = start_service()
+    status, encoding, body = get(port, '/reports/songs/first-sorted?field=duration_ms&limit=1200')
+    assert status == 200
+    assert encoding == 'chunked'
+    assert body['report'] == 'songs/first-sorted'
+    assert body['columns'][:3] == ['id', 'artist', 'song']
+    assert len(body['rows']) == 1200
+    assert body['truncated'] is True
+    durations = [row[body['columns'].index('duration_ms')] for row in body['rows']]
+    assert durations == sorted(durations)
+
+    status, _, body = get(port, '/reports/songs/filtered?where=' + quote("genre = 'rock' AND year >= 2010")
+                          + '&limit=5000')
+    assert status == 200
+    assert body['truncated'] is False
+    assert len(body['rows']) == sum(1 for n in range(SONG_ROWS) if n % 4 == 1 and 1990 + n % 30 >= 2010)
+
+
+def test_limit_and_truncation(start_service):
+    _, port = start_service(max_rows=100)
+    status, _, body = get(port, '/reports/songs/first-sorted?limit=1000')
+    assert status == 200
+    assert len(body['rows']) == 100
+    assert body['truncated'] is True
+
+    status, _, body = get(port, '/reports/songs/aggregate?field=tempo')
+    assert status == 200
+    assert len(body['rows']) == 1
+    assert body['truncated'] is False
+
+    status, _, body = get(port, '/reports/songs/first-sorted?limit=0')
+    assert status == 200
+    assert body['rows'] == []
+    assert body['truncated'] is True
+
+    for limit in ('-1', 'many'):
+        status, _, body = get(port, f'/reports/songs/first-sorted?limit={limit}')
+        assert status == 400
+        assert 'limit' in body['error']
+
+
+def test_bad_filter(start_service):
+    _, port = start_service()
+    for query in ('where=' + quote("year > 2000; DROP TABLE songs"), 'where=' + quote("password = 'x'"),
+                  'field=password'):
+        status, _, body = get(port, f'/reports/songs/filtered?{query}')
+        assert status == 400
+        assert body['error']
+
+
+def test_unknown_report(start_service):
+    _, port = start_service()
+    status, _, body = get(port, '/reports/songs/unknown')
+    assert status == 404
+    assert 'songs/unknown' in body['error']
+
+    status, _, body = get(port, '/reports')
+    assert status == 200
+    assert 'songs/filtered' in [entry['name'] for entry in body['reports']]
+
+
+def test_pool_exhausted(start_service):
+    service, port = start_service(workers=1, timeout=0.3)
+    pool = service['pools']['songs']
+    conn = pool.acquire(1)
+    try:
+        status, _, body = get(port, '/reports/songs/first-sorted?limit=5')
+        assert status == 503
+        assert body['error']
+    finally:
+        pool.release(conn)
+    status, _, body = get(port, '/reports/songs/first-sorted?limit=5')
+    assert status == 200
+    assert len(body['rows']) == 5
+
+    _, port = start_service(max_concurrent=0)
+    status, _, body = get(port, '/reports/songs/first-sorted?limit=5')
+    assert status == 503
+
+
+def test_timeout(start_service):
+    _, port = start_service(timeout=1e-6)
+    status, _, body = get(port, '/reports/songs/filtered?where=' + quote('year > 1990') + '&field=tempo')
+    assert status == 504
+    assert body['error']